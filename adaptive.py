@@ -0,0 +1,164 @@
+"""
+This module contains the adaptive refinement of sweep grids: starting from a coarse grid,
+x values are only added where the curves change quickly or cross a threshold, until a budget
+of simulated trials is spent
+"""
+import numpy as np
+from sweep_spec import build_grid
+
+
+# Error rate above which no secret key can be extracted [%], see key_rate
+QBER_THRESHOLD = 11.0
+# Metrics whose curves steer the refinement and the row field they're divided by, so that
+# every curve lies between 0-1
+REFINEMENT_METRICS = {
+    "average_error_rate" : None,
+    "average_final_key_length" : "key_length",
+}
+
+
+def coarse_grid(x_values: list,number_of_points: int):
+    """
+    Returns:
+        x_values: list of number_of_points values spread evenly over x_values, ends included
+    """
+    x_values = sorted(x_values)
+    if number_of_points >= len(x_values):
+        return x_values
+    indices = np.linspace(0,len(x_values) - 1,max(2,number_of_points)).round().astype(int)
+    return [x_values[i] for i in dict.fromkeys(indices.tolist())]
+
+def interval_scores(x: np.ndarray,y: np.ndarray,half_width: np.ndarray = None,threshold: float = None):
+    """
+    Scores every interval between neighbouring points of a curve scaled to 0-1: the change of
+    the curve across the interval plus the error of linear interpolation, estimated from the
+    change of slope at both ends, minus what the confidence intervals explain.
+    Intervals where the curve crosses the threshold score inf, intervals ending in an unknown
+    point score 0.
+
+    Args:
+        x: float array of sorted x values
+        y: float array of the curve, NaN where unknown or masked
+        half_width: float array of the half widths of the confidence intervals of y
+        threshold: float scaled like y, or None
+    Returns:
+        scores: float array of len(x) - 1
+    """
+    y = np.asarray(y,dtype=float)
+    known = ~np.isnan(y)
+    valid = known[1:] & known[:-1]
+    step = np.diff(x)
+    change = np.where(valid,np.abs(np.diff(y)),0.0)
+    slope = np.where(valid,np.diff(y) / step,np.nan)
+    bend = np.zeros(len(step))
+    if len(step) > 1:
+        slope_change = np.nan_to_num(np.abs(np.diff(slope)))
+        bend[1:] = np.maximum(bend[1:],slope_change)
+        bend[:-1] = np.maximum(bend[:-1],slope_change)
+    scores = change + bend * step / 2
+    if half_width is not None:
+        noise = np.nan_to_num(np.asarray(half_width,dtype=float))
+        scores = np.maximum(0.0,scores - (noise[1:] + noise[:-1]))
+    if threshold is not None:
+        side = np.sign(y - threshold)
+        scores[valid & (side[1:] * side[:-1] < 0)] = np.inf
+    return scores
+
+def _curves(rows: list,results: list):
+    """
+    Groups the grid points by key length and series
+
+    Returns:
+        curves: dict of (key_length, series) : list of (x, row, results_dict) sorted by x
+    """
+    curves = {}
+    for row,results_dict in zip(rows,results):
+        curves.setdefault((row["key_length"],row["series"]),[]).append((row["x"],row,results_dict))
+    for points in curves.values():
+        points.sort(key=lambda point:point[0])
+    return curves
+
+def grid_scores(x_values: list,rows: list,results: list,threshold: float = QBER_THRESHOLD):
+    """
+    Scores every interval of the shared x grid by the worst of all curves of all
+    REFINEMENT_METRICS, the threshold applying to the error rate. Points keeping no bit at all
+    are masked from the error rate, their 100 % is Simulation.qber's sentinel rather than a
+    measured rate.
+
+    Returns:
+        scores: float array of len(x_values) - 1
+    """
+    scores = np.zeros(len(x_values) - 1)
+    for (key_length,series),points in _curves(rows,results).items():
+        x = np.array([point[0] for point in points],dtype=float)
+        for metric,scale in REFINEMENT_METRICS.items():
+            divisor = np.array([point[1][scale] if scale else 100.0 for point in points],dtype=float)
+            y = np.array([point[2].get(metric,np.nan) for point in points],dtype=float) / divisor
+            if metric == "average_error_rate":
+                no_key = np.array([point[2].get("average_final_key_length",np.nan) == 0 for point in points])
+                y[no_key] = np.nan
+            interval = [point[2].get("confidence_interval_" + metric.replace("average_",""),(np.nan,np.nan))
+                        for point in points]
+            half_width = np.array([(high - low) / 2 for low,high in interval],dtype=float) / divisor
+            limit = threshold / 100.0 if metric == "average_error_rate" and threshold is not None else None
+            scores = np.maximum(scores,interval_scores(x,y,half_width,limit))
+    return scores
+
+def refine(spec: dict,
+        config: dict,
+        run,
+        budget: int = None,
+        number_of_points: int = 5,
+        threshold: float = QBER_THRESHOLD,
+        min_step: float = 1.0,
+        tolerance: float = 0.02,
+        task_options: dict = None):
+    """
+    Adaptive sweep: the coarse grid is simulated, then in every round the midpoints of the
+    intervals scoring above tolerance are simulated, best first, as long as the budget allows.
+    The x grid is shared by every key length and series so that the curves stay comparable.
+
+    Args:
+        spec: dict, one of sweep_spec.SWEEP_SPECS, its x values bound the grid
+        config: dict, see sweep_spec.build_grid
+        run: callable simulating a list of tasks and returning their results dicts, e.g.
+             main.run_sweep
+        budget: int number of trials, by default what the uniform grid of the spec costs
+        number_of_points: int size of the coarse grid
+        threshold: float error rate [%] whose crossings are refined down to min_step, None to disable
+        min_step: float narrowest interval which is still split
+        tolerance: float score below which an interval is left alone
+        task_options: dict of further keyword arguments of create_task
+    Returns:
+        (tasks, rows, results): lists in the order of sweep_spec.build_grid, on a non-uniform grid
+    """
+    uniform = config[spec["x_values"]] if isinstance(spec["x_values"],str) else spec["x_values"]
+    # At most this many trials are run per x value, fewer with early stopping
+    trials_per_point = config["number_of_iterations_per_simulation"] * len(build_grid(dict(spec,x_values=uniform[:1]),config)[0])
+    if budget is None:
+        budget = trials_per_point * len(uniform)
+    x_type = type(uniform[0])
+    tasks,rows,results = [],[],[]
+    new_values = coarse_grid(uniform,number_of_points)
+    spent = 0
+    while new_values:
+        new_tasks,new_rows = build_grid(dict(spec,x_values=new_values),config,task_options)
+        new_results = run(new_tasks)
+        tasks += new_tasks
+        rows += new_rows
+        results += new_results
+        spent += sum(int(results_dict["number_of_trials"]) for results_dict in new_results)
+        x_values = sorted({row["x"] for row in rows})
+        scores = grid_scores(x_values,rows,results,threshold)
+        new_values = []
+        for i in np.argsort(-scores,kind="stable"):
+            # Midpoints keep the type of the x values of the spec, e.g. int efficiencies
+            midpoint = x_type(round((x_values[i] + x_values[i + 1]) / 2 / min_step) * min_step)
+            if scores[i] <= tolerance or spent + trials_per_point * (len(new_values) + 1) > budget:
+                break
+            if x_values[i + 1] - x_values[i] >= 2 * min_step and x_values[i] < midpoint < x_values[i + 1]:
+                new_values.append(midpoint)
+    key_lengths = list(config["key_lengths"])
+    order = sorted(range(len(rows)),key=lambda i:(key_lengths.index(rows[i]["key_length"]),
+                                                    rows[i]["series"],rows[i]["x"]))
+    return [tasks[i] for i in order],[rows[i] for i in order],[results[i] for i in order]
@@ -0,0 +1,247 @@
+"""
+This module contains class StreamingAggregator which keeps online statistics of simulation results
+"""
+from collections import Counter
+from statistics import NormalDist
+import numpy as np
+
+
+def wilson_interval(successes: int,trials: int,confidence: float = 0.95):
+    """
+    Wilson score interval of a binomial proportion
+
+    Returns:
+        (low, high): floats between 0-1
+    """
+    if trials == 0:
+        return 0.0,1.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    proportion = successes / trials
+    denominator = 1 + z ** 2 / trials
+    centre = (proportion + z ** 2 / (2 * trials)) / denominator
+    half_width = z * np.sqrt(proportion * (1 - proportion) / trials + z ** 2 / (4 * trials ** 2))
+    half_width /= denominator
+    return max(0.0,centre - half_width),min(1.0,centre + half_width)
+
+
+class StreamingAggregator():
+    """
+    Online statistics of per-trial results: Welford mean / variance and a histogram giving the exact
+    mode of every metric, without keeping the samples. When the results carry sifted and final key
+    lengths the pooled bit error proportion is tracked as well.
+    """
+    METRICS = ["error_rate","sifted_key_length","final_key_length"]
+    def __init__(self,metrics: list = None):
+        self.metrics = list(metrics) if metrics is not None else list(self.METRICS)
+        self.count = 0
+        self._mean = {metric:0.0 for metric in self.metrics}
+        self._m2 = {metric:0.0 for metric in self.metrics}
+        self._histogram = {metric:Counter() for metric in self.metrics}
+        self.sifted_bits = 0
+        self.erroneous_bits = 0
+    def update(self,results_dict: dict):
+        """
+        Adds a batch of trials
+
+        Args:
+            results_dict: a dict holding a float or an array of per-trial values for every metric,
+                          e.g. the one returned by Simulation.simulate_batch
+        """
+        batch_count = None
+        for metric in self.metrics:
+            raw_values = np.atleast_1d(np.asarray(results_dict[metric]))
+            values = raw_values.astype(float)
+            batch_count = len(values)
+            if batch_count == 0:
+                return
+            batch_mean = values.mean()
+            batch_m2 = ((values - batch_mean) ** 2).sum()
+            # Chan et al. combination of two Welford accumulators
+            total = self.count + batch_count
+            delta = batch_mean - self._mean[metric]
+            self._mean[metric] += delta * batch_count / total
+            self._m2[metric] += batch_m2 + delta ** 2 * self.count * batch_count / total
+            if not np.issubdtype(raw_values.dtype,np.integer):
+                # Equal error rates computed from different counts may differ in the last digits
+                raw_values = np.round(values,9)
+            keys,counts = np.unique(raw_values,return_counts=True)
+            self._histogram[metric].update(dict(zip(keys.tolist(),counts.tolist())))
+        if "sifted_key_length" in results_dict and "final_key_length" in results_dict:
+            sifted = np.sum(results_dict["sifted_key_length"])
+            self.sifted_bits += int(sifted)
+            self.erroneous_bits += int(sifted - np.sum(results_dict["final_key_length"]))
+        self.count += batch_count
+    def mean(self,metric: str):
+        """
+        Returns:
+            mean: float average of the metric
+        """
+        return self._mean[metric]
+    def variance(self,metric: str):
+        """
+        Returns:
+            variance: float sample variance of the metric
+        """
+        return self._m2[metric] / (self.count - 1) if self.count > 1 else np.inf
+    def mode(self,metric: str):
+        """
+        Returns:
+            mode: the smallest of the most frequent values, like scipy.stats.mode does
+        """
+        histogram = self._histogram[metric]
+        if not histogram:
+            return np.nan
+        most_frequent = max(histogram.values())
+        return min(value for value,count in histogram.items() if count == most_frequent)
+    def confidence_interval(self,
+                            metric: str,
+                            confidence: float = 0.95,
+                            method: str = "t",
+                            number_of_resamples: int = 1000,
+                            rng: np.random.Generator = None):
+        """
+        Confidence interval of the mean of a metric
+
+        Args:
+            method: str, "t" for Student's t interval or "bootstrap" for a percentile bootstrap,
+                    which resamples the histogram instead of the samples
+        Returns:
+            (low, high): floats
+        """
+        if self.count < 2:
+            return -np.inf,np.inf
+        if method == "t":
+            # scipy.special is imported on first use, it loads several times faster than scipy.stats
+            from scipy.special import stdtrit
+            half_width = stdtrit(self.count - 1,(1 + confidence) / 2)
+            half_width *= np.sqrt(self.variance(metric) / self.count)
+            return self.mean(metric) - half_width,self.mean(metric) + half_width
+        if method == "bootstrap":
+            rng = rng if rng is not None else np.random.default_rng()
+            values = np.array(list(self._histogram[metric].keys()))
+            counts = np.array(list(self._histogram[metric].values()))
+            resampled = rng.multinomial(self.count,counts / self.count,size=number_of_resamples)
+            means = resampled @ values / self.count
+            tail = (1 - confidence) / 2 * 100
+            low,high = np.percentile(means,[tail,100 - tail])
+            return float(low),float(high)
+        raise ValueError(f"Unknown confidence interval method {method}")
+    def pooled_error_rate(self,confidence: float = 0.95):
+        """
+        Returns:
+            (error_rate, low, high): pooled bit error rate of all sifted bits and its Wilson interval [%]
+        """
+        low,high = wilson_interval(self.erroneous_bits,self.sifted_bits,confidence)
+        error_rate = self.erroneous_bits / self.sifted_bits if self.sifted_bits else np.nan
+        return error_rate * 100.0,low * 100.0,high * 100.0
+    def converged(self,target_width: dict,confidence: float = 0.95):
+        """
+        Args:
+            target_width: dict of metric : the widest confidence interval allowed
+        Returns:
+            converged: bool, True when every interval is narrower than its target
+        """
+        for metric,width in target_width.items():
+            low,high = self.confidence_interval(metric,confidence)
+            if high - low > width:
+                return False
+        return True
+    def summary(self,confidence: float = 0.95):
+        """
+        Returns:
+            results_dict: a dict holding the statistics of every metric
+                     scheme:
+                        {
+                        "number_of_trials" : int,
+                        "average_<metric>" : float,
+                        "mode_<metric>" : float,
+                        "variance_<metric>" : float,
+                        "confidence_interval_<metric>" : (float, float),
+                        "pooled_error_rate" : float,
+                        "confidence_interval_pooled_error_rate" : (float, float)
+                        }
+        """
+        results_dict = {"number_of_trials":self.count}
+        for metric in self.metrics:
+            results_dict["average_" + metric] = self.mean(metric)
+            results_dict["mode_" + metric] = self.mode(metric)
+            results_dict["variance_" + metric] = self.variance(metric)
+            results_dict["confidence_interval_" + metric] = self.confidence_interval(metric,confidence)
+        if self.sifted_bits:
+            error_rate,low,high = self.pooled_error_rate(confidence)
+            results_dict["pooled_error_rate"] = error_rate
+            results_dict["confidence_interval_pooled_error_rate"] = (low,high)
+        return results_dict
+
+
+def run_until_converged(simulation,
+                        key_length: int,
+                        tactic: int = 0,
+                        max_iterations: int = 200,
+                        target_width: dict = None,
+                        batch_size: int = None,
+                        confidence: float = 0.95):
+    """
+    Runs Simulation.simulate_batch in batches until the confidence interval of every metric in
+    target_width is narrow enough, or max_iterations trials were run. Without target_width exactly
+    max_iterations trials are run in a single batch.
+
+    Args:
+        simulation: Simulation instance
+        key_length: int defining the initial key length
+        tactic: int defining which eve's tactic's to be used
+        max_iterations: int cap on the number of trials
+        target_width: dict of metric : the widest confidence interval allowed,
+                      e.g. {"error_rate" : 1.0, "final_key_length" : 0.5}
+        batch_size: int number of trials simulated between two convergence checks
+        confidence: float confidence level of the intervals
+    Returns:
+        results_dict: the dict returned by StreamingAggregator.summary
+    """
+    aggregator = StreamingAggregator()
+    if target_width is None:
+        batch_size = max_iterations
+    elif batch_size is None:
+        batch_size = max(2,max_iterations // 10)
+    while aggregator.count < max_iterations:
+        number_of_trials = min(batch_size,max_iterations - aggregator.count)
+        aggregator.update(simulation.simulate_batch(key_length,number_of_trials,tactic))
+        if target_width is not None and aggregator.converged(target_width,confidence):
+            break
+    return aggregator.summary(confidence)
+
+def run_branches_until_converged(simulation,
+                                 key_length: int,
+                                 branches: list,
+                                 max_iterations: int = 200,
+                                 target_width: dict = None,
+                                 batch_size: int = None,
+                                 confidence: float = 0.95,
+                                 branch_rngs: list = None):
+    """
+    Common random numbers version of run_until_converged: every batch is simulated with
+    Simulation.simulate_branches, so all branches get the same number of trials sharing Alice's
+    emission, and the batches continue until every branch has converged
+
+    Args:
+        branches: list of dicts, see Simulation.simulate_branches
+        branch_rngs: list of RandomnessBackend instances, one per branch
+    Returns:
+        results: list of the dicts returned by StreamingAggregator.summary, one per branch
+    """
+    aggregators = [StreamingAggregator() for branch in branches]
+    if target_width is None:
+        batch_size = max_iterations
+    elif batch_size is None:
+        batch_size = max(2,max_iterations // 10)
+    count = 0
+    while count < max_iterations:
+        number_of_trials = min(batch_size,max_iterations - count)
+        batch = simulation.simulate_branches(key_length,number_of_trials,branches,branch_rngs)
+        for aggregator,results_dict in zip(aggregators,batch):
+            aggregator.update(results_dict)
+        count += number_of_trials
+        if target_width is not None and all(aggregator.converged(target_width,confidence)
+                                            for aggregator in aggregators):
+            break
+    return [aggregator.summary(confidence) for aggregator in aggregators]
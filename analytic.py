@@ -0,0 +1,202 @@
+"""
+This module contains the closed form estimator of the quantities plotted by main.py
+"""
+import numpy as np
+import malfunction
+from simulation import Simulation
+
+
+# Above this key length the QBER distribution isn't tabulated exactly, the joint table holds
+# grid x (key_length + 1)^2 floats, i.e. ~130 ms for 21 grid points at the limit
+EXACT_KEY_LENGTH_LIMIT = 200
+
+def malfunction_probability(efficiency):
+    """
+    Exact chance of a device malfunction as simulated by malfunction.malfunction_mask
+
+    Args:
+        efficiency: float or array of efficiencies between 0-100
+    Returns:
+        probability: float array between 0-1
+    """
+    return np.asarray(malfunction.malfunction_probability(100 - np.asarray(efficiency,dtype=float)))
+
+def _distort(state,probability):
+    """
+    Applies a device malfunction to a photon state. state[..., b, v] is the probability of the
+    photon's base (b) and value (v) being equal to the ones Alice chose.
+    """
+    probability = probability[...,None,None]
+    return ((1 - probability) * state
+            + probability / 2 * state[...,::-1,:]
+            + probability / 2 * state[...,:,::-1])
+
+def _measure(state,same_base_as_alice: int):
+    """
+    Returns the chance of measuring Alice's value in a base which either is or isn't Alice's.
+    If the photon's base differs from the measurement base the value is a coin flip.
+    """
+    base_matches = state[...,same_base_as_alice,:]
+    base_differs = state[...,1 - same_base_as_alice,:]
+    return base_matches[...,1] + base_differs.sum(axis=-1) / 2
+
+def _resend(probability_correct,same_base_as_alice: int):
+    """
+    Returns the state of a photon resent by Eve with the value she measured
+    """
+    state = np.zeros(probability_correct.shape + (2,2))
+    state[...,same_base_as_alice,1] = probability_correct
+    state[...,same_base_as_alice,0] = 1 - probability_correct
+    return state
+
+def bit_error_probability(alice: dict,bob: dict,eve: dict,tactic: int = 0):
+    """
+    Chance of Bob's bit differing from Alice's given that their bases match.
+    Efficiencies in the config dicts can be floats or arrays, which are broadcast together.
+    Tactics 0, 2, 3 and 4 are equivalent per bit: Eve's base equals Alice's half of the time.
+    In tactic 1 Eve's resending base is independent of her measuring base.
+
+    Returns:
+        probability: float array between 0-1
+    """
+    alice_emitter = malfunction_probability(alice["emitter_efficiency"])
+    bob_detector = malfunction_probability(bob["detector_efficiency"])
+    shape = np.broadcast(alice_emitter,bob_detector).shape
+    emitted = np.zeros(shape + (2,2))
+    emitted[...,1,1] = 1
+    emitted = _distort(emitted,alice_emitter + np.zeros(shape))
+    if not eve["exists"]:
+        return 1 - _measure(_distort(emitted,bob_detector + np.zeros(shape)),1)
+    eve_emitter = malfunction_probability(eve["emitter_efficiency"])
+    eve_detector = malfunction_probability(eve["detector_efficiency"])
+    shape = np.broadcast(alice_emitter,bob_detector,eve_emitter,eve_detector).shape
+    intercepted = _distort(emitted + np.zeros(shape + (2,2)),eve_detector + np.zeros(shape))
+    probability_correct = np.zeros(shape)
+    for measuring_base in [0,1]:
+        eve_correct = _measure(intercepted,measuring_base)
+        sending_bases = [0,1] if tactic == 1 else [measuring_base]
+        for sending_base in sending_bases:
+            resent = _distort(_resend(eve_correct,sending_base),eve_emitter + np.zeros(shape))
+            received = _distort(resent,bob_detector + np.zeros(shape))
+            probability_correct += _measure(received,1) / (2 * len(sending_bases))
+    return 1 - probability_correct
+
+def _mode(values,pmf):
+    """
+    Returns the smallest of the most probable values, like scipy.stats.mode does
+    """
+    return values[np.argmax(pmf,axis=-1)]
+
+def estimate(key_length: int,alice: dict,bob: dict,eve: dict,tactic: int = 0):
+    """
+    Closed form distribution of the results of Simulation.simulate for the given configuration.
+    Every bit is sifted with a chance of 1/2 and then kept with a chance of 1 - bit error, so the
+    sifted key length is Binomial(key_length,1/2) and the final key length is
+    Binomial(key_length,(1 - bit error)/2). The error rate follows Simulation.qber, which gives
+    100 when no bit is kept. Given sifted > 0 bits it equals 100 (1 - good / sifted) even for
+    good == 0, whose mean is the bit error rate, so the average is exact in closed form:
+    bit error (1 - 2^-key_length) + 100 2^-key_length. The mode needs the joint distribution,
+    which is tabulated exactly up to EXACT_KEY_LENGTH_LIMIT and approximated by the bit error
+    rate above it.
+
+    Args:
+        key_length: int defining the initial key length
+        alice, bob, eve: config dicts, see Simulation.create_configuration_dict,
+                         efficiencies can be arrays covering a whole grid
+        tactic: int defining which eve's tactic's to be used
+    Returns:
+        results_dict: a dict holding arrays broadcast to the shape of the efficiency grid
+                 scheme:
+                    {
+                    "bit_error_rate" : float array [%],
+                    "average_error_rate" : float array [%],
+                    "mode_error_rate" : float array [%],
+                    "sifted_key_length_pmf" : float array (..., key_length + 1),
+                    "average_sifted_key_length" : float,
+                    "mode_sifted_key_length" : int,
+                    "final_key_length_pmf" : float array (..., key_length + 1),
+                    "average_final_key_length" : float array,
+                    "mode_final_key_length" : int array
+                    }
+    """
+    from scipy.stats import binom
+    bit_error = bit_error_probability(alice,bob,eve,tactic)
+    lengths = np.arange(key_length + 1)
+    sifted_pmf = binom.pmf(lengths,key_length,0.5)
+    keep = (1 - bit_error) / 2
+    final_pmf = binom.pmf(lengths,key_length,keep[...,None])
+    nothing_sifted = 0.5 ** key_length
+    results_dict = {
+        "bit_error_rate" : bit_error * 100.0,
+        "average_error_rate" : bit_error * 100.0 * (1 - nothing_sifted) + 100.0 * nothing_sifted,
+        "sifted_key_length_pmf" : sifted_pmf,
+        "average_sifted_key_length" : key_length / 2,
+        "mode_sifted_key_length" : int(_mode(lengths,sifted_pmf)),
+        "final_key_length_pmf" : final_pmf,
+        "average_final_key_length" : key_length * keep,
+        "mode_final_key_length" : _mode(lengths,final_pmf),
+    }
+    if key_length > EXACT_KEY_LENGTH_LIMIT:
+        results_dict["mode_error_rate"] = bit_error * 100.0
+        return results_dict
+    # Joint distribution of (sifted, good) bits and the error rate Simulation.qber reports for it
+    sifted,good = np.meshgrid(lengths,lengths,indexing='ij')
+    joint_pmf = sifted_pmf[:,None] * binom.pmf(good,sifted,1 - bit_error[...,None,None])
+    error_rate = np.full(sifted.shape,100.0)
+    usable = (good > 0) & (good <= sifted)
+    error_rate[usable] = (1 - good[usable] / sifted[usable]) * 100.0
+    # Equal rates (e.g. 1/2 and 2/4) are merged before taking the mode
+    rates,index = np.unique(np.round(error_rate,9),return_inverse=True)
+    rate_pmf = np.zeros(bit_error.shape + rates.shape)
+    np.add.at(rate_pmf,(...,index.reshape(error_rate.shape)),joint_pmf)
+    results_dict["mode_error_rate"] = _mode(rates,rate_pmf)
+    return results_dict
+
+def validate(key_length: int,
+            alice: dict,
+            bob: dict,
+            eve: dict,
+            tactic: int = 0,
+            number_of_trials: int = 200,
+            rng = None,
+            threshold: float = 4.0):
+    """
+    Compares estimate with a Monte Carlo run of the same scalar configuration, so that the
+    simulation budget can be spent only where the two disagree
+
+    Args:
+        threshold: float, number of standard errors above which the averages disagree
+        rng: RandomnessBackend passed to Simulation
+    Returns:
+        results_dict: a dict holding both estimates and their z-scores
+                 scheme:
+                    {
+                    "analytic" : dict returned by estimate,
+                    "simulated_average_error_rate" : float,
+                    "simulated_average_final_key_length" : float,
+                    "error_rate_z_score" : float,
+                    "final_key_length_z_score" : float,
+                    "agrees" : bool
+                    }
+    """
+    analytic = estimate(key_length,alice,bob,eve,tactic)
+    sim = Simulation(alice,bob,eve,rng=rng)
+    simulated = sim.simulate_batch(key_length,number_of_trials,tactic)
+    z_scores = []
+    for name,samples in [("error_rate",simulated["error_rate"]),
+                         ("final_key_length",simulated["final_key_length"])]:
+        standard_error = np.std(samples,ddof=1) / np.sqrt(number_of_trials) if number_of_trials > 1 else 0
+        difference = np.mean(samples) - float(analytic["average_" + name])
+        if standard_error == 0:
+            z_scores.append(0.0 if abs(difference) < 1e-9 else np.inf)
+        else:
+            z_scores.append(abs(difference) / standard_error)
+    results_dict = {
+        "analytic" : analytic,
+        "simulated_average_error_rate" : float(np.mean(simulated["error_rate"])),
+        "simulated_average_final_key_length" : float(np.mean(simulated["final_key_length"])),
+        "error_rate_z_score" : z_scores[0],
+        "final_key_length_z_score" : z_scores[1],
+        "agrees" : max(z_scores) <= threshold
+    }
+    return results_dict
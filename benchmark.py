@@ -0,0 +1,388 @@
+"""
+Benchmark suite which times the stages of the simulation and saves machine readable baselines
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from human import Human
+from randomness import create_backend
+from privacy_amplification import amplify
+from reconciliation import binary_entropy,reconcile
+from simulation import Simulation
+
+
+# CONFIG for changing the benchmarked cases, the key lengths above the limit of a backend or an
+# engine are skipped
+BENCHMARK_CONFIG = {                                    # possible value ranges / types
+    "key_lengths" : [10,100,1000,10000,100000,1000000], # [1,inf) : int
+    "eavesdropping" : [False,True],                     # False or True : bool
+    "eve_tactic" : [0,1,2,3,4],                         # [0,4] : int
+    "engines" : ["photon","vector"],                    # "photon" or "vector" : str
+    "number_of_trials" : 100,                           # [1,inf) : int, trials per simulate_batch
+    "randomness_backend" : "numpy",                     # "aer", "numpy" or "urandom" : str
+    "seed" : 0,                                         # int or None
+    "min_time" : 0.2,                                   # [0,inf) : float, seconds per case
+    "max_repeats" : 5,                                  # [1,inf) : int
+    "import_modules" : ["simulation","sweep","main","cli"], # modules whose import time is tracked
+    "reconciliation_methods" : ["cascade","ldpc"],      # "cascade" or "ldpc" : str
+    "reconciliation_error_rate" : 0.03,                 # (0,0.5) : float
+}
+
+# Longest key simulated per backend and per engine in a reasonable time
+MAX_KEY_LENGTH = {"aer":10000,"numpy":1000000,"urandom":1000000}
+MAX_PHOTON_KEY_LENGTH = 100000
+# Human.device_malfunction is called once per photon, its cases are capped separately
+MAX_MALFUNCTION_CALLS = 100000
+
+
+def measure(function,setup=None,min_time: float = 0.2,max_repeats: int = 5):
+    """
+    Times a function, the best of several runs is kept. Peak memory is measured in an extra
+    run under tracemalloc, so that its overhead doesn't distort the timing.
+
+    Args:
+        function: callable taking the value returned by setup, or nothing if there's no setup
+        setup: callable preparing the input of every run, not included in the timing
+        min_time: float, runs are repeated until this many seconds were spent
+        max_repeats: int cap on the number of timed runs
+    Returns:
+        (seconds, peak_memory, repeats): float best wall time, int bytes, int number of runs
+    """
+    def run_once():
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is None:
+            function()
+        else:
+            function(argument)
+        return time.perf_counter() - start
+    timings = [run_once()]
+    while sum(timings) < min_time and len(timings) < max_repeats:
+        timings.append(run_once())
+    argument = setup() if setup is not None else None
+    tracemalloc.start()
+    try:
+        if setup is None:
+            function()
+        else:
+            function(argument)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(timings),peak_memory,len(timings)
+
+def _record(name: str,key_length: int,timing: tuple,photons: int,trials: int = 1,**case):
+    """
+    Creates the results dict of a single benchmarked case
+    """
+    seconds,peak_memory,repeats = timing
+    record = {
+        "name" : name,
+        "key_length" : key_length,
+        "seconds" : seconds,
+        "photons_per_second" : photons / seconds if seconds > 0 else float("inf"),
+        "trials_per_second" : trials / seconds if seconds > 0 else float("inf"),
+        "peak_memory_bytes" : peak_memory,
+        "repeats" : repeats,
+    }
+    record.update(case)
+    return record
+
+def human_benchmarks(key_length: int,rng,min_time: float,max_repeats: int):
+    """
+    Times Human.send, Human.receive, Human.randomize_number and Human.device_malfunction
+
+    Returns:
+        records: list of results dicts
+    """
+    timing_options = {"min_time":min_time,"max_repeats":max_repeats}
+    records = []
+    def fresh_sender():
+        sender = Human(key_length,emitter_efficiency=90.0,rng=rng)
+        sender.key = sender.convert_decimal_to_binary_str(sender.randomize_number(key_length),key_length)
+        sender.base = sender.convert_decimal_to_binary_str(sender.randomize_number(key_length),key_length)
+        return sender
+    timing = measure(lambda sender: sender.send(),fresh_sender,**timing_options)
+    records.append(_record("Human.send",key_length,timing,key_length))
+    def fresh_beam():
+        return Human(detector_efficiency=90.0,rng=rng),fresh_sender().send()
+    timing = measure(lambda arguments: arguments[0].receive(arguments[1]),fresh_beam,**timing_options)
+    records.append(_record("Human.receive",key_length,timing,key_length))
+    human = Human(key_length,rng=rng)
+    timing = measure(lambda: human.randomize_number(key_length),**timing_options)
+    records.append(_record("Human.randomize_number",key_length,timing,key_length))
+    if key_length <= MAX_MALFUNCTION_CALLS:
+        def malfunctions():
+            for i in range(key_length):
+                human.device_malfunction(10.0)
+        timing = measure(malfunctions,**timing_options)
+        records.append(_record("Human.device_malfunction",key_length,timing,key_length))
+    return records
+
+def qber_benchmark(key_length: int,rng,min_time: float,max_repeats: int):
+    """
+    Times Simulation.qber on a finished exchange between two Human instances
+
+    Returns:
+        record: results dict
+    """
+    alice = Human(key_length,rng=rng)
+    bob = Human(rng=rng)
+    bob.receive(alice.send())
+    sim = Simulation(rng=rng,eve={"exists":False})
+    timing = measure(lambda: sim.qber(alice,bob),min_time=min_time,max_repeats=max_repeats)
+    return _record("Simulation.qber",key_length,timing,key_length)
+
+def simulation_benchmarks(key_length: int,rng,config: dict = None):
+    """
+    Times Simulation.simulate for every engine and Simulation.simulate_batch, without Eve and
+    with Eve using every tactic
+
+    Returns:
+        records: list of results dicts
+    """
+    config = config if config is not None else BENCHMARK_CONFIG
+    timing_options = {"min_time":config["min_time"],"max_repeats":config["max_repeats"]}
+    alice = Simulation.create_configuration_dict(emitter_efficiency=95)
+    bob = Simulation.create_configuration_dict(detector_efficiency=95)
+    records = []
+    for eavesdropper in config["eavesdropping"]:
+        eve = Simulation.create_configuration_dict(95,95,eavesdropper)
+        sim = Simulation(alice,bob,eve,rng=rng)
+        for tactic in config["eve_tactic"] if eavesdropper else [0]:
+            case = {"eve":eavesdropper,"tactic":tactic if eavesdropper else None}
+            for engine in config["engines"]:
+                if engine == "photon" and key_length > MAX_PHOTON_KEY_LENGTH:
+                    continue
+                timing = measure(lambda: sim.simulate(key_length,tactic,engine),**timing_options)
+                records.append(_record("Simulation.simulate",key_length,timing,key_length,
+                                       engine=engine,**case))
+            number_of_trials = config["number_of_trials"]
+            # The trial x bit matrices of a batch are held in memory at once
+            number_of_trials = max(1,min(number_of_trials,10 ** 7 // key_length))
+            timing = measure(lambda: sim.simulate_batch(key_length,number_of_trials,tactic),
+                             **timing_options)
+            records.append(_record("Simulation.simulate_batch",key_length,timing,
+                                   key_length * number_of_trials,number_of_trials,**case))
+    return records
+
+def reconciliation_benchmarks(key_length: int,rng,config: dict = None):
+    """
+    Times reconcile on a single core for a sifted key of key_length bits with the configured
+    error rate, photons_per_second is then the number of sifted bits reconciled per second
+
+    Returns:
+        records: list of results dicts
+    """
+    config = config if config is not None else BENCHMARK_CONFIG
+    error_rate = config["reconciliation_error_rate"]
+    alice_key = rng.random_bits(key_length)
+    bob_key = alice_key ^ rng.bernoulli(error_rate,key_length).astype(np.uint8)
+    records = []
+    for method in config["reconciliation_methods"]:
+        results = []
+        def run():
+            results.append(reconcile(alice_key,bob_key,error_rate,method,max_workers=1,seed=0))
+        timing = measure(run,min_time=config["min_time"],max_repeats=config["max_repeats"])
+        records.append(_record("reconcile",key_length,timing,key_length,engine=method,
+                               leaked_bits=results[-1]["leaked_bits"],
+                               efficiency=results[-1]["efficiency"],
+                               failed_frames=results[-1]["failed_frames"]))
+    records.append(privacy_amplification_benchmark(alice_key,error_rate,config))
+    return records
+
+def privacy_amplification_benchmark(key: np.ndarray,error_rate: float,config: dict = None):
+    """
+    Times amplify on a reconciled key, leaking the bits Cascade would leak at its usual efficiency
+
+    Returns:
+        record: results dict
+    """
+    config = config if config is not None else BENCHMARK_CONFIG
+    leaked_bits = 1.2 * len(key) * binary_entropy(error_rate)
+    results = []
+    timing = measure(lambda: results.append(amplify(key,error_rate,leaked_bits,seed=0)),
+                     min_time=config["min_time"],max_repeats=config["max_repeats"])
+    return _record("amplify",len(key),timing,len(key),
+                   secret_key_length=results[-1]["secret_key_length"],
+                   number_of_blocks=len(results[-1]["block_output_length"]))
+
+def startup_benchmarks(modules: list,max_repeats: int = 3):
+    """
+    Times a fresh interpreter importing every module, and a numpy backed simulation run through
+    the command line, peak memory isn't tracked for other processes
+
+    Returns:
+        records: list of results dicts
+    """
+    commands = [(f"import {module}",0,[sys.executable,"-c",f"import {module}"]) for module in modules]
+    key_length = 1000
+    commands.append(("python -m cli simulate",key_length,
+                     [sys.executable,"-m","cli","simulate","--backend","numpy",
+                      "--key-length",str(key_length)]))
+    records = []
+    for name,photons,command in commands:
+        def run_command():
+            subprocess.run(command,check=True,stdout=subprocess.DEVNULL)
+        timings = []
+        for i in range(max_repeats):
+            start = time.perf_counter()
+            run_command()
+            timings.append(time.perf_counter() - start)
+        records.append(_record(name,photons,(min(timings),0,len(timings)),photons))
+    return records
+
+def run_benchmarks(config: dict = None,verbose: bool = True):
+    """
+    Runs every benchmark for every key length of the config
+
+    Returns:
+        records: list of results dicts
+    """
+    config = config if config is not None else BENCHMARK_CONFIG
+    rng = create_backend(config["randomness_backend"],config["seed"])
+    limit = MAX_KEY_LENGTH.get(config["randomness_backend"],max(config["key_lengths"]))
+    records = startup_benchmarks(config["import_modules"],config["max_repeats"])
+    if verbose:
+        for record in records:
+            print(format_record(record))
+    for key_length in config["key_lengths"]:
+        if key_length > limit:
+            continue
+        new_records = []
+        if key_length <= MAX_PHOTON_KEY_LENGTH:
+            new_records += human_benchmarks(key_length,rng,config["min_time"],config["max_repeats"])
+            new_records.append(qber_benchmark(key_length,rng,config["min_time"],config["max_repeats"]))
+        new_records += simulation_benchmarks(key_length,rng,config)
+        new_records += reconciliation_benchmarks(key_length,rng,config)
+        if verbose:
+            for record in new_records:
+                print(format_record(record))
+        records += new_records
+    return records
+
+def format_record(record: dict):
+    """
+    Returns:
+        line: str, human readable summary of a results dict
+    """
+    case = record["name"]
+    if record.get("engine") is not None:
+        case += f" [{record['engine']}]"
+    if record.get("eve") is not None:
+        case += f" eve={record['eve']} tactic={record['tactic']}"
+    return (f"{case:<55} n={record['key_length']:<8} {record['seconds'] * 1e3:10.3f} ms "
+            f"{record['photons_per_second']:14.0f} photons/s {record['trials_per_second']:10.1f} trials/s "
+            f"{record['peak_memory_bytes'] / 2 ** 20:8.2f} MiB")
+
+def _git_commit():
+    """
+    Returns the current commit hash, or None outside of a git repository
+    """
+    try:
+        output = subprocess.run(["git","rev-parse","--short","HEAD"],capture_output=True,
+                                text=True,check=True)
+    except (OSError,subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+def case_key(record: dict):
+    """
+    Returns:
+        key: tuple identifying the benchmarked case of a results dict across runs
+    """
+    return (record["name"],record["key_length"],record.get("engine"),record.get("eve"),
+            record.get("tactic"))
+
+def save_baseline(records: list,path: str,config: dict = None):
+    """
+    Writes the results together with the environment they were measured in as JSON
+    """
+    baseline = {
+        "commit" : _git_commit(),
+        "created" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "machine" : platform.platform(),
+        "config" : config if config is not None else BENCHMARK_CONFIG,
+        "results" : records,
+    }
+    with open(path,'w',encoding='utf-8') as file:
+        json.dump(baseline,file,indent=2)
+
+def load_baseline(path: str):
+    """
+    Returns:
+        baseline: dict written by save_baseline
+    """
+    with open(path,'r',encoding='utf-8') as file:
+        return json.load(file)
+
+def compare(baseline: dict,records: list,tolerance: float = 0.2):
+    """
+    Compares the results with a baseline case by case
+
+    Args:
+        baseline: dict returned by load_baseline
+        records: list of results dicts
+        tolerance: float, relative slow down or memory growth regarded as a regression
+    Returns:
+        comparison: list of dicts holding the ratios of every case found in both
+                 scheme:
+                    {
+                    "case" : tuple,
+                    "time_ratio" : float,
+                    "memory_ratio" : float,
+                    "regression" : bool
+                    }
+    """
+    previous = {case_key(record):record for record in baseline["results"]}
+    comparison = []
+    for record in records:
+        old = previous.get(case_key(record))
+        if old is None:
+            continue
+        time_ratio = record["seconds"] / old["seconds"] if old["seconds"] > 0 else 1.0
+        memory_ratio = (record["peak_memory_bytes"] / old["peak_memory_bytes"]
+                        if old["peak_memory_bytes"] > 0 else 1.0)
+        comparison.append({
+            "case" : case_key(record),
+            "time_ratio" : time_ratio,
+            "memory_ratio" : memory_ratio,
+            "regression" : time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance,
+        })
+    return comparison
+
+def main():
+    """
+    Runs the benchmarks, saves a baseline and optionally compares it with a previous one
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--key-lengths",type=int,nargs='+',default=BENCHMARK_CONFIG["key_lengths"])
+    parser.add_argument("--backend",default=BENCHMARK_CONFIG["randomness_backend"],
+                        choices=sorted(MAX_KEY_LENGTH))
+    parser.add_argument("--output",default=None,help="defaults to benchmark_<commit>.json")
+    parser.add_argument("--compare",default=None,help="baseline JSON to compare with")
+    parser.add_argument("--tolerance",type=float,default=0.2)
+    arguments = parser.parse_args()
+    config = dict(BENCHMARK_CONFIG,key_lengths=arguments.key_lengths,
+                  randomness_backend=arguments.backend)
+    records = run_benchmarks(config)
+    output = arguments.output or f"benchmark_{_git_commit() or 'baseline'}.json"
+    save_baseline(records,output,config)
+    print(f"Saved {len(records)} results to {output}")
+    if arguments.compare is not None:
+        comparison = compare(load_baseline(arguments.compare),records,arguments.tolerance)
+        regressions = [entry for entry in comparison if entry["regression"]]
+        for entry in regressions:
+            print(f"REGRESSION {entry['case']}: {entry['time_ratio']:.2f}x time, "
+                  f"{entry['memory_ratio']:.2f}x memory")
+        print(f"{len(regressions)} regressions in {len(comparison)} compared cases")
+
+if __name__ == "__main__":
+    main()
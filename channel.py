@@ -0,0 +1,176 @@
+"""
+This module contains the lossy fibre channel: class Detections and class Channel
+"""
+import math
+import numpy as np
+import instrumentation
+from malfunction import fault_indices
+from randomness import RandomnessBackend
+from vector_engine import Beam
+
+
+class Detections():
+    """
+    Sparse photon beam: only the pulses which weren't lost are stored, as the sorted int64 pulse
+    indices together with a Beam holding their bases and values. Memory and sifting therefore
+    scale with the number of detections instead of the number of emitted pulses.
+    dark is True for the events caused by a dark count rather than by a photon.
+    """
+    def __init__(self,index: np.ndarray,beam: Beam,number_of_pulses: int,dark: np.ndarray = None):
+        if len(index) != len(beam):
+            raise ValueError("Index and beam have to be of the same length")
+        self.index = np.asarray(index,dtype=np.int64)
+        self.beam = beam
+        self.number_of_pulses = number_of_pulses
+        self.dark = dark if dark is not None else np.zeros(len(index),dtype=bool)
+    def __len__(self):
+        return len(self.index)
+    def subset(self,mask: np.ndarray):
+        """
+        Returns the Detections selected by a bool mask or an index array
+        """
+        return Detections(self.index[mask],
+                          Beam(self.beam.base[mask],self.beam.value[mask]),
+                          self.number_of_pulses,
+                          self.dark[mask])
+
+
+def dead_time_mask(index: np.ndarray,dead_time_pulses: float):
+    """
+    Removes the clicks falling into the dead time of the previous registered click. The first
+    click which isn't blinded by each click is found with a single vectorized search, registered
+    clicks are then a walk along these links, so the Python loop only visits registered clicks.
+
+    Args:
+        index: sorted int64 array of click pulse indices
+        dead_time_pulses: float length of the dead time in pulse periods
+    Returns:
+        keep: bool array, False for the clicks lost in the dead time
+    """
+    if dead_time_pulses <= 0 or len(index) < 2 or np.all(np.diff(index) >= dead_time_pulses):
+        return np.ones(len(index),dtype=bool)
+    following = np.searchsorted(index,index + dead_time_pulses).tolist()
+    registered = []
+    position = 0
+    while position < len(index):
+        registered.append(position)
+        position = following[position]
+    keep = np.zeros(len(index),dtype=bool)
+    keep[registered] = True
+    return keep
+
+
+class Channel():
+    """
+    Optical fibre between an emitter and a detector with distance based attenuation followed by
+    a detector with a quantum efficiency, dark counts and a dead time. It works on the arrival
+    side only: pulses are lost with probability 1 - transmittance, dark counts add clicks with a
+    random base and value, and clicks within the dead time of a previous click are dropped.
+    The detector_efficiency of Human / VectorHuman still models the malfunctions of a detected
+    photon independently of the channel.
+    """
+    def __init__(self,
+                length: float = 0.0,
+                attenuation: float = 0.2,
+                detection_efficiency: float = 1.0,
+                dark_count_rate: float = 0.0,
+                dead_time: float = 0.0,
+                pulse_rate: float = 1e6):
+        """
+        Args:
+            length: float length of the fibre [km]
+            attenuation: float loss of the fibre [dB/km]
+            detection_efficiency: float between 0-1 equal to the chance that an arriving photon clicks
+            dark_count_rate: float rate of the clicks without a photon [Hz]
+            dead_time: float time the detector is blind after a click [s]
+            pulse_rate: float number of pulses emitted per second [Hz]
+        """
+        self.length = length
+        self.attenuation = attenuation
+        self.detection_efficiency = detection_efficiency
+        self.dark_count_rate = dark_count_rate
+        self.dead_time = dead_time
+        self.pulse_rate = pulse_rate
+    @property
+    def transmittance(self):
+        """
+        Chance that an emitted photon makes the detector click
+        """
+        return 10 ** (-self.attenuation * self.length / 10) * self.detection_efficiency
+    @property
+    def dark_count_probability(self):
+        """
+        Chance of at least one dark count within a pulse period
+        """
+        return -math.expm1(-self.dark_count_rate / self.pulse_rate)
+    @property
+    def dead_time_pulses(self):
+        """
+        Length of the dead time in pulse periods
+        """
+        return self.dead_time * self.pulse_rate
+    def split(self,position: float):
+        """
+        Cuts the fibre where an eavesdropper taps it. She's assumed to have an ideal detector,
+        the receiving detector stays on the second part.
+
+        Args:
+            position: float between 0-1, fraction of the length before the eavesdropper
+        Returns:
+            (first, second): Channel instances
+        """
+        first = Channel(self.length * position,self.attenuation,pulse_rate=self.pulse_rate)
+        second = Channel(self.length * (1 - position),self.attenuation,self.detection_efficiency,
+                         self.dark_count_rate,self.dead_time,self.pulse_rate)
+        return first,second
+    @instrumentation.timed("Channel.arrivals")
+    def arrivals(self,rng: RandomnessBackend,number_of_pulses: int):
+        """
+        Draws which of number_of_pulses emitted pulses aren't lost without materializing the
+        pulses, the cost scales with the number of arrivals
+
+        Returns:
+            index: sorted int64 array of the arriving pulses
+        """
+        if self.transmittance >= 1:
+            return np.arange(number_of_pulses,dtype=np.int64)
+        return fault_indices(rng,self.transmittance,number_of_pulses)
+    @instrumentation.timed("Channel.transmit")
+    def transmit(self,rng: RandomnessBackend,pulses: Detections):
+        """
+        Applies the loss of the fibre to pulses which are already sparse, e.g. resent by Eve
+        """
+        if self.transmittance >= 1:
+            return pulses
+        return pulses.subset(rng.bernoulli(self.transmittance,len(pulses)))
+    @instrumentation.timed("Channel.detect")
+    def detect(self,rng: RandomnessBackend,arrived: Detections):
+        """
+        Adds the dark counts to the arriving photons and removes the clicks lost in dead time.
+        A dark count in a pulse period which holds a photon as well is ignored.
+
+        Args:
+            rng: RandomnessBackend used for the draws
+            arrived: Detections of the photons reaching the detector
+        Returns:
+            detections: Detections of the registered clicks
+        """
+        number_of_pulses = arrived.number_of_pulses
+        dark_index = fault_indices(rng,self.dark_count_probability,number_of_pulses)
+        dark_index = dark_index[~np.isin(dark_index,arrived.index,assume_unique=True)]
+        if len(dark_index):
+            index = np.concatenate((arrived.index,dark_index))
+            base = np.concatenate((arrived.beam.base,rng.random_bits(len(dark_index))))
+            value = np.concatenate((arrived.beam.value,rng.random_bits(len(dark_index))))
+            dark = np.concatenate((arrived.dark,np.ones(len(dark_index),dtype=bool)))
+            order = np.argsort(index,kind="stable")
+            detections = Detections(index[order],Beam(base[order],value[order]),number_of_pulses,dark[order])
+        else:
+            detections = arrived
+        keep = dead_time_mask(detections.index,self.dead_time_pulses)
+        if not keep.all():
+            detections = detections.subset(keep)
+        if instrumentation.enabled():
+            instrumentation.count("dark_counts",len(dark_index))
+            instrumentation.count("dead_time_losses",int(np.count_nonzero(~keep)))
+        return detections
@@ -0,0 +1,322 @@
+"""
+Headless command line entry point running a single simulation or a sweep, e.g.
+
+    python -m cli simulate --key-length 100000 --engine vector --eve 100 100 --tactic 1
+    python -m cli simulate --key-length 1000000000 --distance 100 --detection-efficiency 0.1
+    python -m cli stream --pulses 100000000 --alice 97 --bob 97 --final-output final.bin
+    python -m cli sweep system --key-lengths 20 10 --iterations 100 --plot
+    python -m cli sweep system --adaptive --budget 20000 --threshold 11
+    python -m cli key-rate system --key-lengths 10000 100000000 --plot
+    python -m cli replot sweep_system.npz
+    python -m cli import-time
+
+Heavy dependencies are only imported when they're used: qiskit with the "aer" backend, scipy
+when confidence intervals are computed and matplotlib when plotting is requested.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+
+SWEEPS = {
+    "detector" : "detector_efficiency_tests",
+    "emitter" : "emitter_efficiency_tests",
+    "system" : "system_efficiency_tests",
+    "eve_tactic" : "eve_tactics_test",
+}
+SCALAR_TYPES = (bool,int,float,str,type(None))
+
+
+def _scalars(results_dict: dict):
+    """
+    Returns the JSON serializable scalar fields of a results dict
+    """
+    scalars = {}
+    for key,value in results_dict.items():
+        if hasattr(value,"item") and getattr(value,"ndim",1) == 0:
+            value = value.item()
+        if isinstance(value,SCALAR_TYPES):
+            scalars[key] = value
+        elif isinstance(value,(tuple,list)) and all(isinstance(item,(int,float)) for item in value):
+            scalars[key] = [item if isinstance(item,int) else float(item) for item in value]
+    return scalars
+
+def simulate(arguments):
+    """
+    Runs a single simulation and prints its scalar results as JSON
+    """
+    if arguments.reconcile is not None and arguments.trials is not None:
+        raise ValueError("--reconcile needs the sifted keys of a single simulation, not --trials")
+    if arguments.privacy_amplification and arguments.reconcile is None:
+        raise ValueError("--privacy-amplification compresses the reconciled key, it needs --reconcile")
+    from randomness import create_backend
+    from simulation import Simulation
+    alice = Simulation.create_configuration_dict(emitter_efficiency=arguments.alice)
+    bob = Simulation.create_configuration_dict(detector_efficiency=arguments.bob)
+    if arguments.eve is None:
+        eve = Simulation.create_configuration_dict(exists=False)
+    else:
+        eve = Simulation.create_configuration_dict(arguments.eve[0],arguments.eve[1],True)
+    sim = Simulation(alice,bob,eve,rng=create_backend(arguments.backend,arguments.seed))
+    start = time.perf_counter()
+    if arguments.distance is not None:
+        from channel import Channel
+        channel = Channel(arguments.distance,arguments.attenuation,arguments.detection_efficiency,
+                          arguments.dark_count_rate,arguments.dead_time,arguments.pulse_rate)
+        results_dict = full_results = sim.simulate_lossy(arguments.key_length,channel,arguments.tactic,
+                                                         arguments.eve_position)
+        results_dict = {key:results_dict[key] for key in
+                        ["error_rate","sifted_key_length","final_key_length","number_of_pulses",
+                         "detections","dark_counts","detection_rate","tactic"]}
+    elif arguments.trials is None:
+        results_dict = full_results = sim.simulate(arguments.key_length,arguments.tactic,arguments.engine)
+        if arguments.keys:
+            results_dict = dict(results_dict)
+        else:
+            results_dict = {key:results_dict[key] for key in
+                            ["error_rate","sifted_key_length","final_key_length","tactic"]}
+    else:
+        results_dict = sim.simulate_batch(arguments.key_length,arguments.trials,arguments.tactic)
+        results_dict = {
+            "average_error_rate" : float(results_dict["error_rate"].mean()),
+            "average_sifted_key_length" : float(results_dict["sifted_key_length"].mean()),
+            "average_final_key_length" : float(results_dict["final_key_length"].mean()),
+            "number_of_trials" : arguments.trials,
+            "tactic" : results_dict["tactic"],
+        }
+    results_dict["seconds"] = time.perf_counter() - start
+    if arguments.reconcile is not None:
+        from reconciliation import reconcile_results
+        reconciliation = reconcile_results(full_results,arguments.reconcile,max_workers=arguments.workers,
+                                           seed=arguments.seed)
+        results_dict.update({"reconciliation_" + key:value for key,value in _scalars(reconciliation).items()})
+        if arguments.privacy_amplification:
+            from privacy_amplification import amplify_results
+            amplification = amplify_results(reconciliation,min(full_results["error_rate"],100.0) / 100.0,
+                                            seed=arguments.seed)
+            results_dict.update({"privacy_amplification_" + key:value
+                                 for key,value in _scalars(amplification).items()})
+            results_dict["privacy_amplification_block_output_length"] = amplification["block_output_length"].tolist()
+            results_dict["privacy_amplification_block_throughput"] = amplification["block_throughput"].tolist()
+    print(json.dumps(_scalars(results_dict),indent=2))
+
+def stream(arguments):
+    """
+    Runs a long simulation block by block with bounded memory, printing the statistics of every
+    block as a JSON line as soon as it's done
+    """
+    from randomness import create_backend
+    from simulation import Simulation
+    from streaming import MemmapKeyFile,stream as stream_blocks
+    alice = Simulation.create_configuration_dict(emitter_efficiency=arguments.alice)
+    bob = Simulation.create_configuration_dict(detector_efficiency=arguments.bob)
+    if arguments.eve is None:
+        eve = Simulation.create_configuration_dict(exists=False)
+    else:
+        eve = Simulation.create_configuration_dict(arguments.eve[0],arguments.eve[1],True)
+    sim = Simulation(alice,bob,eve,rng=create_backend(arguments.backend,arguments.seed))
+    channel = None
+    if arguments.distance is not None:
+        from channel import Channel
+        channel = Channel(arguments.distance,arguments.attenuation,arguments.detection_efficiency,
+                          arguments.dark_count_rate,arguments.dead_time,arguments.pulse_rate)
+    sinks = [MemmapKeyFile(path,arguments.pulses) if path is not None else None
+             for path in (arguments.sifted_output,arguments.final_output)]
+    try:
+        for block_dict in stream_blocks(sim,arguments.pulses,arguments.block_size,arguments.tactic,
+                                        channel,arguments.eve_position,*sinks):
+            print(json.dumps(block_dict),flush=True)
+    finally:
+        for sink in sinks:
+            if sink is not None:
+                sink.close()
+
+def sweep(arguments):
+    """
+    Runs one of the sweeps of main.py, plotting it only when asked to, and writes the scalar
+    results of every grid point as JSON lines
+    """
+    import main
+    main.CONFIG.update({
+        "randomness_backend" : arguments.backend,
+        "seed" : arguments.seed,
+        "number_of_workers" : arguments.workers,
+        "cache_path" : None if arguments.no_cache else arguments.cache_path,
+        "instrumentation" : arguments.instrument,
+        "common_random_numbers" : arguments.common_random_numbers,
+    })
+    if arguments.key_lengths is not None:
+        main.CONFIG["key_lengths"] = arguments.key_lengths
+    if arguments.iterations is not None:
+        main.CONFIG["number_of_iterations_per_simulation"] = arguments.iterations
+    if arguments.dataset is not None:
+        main.CONFIG["dataset_path"] = arguments.dataset
+    if arguments.adaptive:
+        main.CONFIG.update({
+            "adaptive_budget" : arguments.budget,
+            "adaptive_threshold" : arguments.threshold,
+        })
+        tasks,results = main.run_adaptive(arguments.kind,plot=arguments.plot)
+    else:
+        tasks,results = getattr(main,SWEEPS[arguments.kind])(plot=arguments.plot)
+    output = open(arguments.output,'w',encoding='utf-8') if arguments.output else sys.stdout
+    try:
+        for task,results_dict in zip(tasks,results):
+            output.write(json.dumps({"task":task,"results":_scalars(results_dict)}) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+def key_rate(arguments):
+    """
+    Evaluates the secret key rate bounds on the grid of one of the sweeps of main.py and writes
+    every grid point as JSON lines
+    """
+    import main
+    main.CONFIG.update({
+        "number_of_workers" : arguments.workers,
+        "security_parameter" : arguments.security_parameter,
+        "reconciliation_efficiency" : arguments.reconciliation_efficiency,
+    })
+    if arguments.key_lengths is not None:
+        main.CONFIG["key_rate_key_lengths"] = arguments.key_lengths
+    if arguments.dataset is not None:
+        main.CONFIG["dataset_path"] = arguments.dataset
+    columns = main.run_key_rate(arguments.kind,plot=arguments.plot)
+    output = open(arguments.output,'w',encoding='utf-8') if arguments.output else sys.stdout
+    try:
+        for row in range(len(columns["x"])):
+            output.write(json.dumps(_scalars({name:column[row] for name,column in columns.items()})) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+def replot(arguments):
+    """
+    Redraws the figures of sweep datasets without simulating anything
+    """
+    from plotting import replot as replot_dataset
+    for path in arguments.datasets:
+        for figure in replot_dataset(path,arguments.workers):
+            print(figure)
+
+def import_time(arguments):
+    """
+    Measures how long starting a fresh interpreter and importing the modules takes
+    """
+    results_dict = {}
+    for module in arguments.modules:
+        timings = []
+        for i in range(arguments.repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable,"-c",f"import {module}"],check=True)
+            timings.append(time.perf_counter() - start)
+        results_dict[module] = min(timings)
+    print(json.dumps(results_dict,indent=2))
+
+def parse_arguments(argv: list = None):
+    """
+    Returns:
+        arguments: argparse.Namespace, its "function" attribute runs the chosen command
+    """
+    parser = argparse.ArgumentParser(prog="python -m cli",description="Headless BB84 simulations")
+    commands = parser.add_subparsers(dest="command",required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--backend",default="numpy",choices=["aer","numpy","urandom"],
+                        help="randomness backend, only 'aer' imports qiskit (default: numpy)")
+    common.add_argument("--seed",type=int,default=None)
+
+    lossy = argparse.ArgumentParser(add_help=False)
+    group = lossy.add_argument_group("lossy channel","simulated sparsely when --distance is given")
+    group.add_argument("--distance",type=float,default=None,help="fibre length [km]")
+    group.add_argument("--attenuation",type=float,default=0.2,help="fibre loss [dB/km]")
+    group.add_argument("--detection-efficiency",type=float,default=1.0,help="between 0-1")
+    group.add_argument("--dark-count-rate",type=float,default=0.0,help="[Hz]")
+    group.add_argument("--dead-time",type=float,default=0.0,help="[s]")
+    group.add_argument("--pulse-rate",type=float,default=1e6,help="[Hz]")
+    group.add_argument("--eve-position",type=float,default=0.5,help="fraction of the fibre before Eve")
+
+    single = commands.add_parser("simulate",parents=[common,lossy],help="run a single simulation, "
+                                 "--key-length is the number of pulses over a lossy channel")
+    single.add_argument("--key-length",type=int,default=1000)
+    single.add_argument("--alice",type=float,default=100.0,help="emitter efficiency [%%]")
+    single.add_argument("--bob",type=float,default=100.0,help="detector efficiency [%%]")
+    single.add_argument("--eve",type=float,nargs=2,default=None,metavar=("EMITTER","DETECTOR"),
+                        help="efficiencies of Eve, she doesn't exist when omitted")
+    single.add_argument("--tactic",type=int,default=0,choices=range(5))
+    single.add_argument("--engine",default="vector",choices=["photon","vector"])
+    single.add_argument("--trials",type=int,default=None,help="run a batch of trials instead")
+    single.add_argument("--keys",action="store_true",help="print the keys and bases as well")
+    single.add_argument("--reconcile",default=None,choices=["cascade","ldpc"],
+                        help="correct the sifted keys and report the leaked bits and throughput")
+    single.add_argument("--workers",type=int,default=None,help="processes used by --reconcile")
+    single.add_argument("--privacy-amplification",action="store_true",
+                        help="hash the reconciled key into a secret key, reported per block")
+    single.set_defaults(function=simulate)
+
+    long_run = commands.add_parser("stream",parents=[common,lossy],
+                                   help="run a long simulation block by block with bounded memory")
+    long_run.add_argument("--pulses",type=int,required=True)
+    long_run.add_argument("--block-size",type=int,default=1 << 20)
+    long_run.add_argument("--alice",type=float,default=100.0,help="emitter efficiency [%%]")
+    long_run.add_argument("--bob",type=float,default=100.0,help="detector efficiency [%%]")
+    long_run.add_argument("--eve",type=float,nargs=2,default=None,metavar=("EMITTER","DETECTOR"))
+    long_run.add_argument("--tactic",type=int,default=0,choices=range(5))
+    long_run.add_argument("--sifted-output",default=None,help="memory-mapped file of the sifted key")
+    long_run.add_argument("--final-output",default=None,help="memory-mapped file of the final key")
+    long_run.set_defaults(function=stream)
+
+    grid = commands.add_parser("sweep",parents=[common],help="run one of the sweeps of main.py")
+    grid.add_argument("kind",choices=sorted(SWEEPS))
+    grid.add_argument("--key-lengths",type=int,nargs='+',default=None)
+    grid.add_argument("--iterations",type=int,default=None)
+    grid.add_argument("--workers",type=int,default=None)
+    grid.add_argument("--cache-path",default="results_cache.sqlite")
+    grid.add_argument("--no-cache",action="store_true")
+    grid.add_argument("--instrument",action="store_true",help="write metrics.json / metrics.prom")
+    grid.add_argument("--common-random-numbers",action="store_true",
+                      help="reuse Alice's beams across the grid points sharing her configuration")
+    grid.add_argument("--plot",action="store_true",help="draw the figures with the Agg backend")
+    grid.add_argument("--adaptive",action="store_true",
+                      help="refine a coarse grid where the curves change quickly or cross --threshold")
+    grid.add_argument("--budget",type=int,default=None,
+                      help="trials of --adaptive (default: what the uniform grid costs)")
+    grid.add_argument("--threshold",type=float,default=11.0,help="error rate of --adaptive [%%]")
+    grid.add_argument("--output",default=None,help="JSON lines file, stdout when omitted")
+    grid.add_argument("--dataset",default=None,help="columnar results, .npz or .parquet "
+                                                    "(default: sweep_<kind>.npz)")
+    grid.set_defaults(function=sweep)
+
+    rates = commands.add_parser("key-rate",help="evaluate the secret key rate bounds on a sweep grid")
+    rates.add_argument("kind",choices=sorted(SWEEPS))
+    rates.add_argument("--key-lengths",type=int,nargs='+',default=None,help="numbers of pulses")
+    rates.add_argument("--security-parameter",type=float,default=1e-10)
+    rates.add_argument("--reconciliation-efficiency",type=float,default=1.16)
+    rates.add_argument("--workers",type=int,default=None,help="processes drawing the figures")
+    rates.add_argument("--plot",action="store_true",help="draw the figures with the Agg backend")
+    rates.add_argument("--output",default=None,help="JSON lines file, stdout when omitted")
+    rates.add_argument("--dataset",default=None,help="(default: sweep_key_rate_<kind>.npz)")
+    rates.set_defaults(function=key_rate)
+
+    figures = commands.add_parser("replot",help="redraw the figures of sweep datasets")
+    figures.add_argument("datasets",nargs='+')
+    figures.add_argument("--workers",type=int,default=None,help="default: one per key length")
+    figures.set_defaults(function=replot)
+
+    timing = commands.add_parser("import-time",help="measure the start-up time of modules")
+    timing.add_argument("modules",nargs='*',default=["cli","simulation","sweep","main"])
+    timing.add_argument("--repeats",type=int,default=3)
+    timing.set_defaults(function=import_time)
+    return parser.parse_args(argv)
+
+def main(argv: list = None):
+    """
+    Runs the command given on the command line
+    """
+    arguments = parse_arguments(argv)
+    arguments.function(arguments)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+This module contains the columnar storage of sweep results, one row per grid point
+"""
+import json
+import numpy as np
+
+
+def to_columns(rows: list,results: list):
+    """
+    Merges the config axes of every grid point with the scalar fields of its results dict.
+    Interval fields, tuples, lists or arrays of 2 values, become <name>_low / <name>_high
+    columns, fields missing from some rows (e.g. instrumentation metrics) are filled with NaN.
+    Any other value raises a ValueError rather than being left out.
+
+    Args:
+        rows: list of dicts, see sweep_spec.build_grid
+        results: list of results dicts in the order of rows
+    Returns:
+        columns: dict of column name : numpy array
+    """
+    records = []
+    for row,results_dict in zip(rows,results):
+        record = dict(row)
+        for name,value in results_dict.items():
+            if isinstance(value,(tuple,list,np.ndarray)) and np.shape(value) == (2,):
+                record[name + "_low"],record[name + "_high"] = np.asarray(value).tolist()
+            elif value is None or np.ndim(value) == 0:
+                record[name] = value.item() if isinstance(value,np.generic) else value
+            else:
+                raise ValueError(f"{name} of shape {np.shape(value)} can't be stored as a column")
+        records.append(record)
+    names = []
+    for record in records:
+        names += [name for name in record if name not in names]
+    columns = {}
+    for name in names:
+        values = [record.get(name) for record in records]
+        if any(isinstance(value,str) for value in values):
+            columns[name] = np.array(["" if value is None else value for value in values])
+        else:
+            columns[name] = np.array([np.nan if value is None else value for value in values])
+    return columns
+
+def save_dataset(path: str,columns: dict,metadata: dict = None):
+    """
+    Writes the columns as an npz file, or as Parquet when the path ends with .parquet
+
+    Args:
+        metadata: dict stored alongside, e.g. the name of the sweep and its config
+    """
+    metadata_json = json.dumps(metadata or {},sort_keys=True,default=str)
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("Writing Parquet files requires pyarrow, use an .npz path instead") from error
+        table = pyarrow.table({name:pyarrow.array(values) for name,values in columns.items()})
+        table = table.replace_schema_metadata({"metadata":metadata_json})
+        pyarrow.parquet.write_table(table,path)
+        return
+    np.savez_compressed(path,__metadata__=np.array(metadata_json),**columns)
+
+def load_dataset(path: str):
+    """
+    Reverses save_dataset
+
+    Returns:
+        (columns, metadata): dict of column name : numpy array and the stored metadata dict
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path)
+        metadata = json.loads((table.schema.metadata or {}).get(b"metadata",b"{}"))
+        columns = {name:table.column(name).to_numpy() for name in table.column_names}
+        return columns,metadata
+    with np.load(path,allow_pickle=False) as arrays:
+        columns = {name:arrays[name] for name in arrays.files if name != "__metadata__"}
+        metadata = json.loads(str(arrays["__metadata__"])) if "__metadata__" in arrays.files else {}
+    return columns,metadata
+
+def select(columns: dict,**conditions):
+    """
+    Returns:
+        columns: dict holding only the rows whose columns equal the given values
+    """
+    mask = np.ones(len(next(iter(columns.values()))),dtype=bool)
+    for name,value in conditions.items():
+        mask &= columns[name] == value
+    return {name:values[mask] for name,values in columns.items()}
@@ -0,0 +1,167 @@
+"""
+This module contains class EntropyPool which serves quantum random bits from a buffer
+"""
+import threading
+import numpy as np
+import instrumentation
+
+
+class EntropyPool():
+    """
+    Buffer of random bits generated by batched AerSimulator runs.
+    A single circuit of number_of_qubits Hadamard gates is transpiled once and run for many shots,
+    every shot giving number_of_qubits fresh bits. When the buffer drops below the low watermark
+    the next batch is generated in a background thread.
+    Given a seed, every batch is run with a seed drawn from its own SeedSequence, so the served
+    bits are reproducible.
+    """
+    MAX_QUBITS = 24 # AerSimulator coupling map allows up to 28 qubits
+    def __init__(self,
+                number_of_qubits: int = 24,
+                shots: int = 4096,
+                low_watermark: float = 0.25,
+                prefetch: bool = True,
+                seed: int = None):
+        if not 1 <= number_of_qubits <= self.MAX_QUBITS or shots < 1:
+            raise ValueError("Invalid entropy pool size")
+        self.number_of_qubits = number_of_qubits
+        self.shots = shots
+        self.block_size = number_of_qubits * shots
+        self.low_watermark = int(low_watermark * self.block_size)
+        self.prefetch = prefetch
+        # Importing qiskit takes seconds, so it's deferred until a pool is actually created
+        from qiskit import QuantumCircuit,transpile
+        from qiskit_aer import AerSimulator
+        with instrumentation.stage("aer_transpile"):
+            self.simulator = AerSimulator()
+            circuit = QuantumCircuit(number_of_qubits)
+            for i in range(number_of_qubits):
+                circuit.h(i)
+            circuit.measure_all()
+            self.compiled = transpile(circuit,self.simulator)
+        self._buffer = np.empty(0,dtype=np.uint8)
+        self._position = 0
+        self._lock = threading.Lock()
+        self._prefetch_thread = None
+        self._prefetched = None
+        self._seed_sequence = None
+        self.reseed(seed)
+    def reseed(self,seed: int = None):
+        """
+        Drops all buffered bits and restarts the stream from the given seed
+
+        Args:
+            seed: int or numpy SeedSequence, None for unseeded simulator runs
+        """
+        with self._lock:
+            if self._prefetch_thread is not None:
+                self._prefetch_thread.join()
+                self._prefetch_thread = None
+            self._prefetched = None
+            self._buffer = np.empty(0,dtype=np.uint8)
+            self._position = 0
+            if seed is None or isinstance(seed,np.random.SeedSequence):
+                self._seed_sequence = seed
+            else:
+                self._seed_sequence = np.random.SeedSequence(seed)
+    def available(self):
+        """
+        Returns:
+            number of bits which can be served without running the simulator
+        """
+        prefetched = 0 if self._prefetched is None else len(self._prefetched)
+        return len(self._buffer) - self._position + prefetched
+    def bits(self,number_of_bits: int):
+        """
+        Serves random bits from the buffer, refilling it when needed
+
+        Args:
+            number_of_bits: int equal to the number of bits to be returned
+        Returns:
+            bits: numpy uint8 array of 0s and 1s
+        """
+        with self._lock:
+            chunks = []
+            needed = number_of_bits
+            while needed > 0:
+                if self._position == len(self._buffer):
+                    self._buffer = self._next_block(needed)
+                    self._position = 0
+                taken = min(needed,len(self._buffer) - self._position)
+                chunks.append(self._buffer[self._position:self._position + taken])
+                self._position += taken
+                needed -= taken
+            if self.prefetch and len(self._buffer) - self._position < self.low_watermark:
+                self._start_prefetch()
+        if not chunks:
+            return np.empty(0,dtype=np.uint8)
+        return np.concatenate(chunks)
+    def integer(self,number_of_bits: int = 1):
+        """
+        Serves a random integer of arbitrary width
+
+        Args:
+            number_of_bits: int equal to the number of bits in the output number
+        Returns:
+            value: int in the range of (0,2^number_of_bits - 1)
+        """
+        if number_of_bits <= 0:
+            return 0
+        packed = np.packbits(self.bits(number_of_bits))
+        padding = len(packed) * 8 - number_of_bits
+        return int.from_bytes(packed.tobytes(),'big') >> padding
+    def _next_block(self,needed: int):
+        """
+        Returns the prefetched block if there is one, otherwise runs the simulator in place.
+        Requests larger than a block are served with a single, larger run.
+        """
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+        if self._prefetched is not None:
+            block = self._prefetched
+            self._prefetched = None
+            return block
+        shots = max(self.shots,-(-needed // self.number_of_qubits))
+        return self._generate_block(shots)
+    def _start_prefetch(self):
+        """
+        Starts generating the next block in a background thread
+        """
+        if self._prefetch_thread is not None or self._prefetched is not None:
+            return
+        def worker():
+            try:
+                self._prefetched = self._generate_block(self.shots)
+            except RuntimeError:
+                # Aer refuses new jobs during interpreter shutdown, _next_block then runs in place
+                pass
+        self._prefetch_thread = threading.Thread(target=worker,daemon=True)
+        self._prefetch_thread.start()
+    @instrumentation.timed("aer_run")
+    def _generate_block(self,shots: int):
+        """
+        Runs the cached circuit and converts the memory of every shot into an array of bits
+        """
+        instrumentation.count("aer_runs")
+        instrumentation.count("aer_bits",shots * self.number_of_qubits)
+        options = {}
+        if self._seed_sequence is not None:
+            options["seed_simulator"] = int(self._seed_sequence.spawn(1)[0].generate_state(1)[0])
+        result = self.simulator.run(self.compiled,shots=shots,memory=True,**options).result()
+        memory = ''.join(result.get_memory()).encode('ascii')
+        return np.frombuffer(memory,dtype=np.uint8) - ord('0')
+
+
+_SHARED_POOL = None
+_SHARED_POOL_LOCK = threading.Lock()
+
+def shared_pool():
+    """
+    Returns the process wide EntropyPool, creating it on first use
+    """
+    global _SHARED_POOL
+    with _SHARED_POOL_LOCK:
+        if _SHARED_POOL is None:
+            _SHARED_POOL = EntropyPool()
+        return _SHARED_POOL
@@ -1,9 +1,10 @@
 """
 This module contains the class Human
 """
-from qiskit import QuantumCircuit,transpile
-from qiskit_aer import AerSimulator
+import instrumentation
+from malfunction import malfunction_mask,malfunction_probability
 from photon import Photon
+from randomness import RandomnessBackend,default_backend
 
 class Human():
     """
@@ -12,12 +13,15 @@ class Human():
     def __init__(self,
                 key_length: int = 1,
                 emitter_efficiency: float = 100.0,
-                detector_efficiency: float = 100.0):
+                detector_efficiency: float = 100.0,
+                rng: RandomnessBackend = None):
         self.key_length = key_length
         self.emitter_efficiency = emitter_efficiency
         self.detector_efficiency = detector_efficiency
         self.base = None
         self.key = None
+        self.rng = rng if rng is not None else default_backend()
+    @instrumentation.timed("Human.receive")
     def receive(self,photon_beam: list):
         """
         Simulation of the photon beam generation procedure.
@@ -31,14 +35,18 @@ class Human():
             base_val = self.randomize_number(no_photons)
             # Convert base to binary str with preceding 0s
             self.base = self.convert_decimal_to_binary_str(base_val,no_photons)
+        # Simulate the possible malfunctions of the detector for the whole beam at once
+        detector_malfunction,value_change = malfunction_mask(self.rng,
+                                                             100 - self.detector_efficiency,
+                                                             no_photons)
+        if instrumentation.enabled():
+            instrumentation.count("photons_detected",no_photons)
+            instrumentation.count("malfunctions",int(detector_malfunction.sum()))
         key = ''
         for i,photon in enumerate(photon_beam):
-            # Simulate the possible malfunction of the detector
-            detector_malfunction = self.device_malfunction(100 - self.detector_efficiency)
-            if detector_malfunction:
-                # Detector failed, randomize whether it changed the base or the value of the photon
-                value_change = self.randomize_number(1)
-                if value_change:
+            if detector_malfunction[i]:
+                # Detector failed, the mask decided whether it changed the base or the value
+                if value_change[i]:
                     photon.change_value()
                 else:
                     photon.switch_base()
@@ -58,6 +66,7 @@ class Human():
             # If the bases are different, value is randomized
             photon.value = self.randomize_number(1)
         return photon.value
+    @instrumentation.timed("Human.send")
     def send(self):
         """
         Simulation of the photon beam generation procedure.
@@ -75,16 +84,20 @@ class Human():
             base_val = self.randomize_number(self.key_length)
             # Convert base to binary str with preceding 0s
             self.base = self.convert_decimal_to_binary_str(base_val,self.key_length)
+        # Simulate the possible malfunctions of the emitter for the whole beam at once
+        emitter_malfunction,value_change = malfunction_mask(self.rng,
+                                                            100 - self.emitter_efficiency,
+                                                            self.key_length)
+        if instrumentation.enabled():
+            instrumentation.count("photons_emitted",self.key_length)
+            instrumentation.count("malfunctions",int(emitter_malfunction.sum()))
         photon_beam = []
         for i in range(self.key_length):
             # Create a photon with each base and key bit value
             photon = Photon(int(self.base[i]),int(self.key[i]))
-            # Simulate the possible malfunction of the emitter
-            emitter_malfunction = self.device_malfunction(100 - self.emitter_efficiency)
-            if emitter_malfunction:
-                # Emitter failed, randomize whether it changed the base or the value of the photon
-                value_change = self.randomize_number(1)
-                if value_change:
+            if emitter_malfunction[i]:
+                # Emitter failed, the mask decided whether it changed the base or the value
+                if value_change[i]:
                     photon.change_value()
                 else:
                     photon.switch_base()
@@ -103,26 +116,22 @@ class Human():
 
     def randomize_number(self,number_of_bits:int = 1):
         """
-        This function's going to return a fully random number
+        This function's going to return a fully random number drawn from the randomness backend
         Args:
             number_of_bits: int equal to the number of bits in the output number
         Returns:
             value: int in the range of (0,2^number_of_bits - 1)
         """
-        simulator = AerSimulator()
-        circuit = QuantumCircuit(number_of_bits)
-        for i in range(number_of_bits):
-            circuit.h(i)
-        circuit.measure_all()
-        compiled = transpile(circuit,simulator)
-        result_of_circuit = simulator.run(compiled,shots=1).result().data()['counts']
-        value = int(list(result_of_circuit.keys())[0],16)
-        return value
+        if instrumentation.enabled():
+            instrumentation.count("rng_calls")
+            instrumentation.count("rng_bits",number_of_bits)
+        return self.rng.integer(number_of_bits)
     def device_malfunction(self,chance_of_malfunction: float = 0.0):
         """
         Function which decides whether the device malfunctioned, thus caused an error.
-        It's purely undeterministic (assuming the qubits are real) with an accuracy of up to
-        10th of a percent since we assume 1/1024 ~ 1/1000
+        It's purely undeterministic (assuming the qubits are real) and uses the chance at full
+        floating point precision. send and receive draw the malfunctions of a whole beam at once
+        with malfunction.malfunction_mask instead.
 
         Args:
             chance_of_malfunction: float between 0-100 equal to the chance of device malfunctioning
@@ -130,14 +139,9 @@ class Human():
             measurement: either True or False - where True means that the device malfunctioned
 
         """
-        amount_of_error_states = int(round(chance_of_malfunction / 0.1,2))
-        error_states = [
-            i for i in range(amount_of_error_states)
-        ]
-        measurement = self.randomize_number(10)
-        if measurement in error_states:
-            return True
-        return False
+        probability = malfunction_probability(chance_of_malfunction)
+        instrumentation.count("rng_calls")
+        return bool(self.rng.bernoulli(probability,1)[0])
 
 
 def main():
@@ -0,0 +1,245 @@
+"""
+This module contains the optional per-stage timing and counter instrumentation of simulation runs
+"""
+import contextlib
+import functools
+import json
+import sys
+import time
+
+
+class Metrics():
+    """
+    Wall time and number of calls of every stage together with named counters, e.g. the number
+    of photons processed or random bits consumed. Metrics of several runs can be merged.
+    """
+    PREFIX = "metrics."
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counters = {}
+    @contextlib.contextmanager
+    def stage(self,name: str):
+        """
+        Context manager adding the wall time of its body to the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name,0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name,0) + 1
+    def count(self,name: str,amount: int = 1):
+        """
+        Adds amount to the counter
+        """
+        self.counters[name] = self.counters.get(name,0) + amount
+    def merge(self,other):
+        """
+        Adds the stages and counters of other Metrics to these
+        """
+        for name,seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name,0.0) + seconds
+            self.calls[name] = self.calls.get(name,0) + other.calls.get(name,0)
+        for name,amount in other.counters.items():
+            self.count(name,amount)
+        return self
+    def to_dict(self):
+        """
+        Returns:
+            metrics_dict: a dict
+                     scheme:
+                        {
+                        "stages" : {name : {"seconds" : float, "calls" : int}},
+                        "counters" : {name : int}
+                        }
+        """
+        metrics_dict = {
+            "stages" : {name:{"seconds":self.seconds[name],"calls":self.calls[name]}
+                        for name in sorted(self.seconds)},
+            "counters" : {name:self.counters[name] for name in sorted(self.counters)},
+        }
+        return metrics_dict
+    def to_json(self,**kwargs):
+        """
+        Returns:
+            json: str of to_dict
+        """
+        return json.dumps(self.to_dict(),**kwargs)
+    def flatten(self):
+        """
+        Returns the metrics as flat scalar fields which can be stored in a results dict
+        """
+        fields = {}
+        for name in self.seconds:
+            fields[f"{self.PREFIX}seconds.{name}"] = self.seconds[name]
+            fields[f"{self.PREFIX}calls.{name}"] = self.calls[name]
+        for name,amount in self.counters.items():
+            fields[f"{self.PREFIX}counters.{name}"] = amount
+        return fields
+    @classmethod
+    def from_results(cls,results_dict: dict):
+        """
+        Reverses flatten, other fields of the results dict are ignored
+        """
+        metrics = cls()
+        for key,value in results_dict.items():
+            if not key.startswith(cls.PREFIX):
+                continue
+            kind,name = key[len(cls.PREFIX):].split('.',1)
+            if kind == "seconds":
+                metrics.seconds[name] = float(value)
+            elif kind == "calls":
+                metrics.calls[name] = int(value)
+            elif kind == "counters":
+                metrics.counters[name] = int(value)
+        return metrics
+
+
+def _escape(value):
+    """
+    Escapes a Prometheus label value
+    """
+    return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+def to_prometheus(labelled_metrics: list,namespace: str = "bb84"):
+    """
+    Renders Metrics in the Prometheus text exposition format
+
+    Args:
+        labelled_metrics: list of (labels, Metrics) tuples, labels being a dict of str : value,
+                          e.g. one tuple per sweep grid point
+        namespace: str prepended to every metric name
+    Returns:
+        text: str
+    """
+    families = {}
+    def add(name,help_text,labels,value):
+        family = families.setdefault(name,(help_text,[]))
+        rendered = ','.join(f'{key}="{_escape(label)}"' for key,label in labels.items())
+        family[1].append(f"{name}{{{rendered}}} {value}" if rendered else f"{name} {value}")
+    for labels,metrics in labelled_metrics:
+        for stage in sorted(metrics.seconds):
+            stage_labels = dict(labels,stage=stage)
+            add(f"{namespace}_stage_seconds_total","Wall time spent in a stage",
+                stage_labels,repr(metrics.seconds[stage]))
+            add(f"{namespace}_stage_calls_total","Number of times a stage was entered",
+                stage_labels,metrics.calls[stage])
+        for counter in sorted(metrics.counters):
+            add(f"{namespace}_{counter}_total",f"Counter {counter}",labels,metrics.counters[counter])
+    lines = []
+    for name,(help_text,samples) in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        lines += samples
+    return '\n'.join(lines) + '\n'
+
+
+_ACTIVE = None
+_NULL_STAGE = contextlib.nullcontext()
+
+def enabled():
+    """
+    Returns:
+        enabled: bool, True while a recording is active
+    """
+    return _ACTIVE is not None
+
+def stage(name: str):
+    """
+    Times a stage into the active recording, a shared no-op context manager when there's none
+    """
+    if _ACTIVE is None:
+        return _NULL_STAGE
+    return _ACTIVE.stage(name)
+
+def timed(name: str):
+    """
+    Decorator timing every call of a function as a stage, when no recording is active the only
+    overhead is a single check
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            if _ACTIVE is None:
+                return function(*args,**kwargs)
+            with _ACTIVE.stage(name):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def count(name: str,amount: int = 1):
+    """
+    Adds amount to a counter of the active recording, does nothing when there's none
+    """
+    if _ACTIVE is not None:
+        _ACTIVE.count(name,amount)
+
+@contextlib.contextmanager
+def recording(metrics: Metrics = None):
+    """
+    Makes the hooks of Human, VectorHuman, Simulation and EntropyPool record into metrics
+    for the duration of the block. Recordings can be nested, the outer one is restored afterwards.
+
+    Returns:
+        metrics: the Metrics being recorded into
+    """
+    global _ACTIVE
+    metrics = metrics if metrics is not None else Metrics()
+    previous = _ACTIVE
+    _ACTIVE = metrics
+    try:
+        yield metrics
+    finally:
+        _ACTIVE = previous
+
+
+class ProgressReporter():
+    """
+    Prints the progress of a sweep with its throughput and estimated time left, at most once
+    every interval seconds, however often it's updated
+    """
+    def __init__(self,total: int,interval: float = 2.0,stream = None,description: str = "Progress"):
+        self.total = total
+        self.interval = interval
+        self.stream = stream if stream is not None else sys.stdout
+        self.description = description
+        self.done = 0
+        self.trials = 0
+        self.photons = 0
+        self.start = time.perf_counter()
+        self._last_report = None
+    def update(self,done: int = 1,trials: int = 0,photons: int = 0):
+        """
+        Counts finished grid points and the trials and photons they simulated
+        """
+        self.done += done
+        self.trials += trials
+        self.photons += photons
+        now = time.perf_counter()
+        if self.done >= self.total or self._last_report is None or now - self._last_report >= self.interval:
+            self.report(now)
+    def report(self,now: float = None):
+        """
+        Prints a single progress line
+        """
+        now = now if now is not None else time.perf_counter()
+        self._last_report = now
+        elapsed = now - self.start
+        fraction = self.done / self.total if self.total else 1.0
+        remaining = elapsed * (1 - fraction) / fraction if fraction > 0 else float("inf")
+        line = (f"{self.description}: {self.done}/{self.total} grid points ({fraction * 100:5.1f}%), "
+                f"{self.trials / elapsed if elapsed > 0 else 0:.1f} trials/s, ")
+        if self.photons:
+            line += f"{self.photons / elapsed if elapsed > 0 else 0:.3g} photons/s, "
+        line += f"elapsed {_format_duration(elapsed)}, ETA {_format_duration(remaining)}"
+        print(line,file=self.stream,flush=True)
+
+def _format_duration(seconds: float):
+    """
+    Formats seconds as h:mm:ss
+    """
+    if seconds == float("inf"):
+        return "?"
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,241 @@
+"""
+This module contains the secret key rate estimator: asymptotic, finite-size and decoy-state
+BB84 bounds, evaluated on whole parameter grids at once without any Monte Carlo
+"""
+import numpy as np
+from analytic import bit_error_probability
+from dataset import to_columns
+from privacy_amplification import SECURITY_PARAMETER
+from reconciliation import binary_entropy
+from simulation import Simulation
+from sweep_spec import SWEEP_SPECS,build_grid
+
+
+# Leaked bits over the Shannon limit, what Cascade achieves, see reconciliation.reconcile
+RECONCILIATION_EFFICIENCY = 1.16
+# Chance that Alice's and Bob's final keys differ
+CORRECTNESS_PARAMETER = 1e-15
+# Share of the sifted key disclosed to estimate the error rate
+PARAMETER_ESTIMATION_FRACTION = 0.1
+# Share of the pulses measured in Alice's base
+SIFTING_RATIO = 0.5
+# Error rate of a dark count
+DARK_COUNT_ERROR_RATE = 0.5
+
+
+def asymptotic_key_rate(error_rate,
+                        efficiency: float = RECONCILIATION_EFFICIENCY,
+                        sifting_ratio: float = SIFTING_RATIO):
+    """
+    Shor-Preskill rate of an infinitely long key: r = s (1 - h(e) - f h(e))
+
+    Args:
+        error_rate: float or array between 0-1, the quantum bit error rate
+        efficiency: float reconciliation efficiency f
+        sifting_ratio: float share of the pulses kept by sifting
+    Returns:
+        rate: float array, secret bits per emitted pulse
+    """
+    entropy = binary_entropy(np.asarray(error_rate,dtype=float))
+    return sifting_ratio * np.maximum(0.0,1 - entropy - efficiency * entropy)
+
+def statistical_fluctuation(key_bits,sample_bits,security_parameter: float = SECURITY_PARAMETER):
+    """
+    Largest difference between the error rate measured on sample_bits bits and the phase error
+    rate of the other key_bits bits, except with probability security_parameter
+
+    Returns:
+        fluctuation: float array, inf where either size is 0
+    """
+    key_bits = np.asarray(key_bits,dtype=float)
+    sample_bits = np.asarray(sample_bits,dtype=float)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        fluctuation = np.sqrt((key_bits + sample_bits) / (key_bits * sample_bits)
+                              * (sample_bits + 1) / sample_bits * np.log(2 / security_parameter))
+    return np.where((key_bits > 0) & (sample_bits > 0),fluctuation,np.inf)
+
+def finite_key_length(sifted_key_length,
+                    error_rate,
+                    efficiency: float = RECONCILIATION_EFFICIENCY,
+                    fraction: float = PARAMETER_ESTIMATION_FRACTION,
+                    security_parameter: float = SECURITY_PARAMETER,
+                    correctness_parameter: float = CORRECTNESS_PARAMETER):
+    """
+    Secret key length of a finite exchange (Tomamichel et al. 2012): a fraction of the sifted key
+    estimates the error rate, the phase error rate of the remaining n bits is bounded by the
+    estimate plus the statistical fluctuation, and
+    l = n (1 - h(e + fluctuation)) - f n h(e) - log2(2 / (security_parameter^2 correctness_parameter))
+
+    Args:
+        sifted_key_length: int or array
+        error_rate: float or array between 0-1, the measured quantum bit error rate
+    Returns:
+        length: int array, 0 where no secret key can be extracted
+    """
+    sifted_key_length = np.asarray(sifted_key_length,dtype=float)
+    error_rate = np.asarray(error_rate,dtype=float)
+    sample_bits = np.floor(fraction * sifted_key_length)
+    key_bits = sifted_key_length - sample_bits
+    phase_error_rate = np.minimum(0.5,error_rate + statistical_fluctuation(key_bits,sample_bits,security_parameter))
+    length = (key_bits * (1 - binary_entropy(phase_error_rate))
+              - efficiency * key_bits * binary_entropy(error_rate)
+              - np.log2(2 / (security_parameter ** 2 * correctness_parameter)))
+    return np.maximum(0,np.floor(np.nan_to_num(length,nan=0.0,neginf=0.0))).astype(np.int64)
+
+def decoy_key_rate(error_rate,
+                transmittance,
+                dark_count_probability,
+                signal: float = 0.5,
+                decoy: float = 0.1,
+                efficiency: float = RECONCILIATION_EFFICIENCY,
+                sifting_ratio: float = SIFTING_RATIO):
+    """
+    Asymptotic rate of a weak coherent source with vacuum + weak decoy states (Ma et al. 2005):
+    the yield and error rate of the single photon pulses are bounded from the gains of the
+    signal and decoy intensities, and only single photon pulses contribute secret bits
+
+    Args:
+        error_rate: float or array between 0-1, the error rate of a detected photon, e.g. caused
+                    by device malfunctions
+        transmittance: float or array, chance that a single photon is detected, see Channel
+        dark_count_probability: float or array, chance of a dark count per pulse
+        signal, decoy: float mean photon numbers of the signal and the weak decoy state
+    Returns:
+        rate: float array, secret bits per emitted pulse
+    """
+    error_rate = np.asarray(error_rate,dtype=float)
+    transmittance = np.asarray(transmittance,dtype=float)
+    dark = np.asarray(dark_count_probability,dtype=float)
+    def gain(intensity):
+        detected = 1 - np.exp(-transmittance * intensity)
+        return dark + detected,DARK_COUNT_ERROR_RATE * dark + error_rate * detected
+    signal_gain,signal_errors = gain(signal)
+    decoy_gain,decoy_errors = gain(decoy)
+    single_yield = (signal / (signal * decoy - decoy ** 2)
+                    * (decoy_gain * np.exp(decoy) - signal_gain * np.exp(signal) * decoy ** 2 / signal ** 2
+                       - (signal ** 2 - decoy ** 2) / signal ** 2 * dark))
+    single_yield = np.maximum(single_yield,0.0)
+    single_gain = single_yield * signal * np.exp(-signal)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        single_error_rate = (decoy_errors * np.exp(decoy) - DARK_COUNT_ERROR_RATE * dark) / (single_yield * decoy)
+        signal_error_rate = signal_errors / signal_gain
+    single_error_rate = np.clip(np.nan_to_num(single_error_rate,nan=0.5,posinf=0.5),0.0,0.5)
+    rate = sifting_ratio * (single_gain * (1 - binary_entropy(single_error_rate))
+                            - signal_gain * efficiency * binary_entropy(np.clip(signal_error_rate,0.0,0.5)))
+    return np.maximum(0.0,rate)
+
+def key_rates(key_length,error_rate,decoy_state: dict = None,**options):
+    """
+    Every bound for exchanges of key_length pulses with the given error rate, the expected
+    sifted key length being SIFTING_RATIO * key_length. Arrays are broadcast together.
+
+    Args:
+        key_length: int or array, number of emitted pulses
+        error_rate: float or array between 0-1
+        decoy_state: dict with the "transmittance", "dark_count_probability", "signal" and
+                     "decoy" arguments of decoy_key_rate, the decoy rate is skipped when None
+        options: "efficiency", "fraction", "security_parameter" and "correctness_parameter"
+    Returns:
+        results_dict: a dict of arrays
+                 scheme:
+                    {
+                    "error_rate" : float [%],
+                    "sifted_key_length" : float,
+                    "asymptotic_key_rate" : float [bit per pulse],
+                    "finite_key_length" : int [bit],
+                    "finite_key_rate" : float [bit per pulse],
+                    "secure" : bool, a finite key can be extracted,
+                    only if decoy_state:
+                    "decoy_key_rate" : float [bit per pulse]
+                    }
+    """
+    key_length = np.asarray(key_length,dtype=float)
+    error_rate = np.asarray(error_rate,dtype=float)
+    efficiency = options.get("efficiency",RECONCILIATION_EFFICIENCY)
+    sifted_key_length = SIFTING_RATIO * key_length + np.zeros_like(error_rate)
+    length = finite_key_length(sifted_key_length,error_rate,**options)
+    results_dict = {
+        "error_rate" : error_rate * 100.0 + np.zeros_like(key_length),
+        "sifted_key_length" : sifted_key_length,
+        "asymptotic_key_rate" : asymptotic_key_rate(error_rate,efficiency) + np.zeros_like(key_length),
+        "finite_key_length" : length,
+        "finite_key_rate" : length / np.maximum(key_length,1),
+        "secure" : length > 0,
+    }
+    if decoy_state is not None:
+        results_dict["decoy_key_rate"] = decoy_key_rate(error_rate,efficiency=efficiency,**decoy_state) \
+                                         + np.zeros_like(key_length)
+    return results_dict
+
+def key_rates_from_results(results_dict: dict,**options):
+    """
+    finite_key_length for the statistics Simulation produced: the results dict of
+    Simulation.simulate or simulate_batch, or a summary of SweepRunner. Summaries are read
+    through their average sifted key length and the pooled error rate of all sifted bits,
+    which, unlike the average error rate, doesn't count the 100 % of trials keeping no bit.
+
+    Returns:
+        results_dict: a dict holding "finite_key_length" and "secure", arrays for batches
+    """
+    if "average_error_rate" in results_dict:
+        if "average_sifted_key_length" not in results_dict:
+            raise ValueError("The results hold no average_sifted_key_length, summaries cached "
+                             "before it was aggregated have to be simulated again")
+        sifted_key_length = np.asarray(results_dict["average_sifted_key_length"],dtype=float)
+        # No sifted bit at all leaves no pooled error rate and no key
+        error_rate = np.asarray(results_dict.get("pooled_error_rate",100.0),dtype=float) / 100.0
+    else:
+        sifted_key_length = np.asarray(results_dict["sifted_key_length"],dtype=float)
+        error_rate = np.asarray(results_dict["error_rate"],dtype=float) / 100.0
+    length = finite_key_length(sifted_key_length,np.minimum(error_rate,0.5),**options)
+    return {"finite_key_length" : length,"secure" : length > 0}
+
+def key_rate_grid(key_lengths,alice_efficiencies,bob_efficiencies,eve: dict,tactics: list = (0,),
+                decoy_state: dict = None,**options):
+    """
+    Every bound over a tactic x key length x efficiency grid, the error rates coming from the
+    closed form model of analytic.bit_error_probability
+
+    Args:
+        key_lengths: list of ints
+        alice_efficiencies, bob_efficiencies: arrays of emitter / detector efficiencies [%],
+                                              broadcast together along the last axis
+        eve: config dict of Eve, see Simulation.create_configuration_dict
+        tactics: list of eve's tactics
+    Returns:
+        results_dict: see key_rates, arrays of shape (tactics, key_lengths, efficiencies)
+    """
+    alice = Simulation.create_configuration_dict(emitter_efficiency=np.asarray(alice_efficiencies,dtype=float))
+    bob = Simulation.create_configuration_dict(detector_efficiency=np.asarray(bob_efficiencies,dtype=float))
+    error_rate = np.stack([np.atleast_1d(bit_error_probability(alice,bob,eve,tactic)) for tactic in tactics])
+    key_lengths = np.asarray(key_lengths,dtype=float)[None,:,None]
+    return key_rates(key_lengths,error_rate[:,None,:],decoy_state,**options)
+
+def key_rate_columns(sweep: str,config: dict,decoy_state: dict = None,**options):
+    """
+    Evaluates key_rates on the grid of a sweep of sweep_spec.SWEEP_SPECS, the grid points sharing
+    Eve's configuration and tactic are computed at once
+
+    Args:
+        config: dict holding "key_lengths" and the entries referenced by the spec
+    Returns:
+        columns: dict of the config axes and of the key_rates fields, see dataset.to_columns
+    """
+    tasks,rows = build_grid(SWEEP_SPECS[sweep],dict(config,number_of_iterations_per_simulation=1))
+    columns = to_columns(rows,[{} for row in rows])
+    groups = {}
+    for index,task in enumerate(tasks):
+        eve = task["eve"]
+        key = (eve["exists"],eve["emitter_efficiency"],eve["detector_efficiency"],task["tactic"])
+        groups.setdefault(key,[]).append(index)
+    error_rate = np.zeros(len(tasks))
+    for (exists,emitter,detector,tactic),indices in groups.items():
+        alice = Simulation.create_configuration_dict(
+            emitter_efficiency=np.array([tasks[index]["alice"]["emitter_efficiency"] for index in indices],dtype=float))
+        bob = Simulation.create_configuration_dict(
+            detector_efficiency=np.array([tasks[index]["bob"]["detector_efficiency"] for index in indices],dtype=float))
+        eve = Simulation.create_configuration_dict(emitter,detector,exists)
+        error_rate[indices] = bit_error_probability(alice,bob,eve,tactic)
+    key_length = np.array([task["key_length"] for task in tasks],dtype=float)
+    columns.update(key_rates(key_length,error_rate,decoy_state,**options))
+    return columns
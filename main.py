@@ -1,207 +1,229 @@
 """
 Main module which generates all the plots based on BB84 QKD concept
 """
-from scipy.stats import mode
-from numpy import average
-import matplotlib.pyplot as plt
-from simulation import Simulation
+import json
+import time
+from channel import Channel
+from adaptive import refine
+from dataset import save_dataset,to_columns
+from instrumentation import Metrics,ProgressReporter,to_prometheus
+from key_rate import key_rate_columns
+from plotting import replot
+from sweep import SweepRunner
+from sweep_spec import SWEEP_SPECS,build_grid
+from result_cache import ResultCache
 
 # CONFIG for changing the parameters of simulation, all of them should be given as a list - even
 # for 1 element, with the exception of 'number of iterations' which should be given straight
 # as an int
 CONFIG = {                                              # possible value ranges / types
-    "key_lengths" : [20,15,10],                         # [1, 26] : int <- AerSimulator limit
+    "key_lengths" : [20,15,10],                         # [1,inf) : int
     "detector_efficiencies" : [i*5 for i in range(21)], # [0,100] : int
     "emitter_efficiencies" : [i*5 for i in range(21)],  # [0,100] : int
     "system_efficiencies" : [i*5 for i in range(21)],   # [0,100] : int
     "eavesdropping" : [False,True],                     # False or True : bool
     "eve_tactic" : [0,1,2,3,4],                         # [0,4] : int
-    "number_of_iterations_per_simulation" : 200,        # [1,inf) : int
+    "number_of_iterations_per_simulation" : 200,        # [1,inf) : int <- cap if target widths are set
+    "target_confidence_interval_width" : None,          # e.g. {"error_rate":1.0,"final_key_length":0.5}
+    "batch_size" : None,                                # [2,inf) : int or None for 1/10 of the cap
+    "confidence" : 0.95,                                # (0,1) : float
+    "number_of_workers" : None,                         # [1,inf) : int or None for all cores
+    "seed" : None,                                      # int or None for a fresh seed
+    "randomness_backend" : "aer",                       # "aer", "numpy" or "urandom" : str
+    "cache_path" : "results_cache.sqlite",              # str or None to disable the cache
+    "instrumentation" : False,                          # False or True : bool, per stage timings
+    "metrics_path" : "metrics",                         # str, <path>.json and <path>.prom are written
+    "progress_interval" : 2.0,                          # [0,inf) : float, seconds between reports
+    "dataset_path" : "sweep_{sweep}.npz",               # str, .npz or .parquet (needs pyarrow)
+    "common_random_numbers" : False,                    # False or True : bool, share Alice's beams
+    "key_rate_key_lengths" : [10**4,10**6,10**8],       # [1,inf) : int, pulses of the key rate figures
+    "security_parameter" : 1e-10,                       # (0,1) : float
+    "reconciliation_efficiency" : 1.16,                 # [1,inf) : float, leaked bits per Shannon limit
+    "decoy_state" : {"signal":0.5,"decoy":0.1,          # mean photon numbers : float
+                     "distance":25.0,"attenuation":0.2, # [km], [dB/km] : float
+                     "detection_efficiency":0.1,        # (0,1] : float
+                     "dark_count_rate":10.0,            # [Hz] : float
+                     "pulse_rate":1e6},                 # [Hz] : float
+    "adaptive_budget" : None,                           # [1,inf) : int trials, None for the uniform grid's
+    "adaptive_initial_points" : 5,                      # [2,inf) : int, size of the coarse grid
+    "adaptive_threshold" : 11.0,                        # [0,100] : float [%] or None, QBER refined around
+    "adaptive_min_step" : 1.0,                          # (0,inf) : float, narrowest interval split
+    "adaptive_tolerance" : 0.02,                        # [0,inf) : float, flatter intervals aren't split
 }
 
-def detector_efficiency_tests():
+def early_stopping():
+    """
+    Returns the early stopping settings of CONFIG as keyword arguments of create_task
+    """
+    settings = {
+        "target_width" : CONFIG["target_confidence_interval_width"],
+        "batch_size" : CONFIG["batch_size"],
+        "confidence" : CONFIG["confidence"],
+    }
+    return settings
+
+def run_sweep(tasks: list):
+    """
+    Runs all the grid points of a sweep in parallel, skipping the ones found in the cache
+
+    Returns:
+        results: list of the results dicts, in the order of tasks
+    """
+    cache = ResultCache(CONFIG["cache_path"]) if CONFIG["cache_path"] is not None else None
+    runner = SweepRunner(CONFIG["number_of_workers"],CONFIG["seed"],
+                         backend=CONFIG["randomness_backend"],cache=cache,
+                         instrument=CONFIG["instrumentation"],
+                         common_random_numbers=CONFIG["common_random_numbers"])
+    print(f"Running {len(tasks)} grid points on {runner.max_workers} workers with seed {runner.seed}")
+    progress = ProgressReporter(len(tasks),CONFIG["progress_interval"])
+    def report(index,results_dict):
+        trials = int(results_dict["number_of_trials"])
+        progress.update(1,trials,trials * tasks[index]["key_length"])
+    results = runner.run(tasks,callback=report)
+    if cache is not None:
+        cache.close()
+    trials = [results_dict["number_of_trials"] for results_dict in results]
+    print(f"Simulated {sum(trials)} trials, between {min(trials)} and {max(trials)} per grid point")
+    if CONFIG["instrumentation"]:
+        export_metrics(tasks,results)
+    return results
+
+def export_metrics(tasks: list,results: list):
+    """
+    Writes the metrics of every grid point and their total as JSON and in the Prometheus text
+    format, and prints where the time went
+    """
+    grid_points = []
+    labelled_metrics = []
+    total = Metrics()
+    for task,results_dict in zip(tasks,results):
+        metrics = Metrics.from_results(results_dict)
+        labels = {
+            "key_length" : task["key_length"],
+            "emitter_efficiency" : task["alice"]["emitter_efficiency"],
+            "detector_efficiency" : task["bob"]["detector_efficiency"],
+            "eve" : task["eve"]["exists"],
+            "tactic" : task["tactic"],
+        }
+        grid_points.append({"labels":labels,"metrics":metrics.to_dict()})
+        labelled_metrics.append((labels,metrics))
+        total.merge(metrics)
+    with open(CONFIG["metrics_path"] + ".json",'w',encoding='utf-8') as file:
+        json.dump({"total":total.to_dict(),"grid_points":grid_points},file,indent=2)
+    with open(CONFIG["metrics_path"] + ".prom",'w',encoding='utf-8') as file:
+        file.write(to_prometheus(labelled_metrics))
+    for name in sorted(total.seconds,key=total.seconds.get,reverse=True):
+        print(f"{name:<30} {total.seconds[name]:10.3f} s in {total.calls[name]} calls")
+
+def run_spec(sweep: str,plot: bool = True):
+    """
+    Runs the grid of a sweep defined in sweep_spec.SWEEP_SPECS, stores its results as a columnar
+    dataset and draws its figures from that dataset
+
+    Args:
+        sweep: str name of the sweep, one of "detector", "emitter", "system", "eve_tactic"
+        plot: bool, when False the figures aren't drawn, see plotting.replot to draw them later
+    Returns:
+        (tasks, results): lists of the grid points and of their results dicts
+    """
+    spec = SWEEP_SPECS[sweep]
+    tasks,rows = build_grid(spec,CONFIG,early_stopping())
+    total_iter = CONFIG["number_of_iterations_per_simulation"] * len(tasks)
+    print(f"Simulation for {spec['description']} : total number of iterations = {total_iter}")
+    results = run_sweep(tasks)
+    path = CONFIG["dataset_path"].format(sweep=sweep)
+    save_dataset(path,to_columns(rows,results),{"sweep":sweep,"config":CONFIG})
+    if plot:
+        replot(path,CONFIG["number_of_workers"])
+    return tasks,results
+
+def run_adaptive(sweep: str,plot: bool = True):
+    """
+    Runs a sweep of sweep_spec.SWEEP_SPECS on an adaptively refined grid, see adaptive.refine,
+    stores its results as a columnar dataset and draws its figures from that dataset
+
+    Args:
+        sweep: str name of the sweep, one of "detector", "emitter", "system", "eve_tactic"
+        plot: bool, when False the figures aren't drawn
+    Returns:
+        (tasks, results): lists of the grid points and of their results dicts
+    """
+    spec = SWEEP_SPECS[sweep]
+    print(f"Adaptive simulation for {spec['description']}")
+    tasks,rows,results = refine(spec,CONFIG,run_sweep,
+                                budget=CONFIG["adaptive_budget"],
+                                number_of_points=CONFIG["adaptive_initial_points"],
+                                threshold=CONFIG["adaptive_threshold"],
+                                min_step=CONFIG["adaptive_min_step"],
+                                tolerance=CONFIG["adaptive_tolerance"],
+                                task_options=early_stopping())
+    x_values = sorted({row["x"] for row in rows})
+    print(f"Refined grid of {len(x_values)} points : {x_values}")
+    path = CONFIG["dataset_path"].format(sweep="adaptive_" + sweep)
+    save_dataset(path,to_columns(rows,results),{"sweep":sweep,"config":CONFIG,"panels":"adaptive"})
+    if plot:
+        replot(path,CONFIG["number_of_workers"])
+    return tasks,results
+
+def decoy_state():
+    """
+    Returns the decoy state settings of CONFIG as the decoy_state argument of key_rate.key_rates
+    """
+    settings = CONFIG["decoy_state"]
+    channel = Channel(settings["distance"],settings["attenuation"],settings["detection_efficiency"],
+                      settings["dark_count_rate"],pulse_rate=settings["pulse_rate"])
+    return {"transmittance" : channel.transmittance,
+            "dark_count_probability" : channel.dark_count_probability,
+            "signal" : settings["signal"],
+            "decoy" : settings["decoy"]}
+
+def run_key_rate(sweep: str,plot: bool = True):
+    """
+    Evaluates the secret key rate bounds of key_rate on the grid of a sweep for the key lengths
+    of "key_rate_key_lengths", without simulating anything, stores them as a columnar dataset and
+    draws its secure region figures
+
+    Args:
+        sweep: str name of the sweep, one of "detector", "emitter", "system", "eve_tactic"
+        plot: bool, when False the figures aren't drawn
+    Returns:
+        columns: dict of the dataset columns
+    """
+    config = dict(CONFIG,key_lengths=CONFIG["key_rate_key_lengths"])
+    start = time.perf_counter()
+    columns = key_rate_columns(sweep,config,decoy_state(),
+                               efficiency=CONFIG["reconciliation_efficiency"],
+                               security_parameter=CONFIG["security_parameter"])
+    print(f"Key rates of {len(columns['x'])} grid points in {(time.perf_counter() - start) * 1e3:.1f} ms")
+    path = CONFIG["dataset_path"].format(sweep="key_rate_" + sweep)
+    save_dataset(path,columns,{"sweep":sweep,"config":config,"panels":"key_rate"})
+    if plot:
+        replot(path,CONFIG["number_of_workers"])
+    return columns
+
+def detector_efficiency_tests(plot: bool = True):
     """
     This function performs simulations for all given detector efficiencies
     """
-    no_iterations = CONFIG["number_of_iterations_per_simulation"]
-    total_iter = no_iterations*len(CONFIG["detector_efficiencies"])*len(CONFIG["eavesdropping"])*len(CONFIG["key_lengths"])
-    print(f"Simulation for detector efficiency : total number of iterations = {total_iter}")
-    iteration = 1
-    for key_length in CONFIG["key_lengths"]:
-        x_list = []
-        y_lists = [[],[],[],[]]
-        for eavesdropper in CONFIG["eavesdropping"]:
-            for det_eff in CONFIG["detector_efficiencies"]:
-                temp_result = [[],[]]
-                for j in range(no_iterations):
-                    print(f"Simulating detector tests # {iteration} / {total_iter} with config {key_length,det_eff,eavesdropper}")
-                    alice_config = Simulation.create_configuration_dict(emitter_efficiency=100)
-                    bob_config = Simulation.create_configuration_dict(detector_efficiency=det_eff)
-                    eve_config = Simulation.create_configuration_dict(100,100,eavesdropper)
-                    sim = Simulation(alice_config,bob_config,eve_config)
-                    results_dict = sim.simulate(key_length,0)
-                    temp_result[0].append(results_dict["error_rate"])
-                    temp_result[1].append(len(results_dict["final_key"]))
-                    iteration+=1
-                x_list.append(det_eff)
-                y_lists[0].append(average(temp_result[0]))
-                y_lists[1].append(mode(temp_result[0])[0])
-                y_lists[2].append(average(temp_result[1]))
-                y_lists[3].append(mode(temp_result[1])[0])
-        fig,axes = plt.subplots(2,2,figsize=(20,20))
-        for k in range(4):
-            axes[k%2, int(k/2.0)].plot(x_list[0:len(CONFIG["detector_efficiencies"])],y_lists[k][0:len(CONFIG["detector_efficiencies"])],color = 'blue',label="without Eve")
-            axes[k%2, int(k/2.0)].plot(x_list[len(CONFIG["detector_efficiencies"]):-1],y_lists[k][len(CONFIG["detector_efficiencies"]):-1],'--r',label="with Eve")
-            axes[k%2, int(k/2.0)].legend(fontsize=12,loc='best')
-            axes[k%2, int(k/2.0)].set_title(f"{'Mode' if k%2 else 'Average'} {'quantum bit error rate' if k in [0,1] else 'usable key length'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_ylabel(f"{'quantum bit error rate [%]' if k in [0,1] else 'usable key length [bit]'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_xlabel('Detector efficiency [%]',fontsize=20)
-        fig.savefig(f"test_detector_{key_length}.png")
-
-
-def emitter_efficiency_tests():
+    return run_spec("detector",plot)
+
+def emitter_efficiency_tests(plot: bool = True):
     """
     This function performs simulations for all given emitter efficiencies
     """
-    no_iterations = CONFIG["number_of_iterations_per_simulation"]
-    total_iter = no_iterations * len(CONFIG["emitter_efficiencies"])*len(CONFIG["eavesdropping"])*len(CONFIG["key_lengths"])
-    print(f"Simulation for emitter efficiency : total number of iterations = {total_iter}")
-    iteration = 1
-    for key_length in CONFIG["key_lengths"]:
-        x_list = []
-        y_lists = [[],[],[],[]]
-        for eavesdropper in CONFIG["eavesdropping"]:
-            for emi_eff in CONFIG["emitter_efficiencies"]:
-                temp_result = [[],[]]
-                for j in range(no_iterations):
-                    print(f"Simulating emitter test # {iteration} / {total_iter} with config {key_length,emi_eff,eavesdropper}")
-                    alice_config = Simulation.create_configuration_dict(emitter_efficiency=emi_eff)
-                    bob_config = Simulation.create_configuration_dict(detector_efficiency=100)
-                    eve_config = Simulation.create_configuration_dict(100,100,eavesdropper)
-                    sim = Simulation(alice_config,bob_config,eve_config)
-                    results_dict = sim.simulate(key_length,0)
-                    temp_result[0].append(results_dict["error_rate"])
-                    temp_result[1].append(len(results_dict["final_key"]))
-                    iteration+=1
-                x_list.append(emi_eff)
-                y_lists[0].append(average(temp_result[0]))
-                y_lists[1].append(mode(temp_result[0])[0])
-                y_lists[2].append(average(temp_result[1]))
-                y_lists[3].append(mode(temp_result[1])[0])
-        fig,axes = plt.subplots(2,2,figsize=(20,20))
-        for k in range(4):
-            axes[k%2, int(k/2.0)].plot(x_list[0:len(CONFIG["emitter_efficiencies"])],y_lists[k][0:len(CONFIG["emitter_efficiencies"])],color = 'blue',label="without Eve")
-            axes[k%2, int(k/2.0)].plot(x_list[len(CONFIG["emitter_efficiencies"]):-1],y_lists[k][len(CONFIG["emitter_efficiencies"]):-1],'--r',label="with Eve")
-            axes[k%2, int(k/2.0)].legend(fontsize=12,loc='best')
-            axes[k%2, int(k/2.0)].set_title(f"{'Mode' if k%2 else 'Average'} {'quantum bit error rate' if k in [0,1] else 'usable key length'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_ylabel(f"{'quantum bit error rate [%]' if k in [0,1] else 'usable key length [bit]'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_xlabel('Emitter efficiency [%]',fontsize=20)
-        fig.savefig(f"test_emitter_{key_length}.png")
-
-def system_efficiency_tests():
+    return run_spec("emitter",plot)
+
+def system_efficiency_tests(plot: bool = True):
     """
     This function performs simulations for all given system efficiencies
     """
-    no_iterations = CONFIG["number_of_iterations_per_simulation"]
-    total_iter = no_iterations*len(CONFIG["system_efficiencies"])*len(CONFIG["eavesdropping"])*len(CONFIG["key_lengths"])
-    print(f"Simulation for detector efficiency : total number of iterations = {total_iter}")
-    iteration = 1
-    for key_length in CONFIG["key_lengths"]:
-        x_list = []
-        y_lists = [[],[],[],[]]
-        for eavesdropper in CONFIG["eavesdropping"]:
-            for eff in CONFIG["system_efficiencies"]:
-                temp_result = [[],[]]
-                for j in range(no_iterations):
-                    print(f"Simulating detector tests # {iteration} / {total_iter} with config {key_length,eff,eavesdropper}")
-                    alice_config = Simulation.create_configuration_dict(emitter_efficiency=eff)
-                    bob_config = Simulation.create_configuration_dict(detector_efficiency=eff)
-                    eve_config = Simulation.create_configuration_dict(100,100,eavesdropper)
-                    sim = Simulation(alice_config,bob_config,eve_config)
-                    results_dict = sim.simulate(key_length,0)
-                    temp_result[0].append(results_dict["error_rate"])
-                    temp_result[1].append(len(results_dict["final_key"]))
-                    iteration+=1
-                x_list.append(eff)
-                y_lists[0].append(average(temp_result[0]))
-                y_lists[1].append(mode(temp_result[0])[0])
-                y_lists[2].append(average(temp_result[1]))
-                y_lists[3].append(mode(temp_result[1])[0])
-        fig,axes = plt.subplots(2,2,figsize=(20,20))
-        for k in range(4):
-            axes[k%2, int(k/2.0)].plot(x_list[0:len(CONFIG["system_efficiencies"])],y_lists[k][0:len(CONFIG["system_efficiencies"])],color = 'blue',label="without Eve")
-            axes[k%2, int(k/2.0)].plot(x_list[len(CONFIG["system_efficiencies"]):-1],y_lists[k][len(CONFIG["system_efficiencies"]):-1],'--r',label="with Eve")
-            axes[k%2, int(k/2.0)].legend(fontsize=12,loc='best')
-            axes[k%2, int(k/2.0)].set_title(f"{'Mode' if k%2 else 'Average'} {'quantum bit error rate' if k in [0,1] else 'usable key length'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_ylabel(f"{'quantum bit error rate [%]' if k in [0,1] else 'usable key length [bit]'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_xlabel('System efficiency [%]',fontsize=20)
-        fig.savefig(f"test_system_{key_length}.png")
-
-def eve_tactics_test():
+    return run_spec("system",plot)
+
+def eve_tactics_test(plot: bool = True):
     """
     This function performs simulations for all given eve tactics
     """
-    no_iterations = CONFIG["number_of_iterations_per_simulation"]
-    efficiencies = [i*10 for i in range(11)]
-    total_iter = no_iterations*len(efficiencies)*len(CONFIG["key_lengths"])*(len(CONFIG["eve_tactic"]) + 1)
-    print(f"Simulation for different eve tactics : total number of iterations = {total_iter}")
-    iteration = 1
-    for key_length in CONFIG["key_lengths"]:
-        x_list = [[],[]]
-        y_lists = [[],[],[],[]]
-        y_lists_2 = [[],[],[],[]]
-        label_list = []
-        for tactic in CONFIG["eve_tactic"]:
-            label_list.append("Tactic #" + str(tactic))
-            for eff in efficiencies:
-                temp_result = [[],[]]
-                for j in range(no_iterations):
-                    print(f"Simulating eve tactic test # {iteration} / {total_iter} with config {key_length,eff,tactic}")
-                    alice_config = Simulation.create_configuration_dict(emitter_efficiency=eff)
-                    bob_config = Simulation.create_configuration_dict(detector_efficiency=eff)
-                    eve_config = Simulation.create_configuration_dict(100,100,True)
-                    sim = Simulation(alice_config,bob_config,eve_config)
-                    results_dict = sim.simulate(key_length,tactic)
-                    temp_result[0].append(results_dict["error_rate"])
-                    temp_result[1].append(len(results_dict["final_key"]))
-                    iteration+=1
-                x_list[0].append(eff)
-                y_lists[0].append(average(temp_result[0]))
-                y_lists[1].append(mode(temp_result[0])[0])
-                y_lists[2].append(average(temp_result[1]))
-                y_lists[3].append(mode(temp_result[1])[0])
-        for eff in efficiencies:
-            temp_result = [[],[]]
-            for j in range(no_iterations):
-                print(f"Simulating eve tactic test # {iteration} / {total_iter} with config {key_length,eff,'no Eve'}")
-                alice_config = Simulation.create_configuration_dict(emitter_efficiency=eff)
-                bob_config = Simulation.create_configuration_dict(detector_efficiency=eff)
-                eve_config = Simulation.create_configuration_dict(100,100,False)
-                sim = Simulation(alice_config,bob_config,eve_config)
-                results_dict = sim.simulate(key_length,0)
-                temp_result[0].append(results_dict["error_rate"])
-                temp_result[1].append(len(results_dict["final_key"]))
-                iteration+=1
-            x_list[1].append(eff)
-            y_lists_2[0].append(average(temp_result[0]))
-            y_lists_2[1].append(mode(temp_result[0])[0])
-            y_lists_2[2].append(average(temp_result[1]))
-            y_lists_2[3].append(mode(temp_result[1])[0])
-        fig,axes = plt.subplots(2,2,figsize=(20,20))
-        for k in range(4):
-            for l in range(len(CONFIG["eve_tactic"])):
-                axes[k%2, int(k/2.0)].plot(x_list[0][l*len(efficiencies):(l+1)*len(efficiencies)],y_lists[k][l*len(efficiencies):(l+1)*len(efficiencies)],label=label_list[l])
-                axes[k%2, int(k/2.0)].legend(fontsize=12,loc='best')
-                axes[k%2, int(k/2.0)].set_title(f"{'Mode' if k%2 else 'Average'} {'quantum bit error rate' if k in [0,1] else 'usable key length'}",fontsize=20)
-                axes[k%2, int(k/2.0)].set_ylabel(f"{'quantum bit error rate [%]' if k in [0,1] else 'usable key length [bit]'}",fontsize=20)
-                axes[k%2, int(k/2.0)].set_xlabel('Emitter and detector efficiency [%]',fontsize=20)
-        for k in range(4):
-            axes[k%2, int(k/2.0)].plot(x_list[1],y_lists_2[k],label="Without Eve")
-            axes[k%2, int(k/2.0)].legend(fontsize=12,loc='best')
-            axes[k%2, int(k/2.0)].set_title(f"{'Mode' if k%2 else 'Average'} {'quantum bit error rate' if k in [0,1] else 'usable key length'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_ylabel(f"{'quantum bit error rate [%]' if k in [0,1] else 'usable key length [bit]'}",fontsize=20)
-            axes[k%2, int(k/2.0)].set_xlabel('Emitter and detector efficiency [%]',fontsize=20)
-        fig.savefig(f"test_eve_tactic_{key_length}.png")
+    return run_spec("eve_tactic",plot)
 
 def main():
     """
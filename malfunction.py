@@ -0,0 +1,74 @@
+"""
+This module contains the malfunction mask generator shared by Human and VectorHuman
+"""
+import numpy as np
+from randomness import RandomnessBackend
+
+
+# Below this chance of a malfunction (0-1) the faults are found by skipping from one to the next
+SKIP_SAMPLING_THRESHOLD = 0.05
+
+def malfunction_probability(chance_of_malfunction):
+    """
+    Args:
+        chance_of_malfunction: float or array between 0-100 equal to the chance of device malfunctioning
+    Returns:
+        probability: float or float array between 0-1
+    """
+    probability = np.clip(np.asarray(chance_of_malfunction,dtype=float) / 100.0,0.0,1.0)
+    return float(probability) if probability.ndim == 0 else probability
+
+def fault_indices(rng: RandomnessBackend,probability: float,number_of_photons: int):
+    """
+    Geometric skip sampling: the gaps between two faults are drawn instead of a coin per photon,
+    so the cost scales with the number of faults rather than with the number of photons
+
+    Args:
+        rng: RandomnessBackend used for the draws
+        probability: float between 0-1 equal to the chance of a fault
+        number_of_photons: int equal to the number of photons in the beam
+    Returns:
+        indices: sorted int64 array of the photons which were hit
+    """
+    if probability <= 0 or number_of_photons <= 0:
+        return np.zeros(0,dtype=np.int64)
+    indices = []
+    position = -1
+    while True:
+        # Enough gaps to reach the end of the beam in all but a tiny fraction of the draws
+        expected = (number_of_photons - 1 - position) * probability
+        gaps = rng.geometric(probability,int(expected + 5 * np.sqrt(expected) + 16))
+        steps = position + np.cumsum(gaps)
+        indices.append(steps[steps < number_of_photons])
+        if steps[-1] >= number_of_photons:
+            break
+        position = int(steps[-1])
+    return np.concatenate(indices)
+
+def malfunction_mask(rng: RandomnessBackend,chance_of_malfunction: float,shape):
+    """
+    Decides for a whole beam which photons were hit by a device malfunction and whether the
+    malfunction changed the value or the base of the photon
+
+    Args:
+        rng: RandomnessBackend used for the draws
+        chance_of_malfunction: float between 0-100 equal to the chance of device malfunctioning,
+                               used at full floating point precision
+        shape: int or tuple equal to the shape of the photon arrays
+    Returns:
+        (malfunction, flip_value): bool arrays of the given shape, the base of a photon is
+                                   flipped where malfunction & ~flip_value
+    """
+    shape = tuple(np.atleast_1d(shape).astype(int).tolist())
+    number_of_photons = int(np.prod(shape))
+    probability = malfunction_probability(chance_of_malfunction)
+    malfunction = np.zeros(number_of_photons,dtype=bool)
+    flip_value = np.zeros(number_of_photons,dtype=bool)
+    if probability < SKIP_SAMPLING_THRESHOLD:
+        indices = fault_indices(rng,probability,number_of_photons)
+        malfunction[indices] = True
+        flip_value[indices] = rng.bits(len(indices)).astype(bool)
+    else:
+        malfunction = rng.bernoulli(probability,number_of_photons)
+        flip_value[malfunction] = rng.bits(int(np.count_nonzero(malfunction))).astype(bool)
+    return malfunction.reshape(shape),flip_value.reshape(shape)
@@ -0,0 +1,247 @@
+"""
+This module contains class Network which simulates a quantum key distribution mesh of many nodes
+"""
+import heapq
+from key_rate import RECONCILIATION_EFFICIENCY,asymptotic_key_rate,finite_key_length
+from simulation import Simulation
+from sweep import SweepRunner,create_task
+
+
+class Network():
+    """
+    Topology of nodes (Humans) joined by BB84 links, each link possibly tapped by an Eve.
+    Every link is simulated as a batch of independent key exchange sessions and all links are
+    run concurrently by a SweepRunner, which derives the random stream of every link from the root
+    seed. The secret key rate of a link is what remains of its sifted key after error
+    correction and privacy amplification, see key_rate. Nodes act as trusted relays: a key
+    between two distant nodes is forwarded hop by hop, each hop consuming as much key as is
+    forwarded, so a route delivers at most the key rate of its slowest link.
+    """
+    def __init__(self,
+                pulse_rate: float = 1e6,
+                qber_threshold: float = 11.0,
+                block_length: int = 10**8,
+                efficiency: float = RECONCILIATION_EFFICIENCY):
+        """
+        Args:
+            pulse_rate: float number of photons emitted per second on every link
+            qber_threshold: float, links whose error rate [%] exceeds it are aborted and give no key
+            block_length: int number of pulses whose sifted key is distilled at once, the
+                          finite-size bound of key_rate.finite_key_length is applied to blocks of
+                          this length, None for the asymptotic rate
+            efficiency: float reconciliation efficiency, leaked bits per Shannon limit
+        """
+        self.pulse_rate = pulse_rate
+        self.qber_threshold = qber_threshold
+        self.block_length = block_length
+        self.efficiency = efficiency
+        self.nodes = {}
+        self.links = []
+    def add_node(self,name: str,emitter_efficiency: float = 100.0,detector_efficiency: float = 100.0):
+        """
+        Adds a node with its own emitter and detector
+        """
+        if name in self.nodes:
+            raise KeyError(f"Node {name} already exists")
+        self.nodes[name] = {"emitter_efficiency":emitter_efficiency,
+                            "detector_efficiency":detector_efficiency}
+    def add_link(self,
+                sender: str,
+                receiver: str,
+                eve: dict = None,
+                tactic: int = 0,
+                key_length: int = 1000):
+        """
+        Adds a link on which sender emits and receiver detects, keys can be relayed both ways
+
+        Args:
+            eve: dict config of an eavesdropper on the link, see Simulation.create_configuration_dict
+            tactic: int defining which eve's tactic's to be used
+            key_length: int number of photons emitted per session
+        """
+        for name in (sender,receiver):
+            if name not in self.nodes:
+                raise KeyError(f"Unknown node {name}")
+        self.links.append({"sender":sender,
+                           "receiver":receiver,
+                           "eve":eve if eve is not None else Simulation.create_configuration_dict(exists=False),
+                           "tactic":tactic,
+                           "key_length":key_length})
+    def tasks(self,number_of_sessions: int):
+        """
+        Returns:
+            tasks: list with one sweep task per link, see sweep.create_task
+        """
+        tasks = []
+        for link in self.links:
+            alice = Simulation.create_configuration_dict(
+                emitter_efficiency=self.nodes[link["sender"]]["emitter_efficiency"])
+            bob = Simulation.create_configuration_dict(
+                detector_efficiency=self.nodes[link["receiver"]]["detector_efficiency"])
+            tasks.append(create_task(link["key_length"],alice,bob,link["eve"],link["tactic"],
+                                     number_of_sessions))
+        return tasks
+    def simulate(self,
+                number_of_sessions: int = 100,
+                demands: list = None,
+                runner: SweepRunner = None):
+        """
+        Runs number_of_sessions key exchanges on every link concurrently and routes the demands
+
+        Args:
+            number_of_sessions: int number of sessions simulated per link
+            demands: list of (source, target) node pairs wanting a shared key
+            runner: SweepRunner scheduling the links, one with the default settings when None
+        Returns:
+            results_dict: a dict
+                     scheme:
+                        {
+                        "links" : [{
+                            "sender" : str,
+                            "receiver" : str,
+                            "eve" : bool,
+                            "error_rate" : float [%] pooled over all sifted bits,
+                            "confidence_interval_error_rate" : (float, float),
+                            "sifted_key_length" : float [bit per session],
+                            "final_key_length" : float [bit per session],
+                            "secure" : bool,
+                            "key_rate" : float [bit/s] of secret key
+                            }],
+                        "demands" : [{
+                            "source" : str,
+                            "target" : str,
+                            "path" : list of str || None,
+                            "throughput" : float [bit/s]
+                            }],
+                        "total_throughput" : float [bit/s]
+                        }
+        """
+        runner = runner if runner is not None else SweepRunner()
+        summaries = runner.run(self.tasks(number_of_sessions))
+        links = []
+        for link,summary in zip(self.links,summaries):
+            error_rate = summary.get("pooled_error_rate",100.0)
+            sifted_key_length = summary["average_sifted_key_length"]
+            key_rate = self.secret_key_rate(sifted_key_length / link["key_length"],error_rate)
+            links.append({
+                "sender" : link["sender"],
+                "receiver" : link["receiver"],
+                "eve" : bool(link["eve"]["exists"]),
+                "error_rate" : error_rate,
+                "confidence_interval_error_rate" : summary.get("confidence_interval_pooled_error_rate",(0.0,100.0)),
+                "sifted_key_length" : sifted_key_length,
+                "final_key_length" : summary["average_final_key_length"],
+                "secure" : key_rate > 0,
+                "key_rate" : key_rate,
+            })
+        routed = self.route(links,demands or [])
+        results_dict = {
+            "links" : links,
+            "demands" : routed,
+            "total_throughput" : sum(demand["throughput"] for demand in routed),
+        }
+        return results_dict
+    def secret_key_rate(self,sifting_ratio: float,error_rate: float):
+        """
+        Secret key rate of a link: the error correction leakage f h(e) and the phase error
+        term are subtracted from its sifted bits, over blocks of block_length pulses
+
+        Args:
+            sifting_ratio: float sifted bits per emitted pulse
+            error_rate: float [%] of the sifted bits
+        Returns:
+            key_rate: float [bit/s], 0 when the error rate exceeds qber_threshold
+        """
+        if error_rate > self.qber_threshold:
+            return 0.0
+        if self.block_length is None:
+            rate = asymptotic_key_rate(error_rate / 100.0,self.efficiency,sifting_ratio)
+        else:
+            rate = finite_key_length(sifting_ratio * self.block_length,error_rate / 100.0,
+                                     self.efficiency) / self.block_length
+        return float(rate) * self.pulse_rate
+    def widest_path(self,links: list,source: str,target: str):
+        """
+        Route with the highest bottleneck key rate, found with a modified Dijkstra
+
+        Args:
+            links: list of link results dicts holding "sender", "receiver" and "key_rate"
+        Returns:
+            (path, bottleneck, hops): list of node names or None if the nodes aren't connected
+                                      by secure links, float key rate of its slowest link and
+                                      list of the indices of the links the path was chosen by
+        """
+        neighbours = {name:[] for name in self.nodes}
+        for index,link in enumerate(links):
+            if link["key_rate"] > 0:
+                neighbours[link["sender"]].append((link["receiver"],index))
+                neighbours[link["receiver"]].append((link["sender"],index))
+        best = {source:float("inf")}
+        previous = {}
+        queue = [(-float("inf"),source)]
+        while queue:
+            width,node = heapq.heappop(queue)
+            width = -width
+            if node == target:
+                break
+            if width < best.get(node,0):
+                continue
+            for neighbour,index in neighbours[node]:
+                candidate = min(width,links[index]["key_rate"])
+                if candidate > best.get(neighbour,0):
+                    best[neighbour] = candidate
+                    previous[neighbour] = (node,index)
+                    heapq.heappush(queue,(-candidate,neighbour))
+        if target not in previous and source != target:
+            return None,0.0,[]
+        path = [target]
+        hops = []
+        while path[-1] != source:
+            node,index = previous[path[-1]]
+            path.append(node)
+            hops.append(index)
+        return path[::-1],best[target],hops[::-1]
+    def route(self,links: list,demands: list):
+        """
+        Routes every demand along its widest path. A link used by several demands shares its key
+        rate equally between them.
+
+        Returns:
+            routed: list of dicts holding "source", "target", "path" and "throughput"
+        """
+        widest = [self.widest_path(links,source,target) for source,target in demands]
+        load = {}
+        for path,bottleneck,hops in widest:
+            for hop in hops:
+                load[hop] = load.get(hop,0) + 1
+        routed = []
+        for (source,target),(path,bottleneck,hops) in zip(demands,widest):
+            if path is None:
+                throughput = 0.0
+            elif not hops:
+                throughput = float("inf")
+            else:
+                throughput = min(links[hop]["key_rate"] / load[hop] for hop in hops)
+            routed.append({"source":source,"target":target,"path":path,"throughput":throughput})
+        return routed
+
+def main():
+    """
+    Basic test: a ring of four nodes with a chord, one link being tapped
+    """
+    network = Network()
+    for name,efficiency in [("A",99),("B",98),("C",97),("D",99)]:
+        network.add_node(name,efficiency,efficiency)
+    network.add_link("A","B")
+    network.add_link("B","C")
+    network.add_link("C","D",eve=Simulation.create_configuration_dict(100,100,True))
+    network.add_link("D","A")
+    network.add_link("A","C")
+    results_dict = network.simulate(50,[("A","C"),("B","D")],SweepRunner(backend="numpy",seed=0))
+    for link in results_dict["links"]:
+        print(link["sender"],link["receiver"],round(link["error_rate"],2),link["key_rate"])
+    for demand in results_dict["demands"]:
+        print(demand["source"],demand["target"],demand["path"],demand["throughput"])
+
+if __name__ == "__main__":
+    main()
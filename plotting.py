@@ -0,0 +1,104 @@
+"""
+This module contains the plotting stage which redraws the sweep figures from a sweep dataset
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dataset import load_dataset,select
+from sweep_spec import PANEL_SETS,SWEEP_SPECS,expand_series
+
+
+def pyplot():
+    """
+    Imports matplotlib.pyplot on first use with the non-interactive Agg backend, so that sweeps
+    which aren't plotted don't pay for importing it
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def _series_styles(spec: dict,config: dict):
+    """
+    Returns the style of every series index of a sweep, empty when the config isn't known
+    """
+    try:
+        return [series["style"] for series in expand_series(spec,config)]
+    except KeyError:
+        return []
+
+def draw_figure(columns: dict,
+                sweep: str,
+                key_length: int,
+                config: dict = None,
+                path: str = None,
+                panels: str = "simulation"):
+    """
+    Draws the 2 x 2 figure of a single key length and saves it
+
+    Args:
+        columns: dict returned by dataset.load_dataset
+        sweep: str name of the sweep in SWEEP_SPECS
+        key_length: int selecting the rows to be drawn
+        config: dict the sweep was run with, used for the styles of the series
+        path: str file name, the one in the spec when None
+        panels: str name of the panel set in sweep_spec.PANEL_SETS
+    Returns:
+        path: str file name of the saved figure
+    """
+    plt = pyplot()
+    spec = SWEEP_SPECS[sweep]
+    panel_list,prefix = PANEL_SETS[panels]
+    styles = _series_styles(spec,config or {})
+    rows = select(columns,key_length=key_length)
+    fig,axes = plt.subplots(2,2,figsize=(20,20))
+    for k,(metric,title,y_label) in enumerate(panel_list):
+        axis = axes[k%2, int(k/2.0)]
+        for series_index in np.unique(rows["series"]):
+            series = select(rows,series=series_index)
+            style = dict(styles[int(series_index)]) if int(series_index) < len(styles) else {}
+            fmt = style.pop("fmt",None)
+            arguments = (series["x"],series[metric]) if fmt is None else (series["x"],series[metric],fmt)
+            axis.plot(*arguments,label=str(series["label"][0]),**style)
+        axis.legend(fontsize=12,loc='best')
+        axis.set_title(title,fontsize=20)
+        axis.set_ylabel(y_label,fontsize=20)
+        axis.set_xlabel(spec["x_label"],fontsize=20)
+    path = path if path is not None else prefix + spec["figure"].format(key_length=key_length)
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+def _draw_from_file(arguments: tuple):
+    """
+    Unpacks a (dataset path, sweep, key length, config, panels) tuple for ProcessPoolExecutor.map
+    """
+    path,sweep,key_length,config,panels = arguments
+    columns,metadata = load_dataset(path)
+    return draw_figure(columns,sweep,key_length,config,panels=panels)
+
+def replot(path: str,max_workers: int = None):
+    """
+    Regenerates every figure of a sweep dataset without simulating anything. The figures of
+    different key lengths are drawn in parallel processes.
+
+    Args:
+        path: str of a dataset written by main.run_spec or main.run_key_rate
+        max_workers: int number of processes, None for one per key length
+    Returns:
+        paths: list of the saved figures
+    """
+    columns,metadata = load_dataset(path)
+    sweep = metadata["sweep"]
+    config = metadata.get("config",{})
+    panels = metadata.get("panels","simulation")
+    # Keep the order in which the key lengths were swept
+    key_lengths = list(dict.fromkeys(int(key_length) for key_length in columns["key_length"]))
+    if max_workers is None:
+        max_workers = len(key_lengths)
+    if max_workers <= 1 or len(key_lengths) <= 1:
+        return [draw_figure(columns,sweep,key_length,config,panels=panels) for key_length in key_lengths]
+    arguments = [(path,sweep,key_length,config,panels) for key_length in key_lengths]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(max_workers,len(key_lengths)),mp_context=context) as executor:
+        return list(executor.map(_draw_from_file,arguments))
@@ -0,0 +1,172 @@
+"""
+This module contains the privacy amplification stage which compresses reconciled keys into
+secret keys with Toeplitz matrix universal hashing
+"""
+import math
+import time
+import numpy as np
+import instrumentation
+from reconciliation import binary_entropy
+
+
+# Bits hashed at once by a single Toeplitz matrix
+BLOCK_SIZE = 1 << 20
+# The FFT convolution is rounded to integers, which stays exact up to this block size
+MAX_BLOCK_SIZE = 1 << 24
+# Failure probability of the hashing of a single block
+SECURITY_PARAMETER = 1e-10
+
+
+def secure_length(number_of_bits: int,
+                error_rate: float,
+                leaked_bits: float,
+                security_parameter: float = SECURITY_PARAMETER):
+    """
+    Length of the secret key which can be extracted from a reconciled key: the phase error
+    rate is estimated by the bit error rate, Eve's information is bounded by n h(error rate)
+    plus every bit leaked during error correction, and 2 log2(1 / security_parameter) bits are
+    sacrificed for the hashing
+
+    Args:
+        number_of_bits: int length of the reconciled key
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        leaked_bits: float number of bits disclosed during error correction
+        security_parameter: float between 0-1
+    Returns:
+        length: int, 0 when no secret key can be extracted
+    """
+    length = (number_of_bits * (1 - binary_entropy(error_rate)) - leaked_bits
+              - 2 * math.log2(1 / security_parameter))
+    return max(0,int(math.floor(length)))
+
+def toeplitz_hash(bits: np.ndarray,output_length: int,seed_bits: np.ndarray):
+    """
+    Multiplies the key with the output_length x n Toeplitz matrix T[i, j] = seed_bits[i - j + n - 1]
+    over GF(2). The product is a slice of the linear convolution of seed_bits with the key, which
+    is computed with a real FFT in O(n log n) instead of a dense O(n m) matrix product.
+
+    Args:
+        bits: uint8 array of 0s and 1s of length n
+        output_length: int number of output bits m
+        seed_bits: uint8 array of 0s and 1s of length n + m - 1 defining the matrix
+    Returns:
+        hashed: uint8 array of output_length bits
+    """
+    number_of_bits = len(bits)
+    if output_length <= 0 or number_of_bits == 0:
+        return np.zeros(0,dtype=np.uint8)
+    if number_of_bits > MAX_BLOCK_SIZE:
+        raise ValueError(f"Blocks longer than {MAX_BLOCK_SIZE} bits can't be hashed exactly, "
+                         "use a smaller block size")
+    if len(seed_bits) != number_of_bits + output_length - 1:
+        raise ValueError("The Toeplitz matrix needs n + m - 1 seed bits")
+    size = 1 << (len(seed_bits) + number_of_bits - 2).bit_length()
+    convolution = np.fft.irfft(np.fft.rfft(seed_bits,size) * np.fft.rfft(bits,size),size)
+    window = convolution[number_of_bits - 1:number_of_bits - 1 + output_length]
+    return (np.rint(window).astype(np.int64) & 1).astype(np.uint8)
+
+def amplify_blocks(blocks,
+                error_rate: float,
+                leak_rate: float,
+                security_parameter: float = SECURITY_PARAMETER,
+                seed: int = None):
+    """
+    Streaming privacy amplification: every block of the reconciled key is hashed by its own
+    Toeplitz matrix, so a key of any length is processed with the memory of a single block.
+    Each block is charged its share of the leaked bits and its own hashing penalty.
+
+    Args:
+        blocks: iterable of uint8 arrays of 0s and 1s, e.g. a reconciled key cut into blocks
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        leak_rate: float bits leaked during error correction per reconciled bit
+        security_parameter: float between 0-1, per block
+        seed: int seed of the public Toeplitz matrices
+    Yields:
+        block_dict: a dict
+                 scheme:
+                    {
+                    "secret_key" : uint8 array,
+                    "input_length" : int,
+                    "output_length" : int,
+                    "seconds" : float,
+                    "throughput" : float [Mbit/s] of reconciled key
+                    }
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    for bits in blocks:
+        start = time.perf_counter()
+        bits = np.asarray(bits,dtype=np.uint8)
+        output_length = secure_length(len(bits),error_rate,leak_rate * len(bits),security_parameter)
+        generator = np.random.default_rng(seed_sequence.spawn(1)[0])
+        seed_bits = generator.integers(0,2,len(bits) + output_length - 1,dtype=np.uint8)
+        with instrumentation.stage("privacy_amplification"):
+            secret_key = toeplitz_hash(bits,output_length,seed_bits)
+        seconds = time.perf_counter() - start
+        instrumentation.count("secret_bits",output_length)
+        yield {
+            "secret_key" : secret_key,
+            "input_length" : len(bits),
+            "output_length" : output_length,
+            "seconds" : seconds,
+            "throughput" : len(bits) / seconds / 1e6 if seconds > 0 else float("inf"),
+        }
+
+def amplify(key: np.ndarray,
+            error_rate: float,
+            leaked_bits: float,
+            block_size: int = BLOCK_SIZE,
+            security_parameter: float = SECURITY_PARAMETER,
+            seed: int = None):
+    """
+    Compresses a whole reconciled key with amplify_blocks
+
+    Args:
+        key: uint8 array of 0s and 1s, the reconciled key
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        leaked_bits: float number of bits disclosed during error correction
+        block_size: int bits per Toeplitz matrix, at most MAX_BLOCK_SIZE
+    Returns:
+        results_dict: a dict
+                 scheme:
+                    {
+                    "secret_key" : uint8 array,
+                    "secret_key_length" : int,
+                    "block_input_length" : int array,
+                    "block_output_length" : int array,
+                    "block_throughput" : float array [Mbit/s],
+                    "seconds" : float,
+                    "throughput" : float [Mbit/s] of reconciled key
+                    }
+    """
+    key = np.asarray(key,dtype=np.uint8)
+    leak_rate = leaked_bits / len(key) if len(key) else 0.0
+    blocks = (key[low:low + block_size] for low in range(0,len(key),block_size))
+    block_dicts = list(amplify_blocks(blocks,error_rate,leak_rate,security_parameter,seed))
+    seconds = sum(block_dict["seconds"] for block_dict in block_dicts)
+    if block_dicts:
+        secret_key = np.concatenate([block_dict["secret_key"] for block_dict in block_dicts])
+    else:
+        secret_key = np.zeros(0,dtype=np.uint8)
+    results_dict = {
+        "secret_key" : secret_key,
+        "secret_key_length" : len(secret_key),
+        "block_input_length" : np.array([block_dict["input_length"] for block_dict in block_dicts],dtype=np.int64),
+        "block_output_length" : np.array([block_dict["output_length"] for block_dict in block_dicts],dtype=np.int64),
+        "block_throughput" : np.array([block_dict["throughput"] for block_dict in block_dicts]),
+        "seconds" : seconds,
+        "throughput" : len(key) / seconds / 1e6 if seconds > 0 else float("inf"),
+    }
+    return results_dict
+
+def amplify_results(reconciliation: dict,error_rate: float,**options):
+    """
+    Runs amplify on the results dict returned by reconciliation.reconcile
+
+    Args:
+        reconciliation: dict holding "reconciled_key" and "leaked_bits"
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        options: keyword arguments of amplify
+    Returns:
+        results_dict: see amplify
+    """
+    return amplify(reconciliation["reconciled_key"],error_rate,reconciliation["leaked_bits"],**options)
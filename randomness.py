@@ -0,0 +1,193 @@
+"""
+This module contains the randomness backends used by Human, VectorHuman and Simulation
+"""
+import os
+import numpy as np
+from entropy_pool import EntropyPool,shared_pool
+
+
+def _shape(shape):
+    """
+    Converts an int or tuple shape into a list
+    """
+    return np.atleast_1d(shape).astype(int).tolist()
+
+
+class RandomnessBackend():
+    """
+    Interface of a source of random bits. Every draw is batched, subclasses have to implement
+    bits and spawn, the remaining draws are derived from bits unless a backend has a faster way.
+    """
+    name = None
+    def bits(self,number_of_bits: int):
+        """
+        Returns:
+            bits: uint8 array of number_of_bits 0s and 1s
+        """
+        raise NotImplementedError
+    def spawn(self,number_of_streams: int):
+        """
+        Splits the backend into independent streams, e.g. one per node
+
+        Returns:
+            backends: list of number_of_streams RandomnessBackend instances
+        """
+        raise NotImplementedError
+    def random_bits(self,shape):
+        """
+        Returns:
+            bits: uint8 array of the given shape filled with 0s and 1s
+        """
+        shape = _shape(shape)
+        return self.bits(int(np.prod(shape))).reshape(shape)
+    def integer(self,number_of_bits: int = 1):
+        """
+        Returns:
+            value: int of arbitrary width in the range of (0,2^number_of_bits - 1)
+        """
+        if number_of_bits <= 0:
+            return 0
+        packed = np.packbits(self.bits(number_of_bits))
+        padding = len(packed) * 8 - number_of_bits
+        return int.from_bytes(packed.tobytes(),'big') >> padding
+    def integers(self,number_of_bits: int,shape):
+        """
+        Args:
+            number_of_bits: int between 1-64 equal to the number of bits of every value
+            shape: int or tuple equal to the shape of the output array
+        Returns:
+            values: uint64 array with values in the range of (0,2^number_of_bits - 1)
+        """
+        weights = np.left_shift(np.uint64(1),np.arange(number_of_bits - 1,-1,-1,dtype=np.uint64))
+        return self.random_bits(_shape(shape) + [number_of_bits]).astype(np.uint64) @ weights
+    def uniform(self,shape):
+        """
+        Returns:
+            values: float array of the given shape with values in the range of [0,1)
+        """
+        return self.integers(53,shape) / float(1 << 53)
+    def bernoulli(self,probability: float,shape):
+        """
+        Args:
+            probability: float between 0-1 equal to the chance of True
+            shape: int or tuple equal to the shape of the output array
+        Returns:
+            values: bool array of the given shape
+        """
+        if probability <= 0:
+            return np.zeros(_shape(shape),dtype=bool)
+        if probability >= 1:
+            return np.ones(_shape(shape),dtype=bool)
+        return self.uniform(shape) < probability
+    def geometric(self,probability: float,size: int):
+        """
+        Args:
+            probability: float between 0-1 equal to the chance of success of every trial
+            size: int equal to the number of values
+        Returns:
+            values: int64 array of the number of trials up to and including the first success
+        """
+        if probability >= 1:
+            return np.ones(size,dtype=np.int64)
+        # Inverse transform, 1 - uniform lies in (0,1] so the logarithm stays finite
+        values = np.floor(np.log(1 - self.uniform(size)) / np.log1p(-probability)) + 1
+        return np.minimum(values,2.0 ** 62).astype(np.int64)
+
+
+class AerBackend(RandomnessBackend):
+    """
+    Quantum random bits served by an EntropyPool. All streams spawned from it share the pool,
+    the bits of a seeded pool stay reproducible as long as they're drawn in the same order.
+    """
+    name = "aer"
+    def __init__(self,seed: int = None,pool: EntropyPool = None):
+        if pool is None:
+            pool = shared_pool() if seed is None else EntropyPool(seed=seed)
+        self.pool = pool
+    def bits(self,number_of_bits: int):
+        return self.pool.bits(number_of_bits)
+    def spawn(self,number_of_streams: int):
+        return [self for i in range(number_of_streams)]
+
+
+class NumpyBackend(RandomnessBackend):
+    """
+    Pseudo random bits drawn from a numpy Generator, seeded through a SeedSequence so that
+    spawned streams (e.g. one per node) are independent and reproducible
+    """
+    name = "numpy"
+    BIT_GENERATORS = ["PCG64","PCG64DXSM","Philox","SFC64"]
+    def __init__(self,seed: int = None,bit_generator: str = "PCG64"):
+        if bit_generator not in self.BIT_GENERATORS:
+            raise ValueError(f"Unknown bit generator {bit_generator}")
+        if isinstance(seed,np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.bit_generator = bit_generator
+        self.generator = np.random.Generator(getattr(np.random,bit_generator)(self.seed_sequence))
+    def bits(self,number_of_bits: int):
+        return self.generator.integers(0,2,number_of_bits,dtype=np.uint8)
+    def spawn(self,number_of_streams: int):
+        return [NumpyBackend(seed,self.bit_generator)
+                for seed in self.seed_sequence.spawn(number_of_streams)]
+    def random_bits(self,shape):
+        return self.generator.integers(0,2,_shape(shape),dtype=np.uint8)
+    def integer(self,number_of_bits: int = 1):
+        if number_of_bits <= 0:
+            return 0
+        number_of_bytes = -(-number_of_bits // 8)
+        padding = number_of_bytes * 8 - number_of_bits
+        return int.from_bytes(self.generator.bytes(number_of_bytes),'big') >> padding
+    def integers(self,number_of_bits: int,shape):
+        return self.generator.integers(0,(1 << number_of_bits) - 1,_shape(shape),
+                                       dtype=np.uint64,endpoint=True)
+    def uniform(self,shape):
+        return self.generator.random(_shape(shape))
+    def geometric(self,probability: float,size: int):
+        return self.generator.geometric(probability,size).astype(np.int64)
+
+
+class UrandomBackend(RandomnessBackend):
+    """
+    Random bits read from os.urandom, can't be seeded
+    """
+    name = "urandom"
+    def bits(self,number_of_bits: int):
+        raw = np.frombuffer(os.urandom(-(-number_of_bits // 8)),dtype=np.uint8)
+        return np.unpackbits(raw)[:number_of_bits]
+    def spawn(self,number_of_streams: int):
+        return [UrandomBackend() for i in range(number_of_streams)]
+    def integer(self,number_of_bits: int = 1):
+        if number_of_bits <= 0:
+            return 0
+        number_of_bytes = -(-number_of_bits // 8)
+        padding = number_of_bytes * 8 - number_of_bits
+        return int.from_bytes(os.urandom(number_of_bytes),'big') >> padding
+
+
+BACKENDS = {
+    "aer" : AerBackend,
+    "numpy" : NumpyBackend,
+    "urandom" : UrandomBackend,
+}
+
+def create_backend(name: str = "aer",seed=None):
+    """
+    Helper function for creating a backend by its name
+
+    Args:
+        name: str, one of "aer", "numpy", "urandom"
+        seed: int or numpy SeedSequence, ignored by "urandom"
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown randomness backend {name}")
+    if name == "urandom":
+        return UrandomBackend()
+    return BACKENDS[name](seed)
+
+def default_backend():
+    """
+    Returns the backend used when none is given: AerBackend on the process wide entropy pool
+    """
+    return AerBackend()
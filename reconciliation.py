@@ -0,0 +1,318 @@
+"""
+This module contains the error correction stage run on the sifted keys: Cascade and a fixed-rate
+LDPC decoder, both applied to independent key frames in parallel processes
+"""
+import heapq
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import instrumentation
+from sifting import pack_bits,str_to_bits,unpack_bits
+
+
+CASCADE_PASSES = 4
+# Bits per independently reconciled frame
+FRAME_SIZE = {"cascade":1 << 16,"ldpc":1 << 14}
+# Check matrix size relative to the Shannon limit when no LDPC rate is given, regular codes of
+# column weight 4 decode reliably at short frame lengths only well above it
+LDPC_EFFICIENCY = 1.8
+# Column weight 3 leaves many frames undecodable below 1 % errors, where the rate is high and
+# every band only has a few checks
+LDPC_COLUMN_WEIGHT = 4
+LDPC_MAX_ITERATIONS = 50
+# Scaling of the check messages of the normalized min-sum decoder
+MIN_SUM_NORMALIZATION = 0.8
+# Floor of the error rate, keeps block sizes and log likelihood ratios finite
+MIN_ERROR_RATE = 1e-4
+
+
+def binary_entropy(probability):
+    """
+    Args:
+        probability: float or array between 0-1
+    Returns:
+        entropy: float or float array in bits, 0 at probability 0 and 1
+    """
+    probability = np.clip(np.asarray(probability,dtype=float),0.0,1.0)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        entropy = -probability * np.log2(probability) - (1 - probability) * np.log2(1 - probability)
+    entropy = np.nan_to_num(entropy,nan=0.0)
+    return float(entropy) if entropy.ndim == 0 else entropy
+
+def cascade(alice_bits: np.ndarray,
+            bob_bits: np.ndarray,
+            error_rate: float,
+            passes: int = CASCADE_PASSES,
+            seed: np.random.SeedSequence = None):
+    """
+    Cascade: the parities of blocks of size 0.73 / error_rate, doubled on every pass, are
+    compared and an odd block is bisected down to the erroneous bit. Passes after the first
+    shuffle the key with a public permutation. Correcting a bit flips the parity of the blocks
+    holding it in the earlier passes, these are bisected again, smallest blocks first.
+
+    Args:
+        alice_bits, bob_bits: uint8 arrays of 0s and 1s of equal length
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        passes: int number of passes
+        seed: SeedSequence of the public permutations
+    Returns:
+        (corrected, leaked_bits): Bob's corrected uint8 bits and int number of disclosed parities
+    """
+    number_of_bits = len(alice_bits)
+    bob_bits = np.array(bob_bits,dtype=np.uint8)
+    if number_of_bits == 0:
+        return bob_bits,0
+    generator = np.random.default_rng(seed)
+    first_block = max(1,int(0.73 / max(error_rate,MIN_ERROR_RATE)))
+    block_sizes = []
+    orders = []
+    inverses = []
+    alice_permuted = []
+    bob_permuted = []
+    alice_parity = []
+    bob_parity = []
+    leaked_bits = 0
+    pending = []
+    def parities(bits,block_size):
+        return np.add.reduceat(bits,np.arange(0,number_of_bits,block_size),dtype=np.int64) & 1
+    for pass_index in range(passes):
+        block_size = min(first_block << pass_index,number_of_bits)
+        order = np.arange(number_of_bits) if pass_index == 0 else generator.permutation(number_of_bits)
+        inverse = np.empty(number_of_bits,dtype=np.int64)
+        inverse[order] = np.arange(number_of_bits)
+        block_sizes.append(block_size)
+        orders.append(order)
+        inverses.append(inverse)
+        alice_permuted.append(alice_bits[order])
+        bob_permuted.append(bob_bits[order])
+        alice_parity.append(parities(alice_permuted[-1],block_size))
+        bob_parity.append(parities(bob_permuted[-1],block_size))
+        leaked_bits += len(alice_parity[-1])
+        for block in np.flatnonzero(alice_parity[-1] != bob_parity[-1]):
+            heapq.heappush(pending,(pass_index,int(block)))
+        while pending:
+            current,block = heapq.heappop(pending)
+            if alice_parity[current][block] == bob_parity[current][block]:
+                continue
+            low = block * block_sizes[current]
+            high = min(low + block_sizes[current],number_of_bits)
+            alice_block = alice_permuted[current]
+            bob_block = bob_permuted[current]
+            while high - low > 1:
+                middle = (low + high) // 2
+                leaked_bits += 1
+                if (int(alice_block[low:middle].sum()) ^ int(bob_block[low:middle].sum())) & 1:
+                    high = middle
+                else:
+                    low = middle
+            position = orders[current][low]
+            bob_bits[position] ^= 1
+            for other in range(pass_index + 1):
+                index = inverses[other][position]
+                bob_permuted[other][index] ^= 1
+                other_block = index // block_sizes[other]
+                bob_parity[other][other_block] ^= 1
+                if alice_parity[other][other_block] != bob_parity[other][other_block]:
+                    heapq.heappush(pending,(other,int(other_block)))
+    return bob_bits,leaked_bits
+
+def ldpc_matrix(number_of_bits: int,rate: float,column_weight: int = LDPC_COLUMN_WEIGHT,seed: int = 0):
+    """
+    Random regular parity check matrix of Gallager's construction: the checks are split into
+    column_weight bands and every band checks a random permutation of the bits in equal groups,
+    so every bit takes part in exactly one check of every band. Edges are sorted by check.
+
+    Returns:
+        (check, variable, number_of_checks): int64 arrays of the edges and int number of rows
+    """
+    checks_per_band = max(1,int(round(number_of_bits * (1 - rate) / column_weight)))
+    generator = np.random.default_rng(seed)
+    check = []
+    variable = []
+    for band in range(column_weight):
+        permutation = generator.permutation(number_of_bits)
+        check.append(band * checks_per_band + np.arange(number_of_bits) % checks_per_band)
+        variable.append(permutation)
+    check = np.concatenate(check)
+    variable = np.concatenate(variable)
+    order = np.argsort(check,kind="stable")
+    return check[order],variable[order],checks_per_band * column_weight
+
+def syndrome(bits: np.ndarray,matrix: tuple):
+    """
+    Returns:
+        syndrome: uint8 array, the parity of every check of the matrix
+    """
+    check,variable,number_of_checks = matrix
+    return (np.bincount(check,weights=bits[variable],minlength=number_of_checks).astype(np.int64) & 1).astype(np.uint8)
+
+def ldpc_decode(target_syndrome: np.ndarray,
+                bob_bits: np.ndarray,
+                error_rate: float,
+                matrix: tuple,
+                max_iterations: int = LDPC_MAX_ITERATIONS):
+    """
+    Normalized min-sum decoding of Bob's bits towards Alice's syndrome
+
+    Returns:
+        (bits, success, iterations): decoded uint8 bits, bool whether the syndromes match and
+                                     int number of iterations
+    """
+    check,variable,number_of_checks = matrix
+    error_rate = min(max(error_rate,MIN_ERROR_RATE),0.5 - MIN_ERROR_RATE)
+    prior = math.log((1 - error_rate) / error_rate) * (1.0 - 2.0 * bob_bits)
+    starts = np.flatnonzero(np.concatenate(([True],check[1:] != check[:-1])))
+    degree = np.diff(np.concatenate((starts,[len(check)])))
+    to_check = prior[variable]
+    bits = bob_bits.astype(np.uint8)
+    for iteration in range(1,max_iterations + 1):
+        magnitude = np.abs(to_check)
+        negative = to_check < 0
+        smallest = np.repeat(np.minimum.reduceat(magnitude,starts),degree)
+        is_smallest = magnitude == smallest
+        second = np.repeat(np.minimum.reduceat(np.where(is_smallest,np.inf,magnitude),starts),degree)
+        # A tie means the other edges see the smallest magnitude as well
+        ties = np.repeat(np.add.reduceat(is_smallest.astype(np.int64),starts),degree) > 1
+        second = np.where(ties,smallest,second)
+        odd = (np.add.reduceat(negative.astype(np.int64),starts) + target_syndrome[check[starts]]) & 1
+        sign = 1.0 - 2.0 * (np.repeat(odd,degree) ^ negative.astype(np.int64))
+        to_variable = MIN_SUM_NORMALIZATION * sign * np.where(is_smallest,second,smallest)
+        posterior = prior + np.bincount(variable,weights=to_variable,minlength=len(prior))
+        bits = (posterior < 0).astype(np.uint8)
+        if np.array_equal(syndrome(bits,matrix),target_syndrome):
+            return bits,True,iteration
+        to_check = posterior[variable] - to_variable
+    return bits,False,max_iterations
+
+def _reconcile_frame(arguments: tuple):
+    """
+    Reconciles a single frame given as packed words, see reconcile
+    """
+    method,alice_words,bob_words,number_of_bits,error_rate,options,seed = arguments
+    alice_bits = unpack_bits(alice_words,number_of_bits)
+    bob_bits = unpack_bits(bob_words,number_of_bits)
+    errors = int(np.count_nonzero(alice_bits != bob_bits))
+    if method == "cascade":
+        passes = options.get("passes",CASCADE_PASSES)
+        corrected,leaked_bits = cascade(alice_bits,bob_bits,error_rate,passes,seed)
+        success = True
+    elif method == "ldpc":
+        rate = options.get("rate")
+        if rate is None:
+            rate = max(0.0,1 - LDPC_EFFICIENCY * binary_entropy(max(error_rate,MIN_ERROR_RATE)))
+        matrix = ldpc_matrix(number_of_bits,rate,seed=options.get("matrix_seed",0))
+        target_syndrome = syndrome(alice_bits,matrix)
+        corrected,success,passes = ldpc_decode(target_syndrome,bob_bits,error_rate,matrix,
+                                               options.get("max_iterations",LDPC_MAX_ITERATIONS))
+        leaked_bits = matrix[2]
+    else:
+        raise ValueError(f"Unknown reconciliation method {method}")
+    residual_errors = int(np.count_nonzero(alice_bits != corrected))
+    return {
+        "key" : pack_bits(corrected),
+        "number_of_bits" : number_of_bits,
+        "errors" : errors,
+        "residual_errors" : residual_errors,
+        "leaked_bits" : leaked_bits,
+        "passes" : passes,
+        "success" : bool(success),
+    }
+
+@instrumentation.timed("reconciliation")
+def reconcile(alice_key: np.ndarray,
+            bob_key: np.ndarray,
+            error_rate: float,
+            method: str = "cascade",
+            frame_size: int = None,
+            max_workers: int = None,
+            seed: int = None,
+            **options):
+    """
+    Corrects Bob's sifted key so that it matches Alice's. The key is cut into independent
+    frames which are reconciled in parallel processes, keys travel between processes packed into
+    64-bit words. Frames which the LDPC decoder can't correct are discarded.
+
+    Args:
+        alice_key, bob_key: uint8 arrays of 0s and 1s, the sifted keys
+        error_rate: float between 0-1, the estimated quantum bit error rate
+        method: str, "cascade" or "ldpc"
+        frame_size: int bits per frame, FRAME_SIZE[method] when None
+        max_workers: int number of processes, 1 reconciles in this process, None uses all cores
+        seed: int seed of the public permutations of Cascade
+        options: "passes" for Cascade, "rate", "max_iterations" and "matrix_seed" for LDPC
+    Returns:
+        results_dict: a dict
+                 scheme:
+                    {
+                    "reconciled_key" : uint8 array,
+                    "reconciled_key_length" : int,
+                    "sifted_key_length" : int,
+                    "leaked_bits" : int,
+                    "passes" : float, Cascade passes or mean LDPC decoder iterations per frame,
+                    "efficiency" : float, leaked bits over the Shannon limit n h(error rate),
+                    "residual_errors" : int,
+                    "failed_frames" : int,
+                    "number_of_frames" : int,
+                    "seconds" : float,
+                    "throughput" : float [Mbit/s] of sifted key
+                    }
+    """
+    start = time.perf_counter()
+    alice_key = np.asarray(alice_key,dtype=np.uint8)
+    bob_key = np.asarray(bob_key,dtype=np.uint8)
+    if len(alice_key) != len(bob_key):
+        raise ValueError("Sifted keys have to be of the same length")
+    frame_size = frame_size if frame_size is not None else FRAME_SIZE[method]
+    bounds = list(range(0,len(alice_key),frame_size))
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    arguments = [(method,pack_bits(alice_key[low:low + frame_size]),pack_bits(bob_key[low:low + frame_size]),
+                  len(alice_key[low:low + frame_size]),error_rate,options,frame_seed)
+                 for low,frame_seed in zip(bounds,seeds)]
+    if max_workers == 1 or len(arguments) <= 1:
+        frames = [_reconcile_frame(argument) for argument in arguments]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers,mp_context=context) as executor:
+            frames = list(executor.map(_reconcile_frame,arguments))
+    kept = [frame for frame in frames if frame["success"]]
+    if kept:
+        reconciled_key = np.concatenate([unpack_bits(frame["key"],frame["number_of_bits"]) for frame in kept])
+    else:
+        reconciled_key = np.zeros(0,dtype=np.uint8)
+    seconds = time.perf_counter() - start
+    errors = sum(frame["errors"] for frame in frames)
+    leaked_bits = sum(frame["leaked_bits"] for frame in frames)
+    shannon_limit = len(alice_key) * binary_entropy(errors / len(alice_key)) if len(alice_key) else 0.0
+    if instrumentation.enabled():
+        instrumentation.count("reconciled_bits",len(reconciled_key))
+        instrumentation.count("leaked_bits",leaked_bits)
+    results_dict = {
+        "reconciled_key" : reconciled_key,
+        "reconciled_key_length" : len(reconciled_key),
+        "sifted_key_length" : len(alice_key),
+        "leaked_bits" : leaked_bits,
+        "passes" : float(np.mean([frame["passes"] for frame in frames])) if frames else 0.0,
+        "efficiency" : leaked_bits / shannon_limit if shannon_limit > 0 else float("inf"),
+        "residual_errors" : sum(frame["residual_errors"] for frame in kept),
+        "failed_frames" : len(frames) - len(kept),
+        "number_of_frames" : len(frames),
+        "seconds" : seconds,
+        "throughput" : len(alice_key) / seconds / 1e6 if seconds > 0 else float("inf"),
+    }
+    return results_dict
+
+def reconcile_results(results_dict: dict,method: str = "cascade",**options):
+    """
+    Runs reconcile on the sifted keys of a results dict returned by Simulation.simulate,
+    Simulation.simulate_lossy or Simulation.qber, with the error rate it reports as the estimate.
+    Unlike its "final_key", which drops the erroneous bits by comparing the keys, only the
+    disclosed parities are used.
+
+    Returns:
+        results_dict: see reconcile
+    """
+    alice_key = str_to_bits(results_dict["alice_key_same_bases"])
+    bob_key = str_to_bits(results_dict["bob_key_same_bases"])
+    return reconcile(alice_key,bob_key,min(results_dict["error_rate"],100.0) / 100.0,method,**options)
@@ -0,0 +1,169 @@
+"""
+This module contains class ResultCache which stores simulation results on disk
+"""
+import hashlib
+import io
+import json
+import sqlite3
+import time
+import numpy as np
+
+
+# Entry of the npz blob listing the fields stored from tuples
+TUPLE_KEYS = "__tuple_keys__"
+
+
+def task_key(task: dict,backend: str = "aer",seed: int = None,mode: str = None):
+    """
+    Content address of a grid point: a hash of everything that determines its results
+
+    Args:
+        task: dict created by sweep.create_task
+        backend: str name of the randomness backend
+        seed: int root seed of the sweep, None for unseeded sweeps
+        mode: str telling apart results simulated differently, e.g. with common random numbers
+    Returns:
+        key: str hex digest
+    """
+    content = {"task":task,"backend":backend,"seed":seed}
+    if mode is not None:
+        content["mode"] = mode
+    serialized = json.dumps(content,sort_keys=True,default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+def _encode(results_dict: dict):
+    """
+    Returns:
+        (none_keys, payload): str JSON list of the None fields and bytes of the npz blob
+    """
+    arrays = {name:np.asarray(value) for name,value in results_dict.items() if value is not None}
+    tuple_keys = [name for name,value in results_dict.items() if isinstance(value,tuple)]
+    if tuple_keys:
+        arrays[TUPLE_KEYS] = np.array(tuple_keys)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer,**arrays)
+    none_keys = [name for name,value in results_dict.items() if value is None]
+    return json.dumps(none_keys),buffer.getvalue()
+
+def _decode(none_keys: str,payload: bytes):
+    """
+    Inverse of _encode
+    """
+    results_dict = {name:None for name in json.loads(none_keys)}
+    with np.load(io.BytesIO(payload),allow_pickle=False) as arrays:
+        tuple_keys = set(arrays[TUPLE_KEYS].tolist()) if TUPLE_KEYS in arrays.files else set()
+        for name in arrays.files:
+            if name == TUPLE_KEYS:
+                continue
+            value = arrays[name]
+            if name in tuple_keys:
+                results_dict[name] = tuple(value.tolist())
+            else:
+                results_dict[name] = value.item() if value.ndim == 0 else value
+    return results_dict
+
+def _equal(stored: dict,results_dict: dict):
+    """
+    Returns:
+        equal: bool, True when both dicts hold the same fields of the same kind and values
+    """
+    if stored.keys() != results_dict.keys():
+        return False
+    for name,value in results_dict.items():
+        if isinstance(value,tuple) != isinstance(stored[name],tuple) or (value is None) != (stored[name] is None):
+            return False
+        if value is not None and not np.array_equal(np.asarray(stored[name]),np.asarray(value),
+                                                    equal_nan=np.asarray(value).dtype.kind in "fc"):
+            return False
+    return True
+
+
+class ResultCache():
+    """
+    Content addressed store of results dicts backed by a SQLite file. Arrays are stored as npz
+    blobs together with the names of the tuple fields, e.g. confidence intervals, which are
+    given back as tuples so that a cached results dict equals the simulated one. Every entry
+    remembers when it was last read so that the least recently used ones can be evicted.
+    """
+    def __init__(self,path: str = "results_cache.sqlite"):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                                    key TEXT PRIMARY KEY,
+                                    config TEXT,
+                                    none_keys TEXT,
+                                    payload BLOB,
+                                    created REAL,
+                                    last_access REAL)""")
+        self.connection.commit()
+    def __contains__(self,key: str):
+        row = self.connection.execute("SELECT 1 FROM results WHERE key = ?",(key,)).fetchone()
+        return row is not None
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    def get(self,key: str):
+        """
+        Returns:
+            results_dict: the stored dict or None if there's no entry for the key
+        """
+        row = self.connection.execute("SELECT none_keys,payload FROM results WHERE key = ?",
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("UPDATE results SET last_access = ? WHERE key = ?",
+                                (time.time(),key))
+        self.connection.commit()
+        return _decode(row[0],row[1])
+    def put(self,key: str,results_dict: dict,config: dict = None):
+        """
+        Stores a results dict, its values have to be None, tuples or convertible to numpy
+        arrays. The entry is decoded again and compared to the dict, so that get returns exactly
+        what was simulated.
+
+        Args:
+            key: str created by task_key
+            results_dict: dict to be stored
+            config: dict stored alongside for inspection, e.g. the task
+        """
+        none_keys,payload = _encode(results_dict)
+        if not _equal(_decode(none_keys,payload),results_dict):
+            raise ValueError("The results dict doesn't survive being stored, its values have to be "
+                             "None, tuples or convertible to numpy arrays")
+        now = time.time()
+        self.connection.execute("INSERT OR REPLACE INTO results VALUES (?,?,?,?,?,?)",
+                                (key,json.dumps(config,sort_keys=True,default=str),
+                                 none_keys,payload,now,now))
+        self.connection.commit()
+    def evict(self,max_entries: int = None,older_than: float = None):
+        """
+        Removes entries, least recently used first
+
+        Args:
+            max_entries: int, the number of entries to be kept
+            older_than: float, entries not read for this many seconds are removed
+        Returns:
+            removed: int equal to the number of removed entries
+        """
+        removed = 0
+        if older_than is not None:
+            cursor = self.connection.execute("DELETE FROM results WHERE last_access < ?",
+                                             (time.time() - older_than,))
+            removed += cursor.rowcount
+        if max_entries is not None:
+            cursor = self.connection.execute("""DELETE FROM results WHERE key NOT IN (
+                                                SELECT key FROM results
+                                                ORDER BY last_access DESC LIMIT ?)""",
+                                             (max_entries,))
+            removed += cursor.rowcount
+        self.connection.commit()
+        return removed
+    def compact(self):
+        """
+        Gives the space of removed entries back to the file system
+        """
+        self.connection.execute("VACUUM")
+    def close(self):
+        """
+        Closes the underlying database
+        """
+        self.connection.close()
@@ -0,0 +1,230 @@
+"""
+This module contains the bit packed sifting and quantum bit error rate kernel
+"""
+import numpy as np
+
+
+WORD_BITS = 64
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)],dtype=np.uint8)
+
+def str_to_bits(bits: str):
+    """
+    Converts the str representation used by Human to a uint8 array of 0s and 1s
+    """
+    return np.frombuffer(bits.encode('ascii'),dtype=np.uint8) - ord('0')
+
+def bits_to_str(bits: np.ndarray):
+    """
+    Converts an array of 0s and 1s to the str representation used by Human
+    """
+    return (np.asarray(bits,dtype=np.uint8) + ord('0')).tobytes().decode('ascii')
+
+def pack_bits(bits: np.ndarray):
+    """
+    Packs the last axis of an array of 0s and 1s into 64-bit words, padded with 0s
+
+    Returns:
+        words: uint64 array of shape (..., ceil(n / 64))
+    """
+    bits = np.asarray(bits,dtype=np.uint8)
+    padding = -bits.shape[-1] % WORD_BITS
+    if padding:
+        bits = np.concatenate([bits,np.zeros(bits.shape[:-1] + (padding,),dtype=np.uint8)],axis=-1)
+    return np.packbits(bits,axis=-1).view(np.uint64)
+
+def unpack_bits(words: np.ndarray,number_of_bits: int):
+    """
+    Reverses pack_bits
+
+    Returns:
+        bits: uint8 array of shape (..., number_of_bits)
+    """
+    bits = np.unpackbits(np.ascontiguousarray(words).view(np.uint8),axis=-1)
+    return bits[...,:number_of_bits]
+
+def popcount(words: np.ndarray):
+    """
+    Returns:
+        counts: the number of set bits of every word
+    """
+    if hasattr(np,"bitwise_count"):
+        return np.bitwise_count(words)
+    bytes_ = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape + (8,))
+    return _BYTE_POPCOUNT[bytes_].sum(axis=-1,dtype=np.uint8)
+
+def error_rate_from_counts(sifted_key_length,final_key_length):
+    """
+    Quantum bit error rate the way Simulation.qber defines it: 100 when no bit is left
+
+    Returns:
+        error_rate: float for scalar counts, float array otherwise
+    """
+    sifted_key_length = np.asarray(sifted_key_length)
+    final_key_length = np.asarray(final_key_length)
+    error_rate = np.full(sifted_key_length.shape,100.0)
+    usable = final_key_length > 0
+    error_rate[usable] = (1 - final_key_length[usable] / sifted_key_length[usable]) * 100.0
+    return float(error_rate) if error_rate.ndim == 0 else error_rate
+
+def sift(alice_key,alice_base,bob_key,bob_base,number_of_bits: int):
+    """
+    Counts sifted and erroneous bits over the last axis of packed keys and bases: the bases are
+    compared with XOR into a mask, and the errors are the popcount of (key XOR key) AND mask
+
+    Args:
+        alice_key, alice_base, bob_key, bob_base: uint64 arrays created by pack_bits
+        number_of_bits: int equal to the length of the unpacked keys
+    Returns:
+        (same_bases, sifted_key_length, final_key_length): packed mask and counts per row
+    """
+    # Padding bits are 0 for both, so they'd count as matching bases unless masked out
+    same_bases = ~(alice_base ^ bob_base) & _valid_bits_mask(alice_base.shape[-1],number_of_bits)
+    errors = (alice_key ^ bob_key) & same_bases
+    sifted_key_length = popcount(same_bases).sum(axis=-1,dtype=np.int64)
+    final_key_length = sifted_key_length - popcount(errors).sum(axis=-1,dtype=np.int64)
+    return same_bases,sifted_key_length,final_key_length
+
+def _valid_bits_mask(number_of_words: int,number_of_bits: int):
+    """
+    Returns packed words with the first number_of_bits bits set
+    """
+    bits = np.zeros(number_of_words * WORD_BITS,dtype=np.uint8)
+    bits[:number_of_bits] = 1
+    return pack_bits(bits)
+
+def qber(alice_key,alice_base,bob_key,bob_base,block_size: int = None):
+    """
+    Quantum bit error rate and sifted keys of a single key exchange. Keys and bases are arrays of
+    0s and 1s, the str fields of the results are only created when accessed.
+
+    Args:
+        alice_key, alice_base, bob_key, bob_base: uint8 arrays of equal length
+        block_size: int multiple of 64, when given the per-block error rates are returned as well
+    Returns:
+        results_dict: SiftingResults
+                 scheme:
+                    {
+                    "final_key" : str,
+                    "error_rate" : float,
+                    "alice_key_same_bases" : str,
+                    "bob_key_same_bases" : str,
+                    "sifted_key_length" : int,
+                    "final_key_length" : int,
+                    only if block_size:
+                    "block_error_rate" : float array,
+                    "block_sifted_key_length" : int array
+                    }
+    """
+    number_of_bits = len(alice_key)
+    packed = [pack_bits(bits) for bits in (alice_key,alice_base,bob_key,bob_base)]
+    same_bases,sifted_key_length,final_key_length = sift(*packed,number_of_bits)
+    good = same_bases & ~(packed[0] ^ packed[2])
+    def compress(bits,mask_words):
+        mask = unpack_bits(mask_words,number_of_bits).astype(bool)
+        return bits_to_str(np.asarray(bits)[mask])
+    results_dict = SiftingResults(
+        {
+            "final_key" : lambda: compress(alice_key,good),
+            "alice_key_same_bases" : lambda: compress(alice_key,same_bases),
+            "bob_key_same_bases" : lambda: compress(bob_key,same_bases),
+        },
+        error_rate=error_rate_from_counts(sifted_key_length,final_key_length),
+        sifted_key_length=int(sifted_key_length),
+        final_key_length=int(final_key_length),
+    )
+    if block_size is not None:
+        results_dict.update(block_qber(*packed,number_of_bits,block_size))
+    return results_dict
+
+def batch_counts(alice_key,alice_base,bob_key,bob_base):
+    """
+    Sifted and final key lengths of every row of trial x bit matrices
+
+    Returns:
+        (sifted_key_length, final_key_length): int arrays with one value per trial
+    """
+    number_of_bits = np.shape(alice_key)[-1]
+    packed = [pack_bits(bits) for bits in (alice_key,alice_base,bob_key,bob_base)]
+    _,sifted_key_length,final_key_length = sift(*packed,number_of_bits)
+    return sifted_key_length,final_key_length
+
+def block_qber(alice_key,alice_base,bob_key,bob_base,number_of_bits: int,block_size: int = 4096):
+    """
+    Per-block quantum bit error rates of a long key, computed in one pass over packed words
+
+    Args:
+        alice_key, alice_base, bob_key, bob_base: 1-D uint64 arrays created by pack_bits
+        number_of_bits: int equal to the length of the unpacked key
+        block_size: int multiple of 64 equal to the number of bits in a block
+    Returns:
+        results_dict: a dict
+                 scheme:
+                    {
+                    "block_error_rate" : float array,
+                    "block_sifted_key_length" : int array
+                    }
+    """
+    if block_size <= 0 or block_size % WORD_BITS:
+        raise ValueError(f"Block size has to be a positive multiple of {WORD_BITS}")
+    words_per_block = block_size // WORD_BITS
+    number_of_words = len(alice_key)
+    padding = -number_of_words % words_per_block
+    packed = [np.concatenate([words,np.zeros(padding,dtype=np.uint64)])
+              for words in (alice_key,alice_base,bob_key,bob_base)]
+    valid = np.concatenate([_valid_bits_mask(number_of_words,number_of_bits),
+                            np.zeros(padding,dtype=np.uint64)])
+    same_bases = ~(packed[1] ^ packed[3]) & valid
+    errors = (packed[0] ^ packed[2]) & same_bases
+    sifted = popcount(same_bases).reshape(-1,words_per_block).sum(axis=-1,dtype=np.int64)
+    wrong = popcount(errors).reshape(-1,words_per_block).sum(axis=-1,dtype=np.int64)
+    results_dict = {
+        "block_error_rate" : np.asarray(error_rate_from_counts(sifted,sifted - wrong)),
+        "block_sifted_key_length" : sifted
+    }
+    return results_dict
+
+
+class SiftingResults(dict):
+    """
+    Results dict whose expensive fields are given as functions and only created on first access.
+    Iterating over it or copying it creates all of them.
+    """
+    def __init__(self,lazy_fields: dict = None,**fields):
+        super().__init__(**fields)
+        self._lazy_fields = dict(lazy_fields or {})
+    def __missing__(self,key):
+        if key not in self._lazy_fields:
+            raise KeyError(key)
+        value = self._lazy_fields.pop(key)()
+        self[key] = value
+        return value
+    def __contains__(self,key):
+        return key in self._lazy_fields or super().__contains__(key)
+    def __len__(self):
+        return super().__len__() + len(self._lazy_fields)
+    def __iter__(self):
+        self.materialize()
+        return super().__iter__()
+    def __repr__(self):
+        self.materialize()
+        return super().__repr__()
+    def get(self,key,default=None):
+        return self[key] if key in self else default
+    def keys(self):
+        self.materialize()
+        return super().keys()
+    def values(self):
+        self.materialize()
+        return super().values()
+    def items(self):
+        self.materialize()
+        return super().items()
+    def copy(self):
+        self.materialize()
+        return dict(super().items())
+    def materialize(self):
+        """
+        Creates all the lazy fields
+        """
+        for key in list(self._lazy_fields):
+            self[key]
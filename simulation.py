@@ -1,17 +1,26 @@
 """
 This module contains class Simulation which allows to easily simulate BB84 protocol
 """
+import numpy as np
+import instrumentation
+from channel import Channel,Detections
 from human import Human
+from randomness import RandomnessBackend,default_backend
+from sifting import bits_to_str,qber,str_to_bits
+from vector_engine import Beam,VectorHuman,batch_qber,vector_qber
 
 
 class Simulation():
     """
-    Class which uses Human to simulate BB84
+    Class which uses Human to simulate BB84.
+    The randomness backend rng is split into independent streams for Alice, Bob and Eve
+    on every simulation.
     """
     def __init__(self,
                 alice : dict() = {"emitter_efficiency":100},
                 bob : dict() = {"detector_efficiency":100},
-                eve : dict() = {"exists":False}):
+                eve : dict() = {"exists":False},
+                rng : RandomnessBackend = None):
         required_keys = ["emitter_efficiency","detector_efficiency","exists"]
         alice_test = required_keys[0] not in alice.keys()
         bob_test = required_keys[1] not in bob.keys()
@@ -26,6 +35,7 @@ class Simulation():
             self.alice_config = alice
             self.bob_config = bob
             self.eve_config = eve
+            self.rng = rng if rng is not None else default_backend()
     @staticmethod
     def create_configuration_dict(emitter_efficiency: int = 0,
                                 detector_efficiency: int = 0,
@@ -37,7 +47,8 @@ class Simulation():
                 "detector_efficiency":detector_efficiency,
                 "exists":exists}
         return config
-    def simulate(self,sender_key_length : int, tactic : int = 0):
+    @instrumentation.timed("Simulation.simulate")
+    def simulate(self,sender_key_length : int, tactic : int = 0, engine : str = "photon"):
         """
         Performs the simulation for the given key length and with a given eve's tactic.
         Available tactics:
@@ -47,9 +58,14 @@ class Simulation():
         3 - eve uses 1 as a base for every measurement
         4 - eve uses a base of 1s and 0s where 1 is for odd indices and 0 for even
 
+        Available engines:
+        "photon" - Human instances exchanging a list of Photon objects
+        "vector" - VectorHuman instances exchanging array backed Beam, suited for long keys
+
         Args:
             sender_key_length: int defining the initial key length
             tactic: int defining which tactic's to be used
+            engine: str defining which engine's to be used
         Returns:
             results_dict: a dict holding all the results
                      scheme:
@@ -66,12 +82,21 @@ class Simulation():
                         "bob_key_same_bases" : str
                         }
         """
-        alice = Human(sender_key_length,emitter_efficiency=self.alice_config["emitter_efficiency"])
-        photon_beam = alice.send()
-        bob = Human(detector_efficiency=self.bob_config["detector_efficiency"])
+        if engine == "vector":
+            return self._simulate_vector(sender_key_length,tactic)
+        if engine != "photon":
+            raise ValueError(f"Unknown engine {engine}")
+        alice_rng,bob_rng,eve_rng = self.rng.spawn(3)
+        alice = Human(sender_key_length,emitter_efficiency=self.alice_config["emitter_efficiency"],
+                      rng=alice_rng)
+        with instrumentation.stage("emission"):
+            photon_beam = alice.send()
+        bob = Human(detector_efficiency=self.bob_config["detector_efficiency"],
+                    rng=bob_rng)
         if self.eve_config["exists"]:
             eve = Human(emitter_efficiency=self.eve_config["emitter_efficiency"],
-                        detector_efficiency=self.eve_config["detector_efficiency"])
+                        detector_efficiency=self.eve_config["detector_efficiency"],
+                        rng=eve_rng)
             if tactic in [2,3]:
                 temp_base = ""
                 for i in range(sender_key_length):
@@ -85,12 +110,15 @@ class Simulation():
                     else:
                         temp_base +='1'  # odd numbers
                 eve.base = temp_base
-            eve.receive(photon_beam)
-            if tactic == 1:
-                eve.base = None
-            photon_beam = eve.send()
-        bob.receive(photon_beam)
-        results_dict = {
+            with instrumentation.stage("intercept_resend"):
+                eve.receive(photon_beam)
+                if tactic == 1:
+                    eve.base = None
+                photon_beam = eve.send()
+        with instrumentation.stage("detection"):
+            bob.receive(photon_beam)
+        results_dict = self.qber(alice, bob)
+        results_dict.update({
             "alice_initial_key" : alice.key,
             "alice_base" : alice.base,
             "bob_initial_key" : bob.key,
@@ -98,51 +126,320 @@ class Simulation():
             "eve_stolen_key" : eve.key if self.eve_config["exists"] else None,
             "eve_base" : eve.base if self.eve_config["exists"] else None,
             "tactic" : tactic if self.eve_config["exists"] else None,
+        })
+        return results_dict
+    def _simulate_vector(self,sender_key_length : int, tactic : int = 0):
+        """
+        Array backed version of simulate, returns the same results dict
+        """
+        alice_rng,bob_rng,eve_rng = self.rng.spawn(3)
+        alice = VectorHuman(sender_key_length,emitter_efficiency=self.alice_config["emitter_efficiency"],
+                            rng=alice_rng)
+        with instrumentation.stage("emission"):
+            photon_beam = alice.send()
+        bob = VectorHuman(detector_efficiency=self.bob_config["detector_efficiency"],
+                          rng=bob_rng)
+        if self.eve_config["exists"]:
+            eve = VectorHuman(emitter_efficiency=self.eve_config["emitter_efficiency"],
+                              detector_efficiency=self.eve_config["detector_efficiency"],
+                              rng=eve_rng)
+            eve.base = self.eve_base(sender_key_length,tactic)
+            with instrumentation.stage("intercept_resend"):
+                eve.receive(photon_beam)
+                if tactic == 1:
+                    eve.base = None
+                photon_beam = eve.send()
+        with instrumentation.stage("detection"):
+            bob.receive(photon_beam)
+        results_dict = vector_qber(alice, bob)
+        results_dict.update({
+            "alice_initial_key" : bits_to_str(alice.key),
+            "alice_base" : bits_to_str(alice.base),
+            "bob_initial_key" : bits_to_str(bob.key),
+            "bob_base" : bits_to_str(bob.base),
+            "eve_stolen_key" : bits_to_str(eve.key) if self.eve_config["exists"] else None,
+            "eve_base" : bits_to_str(eve.base) if self.eve_config["exists"] else None,
+            "tactic" : tactic if self.eve_config["exists"] else None,
+        })
+        return results_dict
+    @instrumentation.timed("Simulation.simulate_batch")
+    def simulate_batch(self,
+                    sender_key_length : int,
+                    number_of_trials : int,
+                    tactic : int = 0,
+                    return_keys : bool = False):
+        """
+        Performs number_of_trials independent simulations at once, every key and base is held
+        as a trial x bit matrix. Tactics are the same as in simulate.
+
+        Args:
+            sender_key_length: int defining the initial key length
+            number_of_trials: int defining how many simulations are to be performed
+            tactic: int defining which tactic's to be used
+            return_keys: bool defining whether the full key and base matrices are returned
+        Returns:
+            results_dict: a dict holding all the results
+                     scheme:
+                        {
+                        "error_rate" : float array,
+                        "sifted_key_length" : int array,
+                        "final_key_length" : int array,
+                        "tactic" : int || None,
+                        only if return_keys:
+                        "alice_initial_key" : uint8 matrix,
+                        "alice_base" : uint8 matrix,
+                        "bob_initial_key" : uint8 matrix,
+                        "bob_base" : uint8 matrix,
+                        "eve_stolen_key" : uint8 matrix || None,
+                        "eve_base" : uint8 matrix || None,
+                        "same_bases" : bool matrix
+                        }
+        """
+        alice_rng,bob_rng,eve_rng = self.rng.spawn(3)
+        alice = VectorHuman(sender_key_length,
+                            emitter_efficiency=self.alice_config["emitter_efficiency"],
+                            rng=alice_rng,
+                            number_of_trials=number_of_trials)
+        with instrumentation.stage("emission"):
+            photon_beam = alice.send()
+        return self._receive_batch(alice,photon_beam,self.bob_config,self.eve_config,tactic,
+                                   bob_rng,eve_rng,return_keys)
+    @instrumentation.timed("Simulation.simulate_branches")
+    def simulate_branches(self,
+                        sender_key_length : int,
+                        number_of_trials : int,
+                        branches : list,
+                        branch_rngs : list = None,
+                        return_keys : bool = False):
+        """
+        Common random numbers version of simulate_batch: Alice's keys, bases and beam are
+        generated once per trial and every branch, i.e. a Bob / Eve configuration and a tactic,
+        receives the same beam. Beams are read-only so that branches can't alter each other's input.
+        Bob's bases and Eve's randomized measuring bases are shared by the branches as well, only
+        the malfunctions and the outcomes of mismatched measurements are drawn per branch.
+        Emission is paid once for all the branches, and since they share most of the randomness
+        the differences between branches have a far lower variance than between independent runs.
+
+        Args:
+            sender_key_length: int defining the initial key length
+            number_of_trials: int defining how many simulations are to be performed per branch
+            branches: list of dicts, each holding the "bob" and "eve" config dicts and the "tactic"
+            branch_rngs: list of RandomnessBackend instances, one per branch, used for Bob and Eve.
+                         Spawned from rng when None.
+            return_keys: bool defining whether the full key and base matrices are returned
+        Returns:
+            results: list of dicts with the scheme of simulate_batch, one per branch
+        """
+        if branch_rngs is None:
+            branch_rngs = self.rng.spawn(len(branches))
+        if len(branch_rngs) != len(branches):
+            raise ValueError("Every branch needs its own randomness backend")
+        alice_rng,bob_base_rng,eve_base_rng = self.rng.spawn(3)
+        alice = VectorHuman(sender_key_length,
+                            emitter_efficiency=self.alice_config["emitter_efficiency"],
+                            rng=alice_rng,
+                            number_of_trials=number_of_trials)
+        with instrumentation.stage("emission"):
+            photon_beam = alice.send()
+        shape = (number_of_trials,sender_key_length)
+        bob_base = bob_base_rng.random_bits(shape)
+        eve_base = eve_base_rng.random_bits(shape)
+        results = []
+        for branch,branch_rng in zip(branches,branch_rngs):
+            bob_rng,eve_rng = branch_rng.spawn(2)
+            results.append(self._receive_batch(alice,photon_beam,branch["bob"],branch["eve"],
+                                               branch.get("tactic",0),bob_rng,eve_rng,return_keys,
+                                               bob_base,eve_base))
+        return results
+    def _receive_batch(self,
+                    alice : VectorHuman,
+                    photon_beam : Beam,
+                    bob_config : dict,
+                    eve_config : dict,
+                    tactic : int,
+                    bob_rng : RandomnessBackend,
+                    eve_rng : RandomnessBackend,
+                    return_keys : bool = False,
+                    bob_base : np.ndarray = None,
+                    eve_base : np.ndarray = None):
+        """
+        Everything simulate_batch does downstream of Alice's emission, the beam is left unchanged.
+        Bob's bases and Eve's randomized measuring bases are drawn from their streams unless given.
+        """
+        sender_key_length = alice.key_length
+        number_of_trials = alice.number_of_trials
+        bob = VectorHuman(detector_efficiency=bob_config["detector_efficiency"],
+                          rng=bob_rng,
+                          number_of_trials=number_of_trials)
+        bob.base = bob_base
+        if eve_config["exists"]:
+            eve = VectorHuman(emitter_efficiency=eve_config["emitter_efficiency"],
+                              detector_efficiency=eve_config["detector_efficiency"],
+                              rng=eve_rng,
+                              number_of_trials=number_of_trials)
+            eve.base = self.eve_base(sender_key_length,tactic,number_of_trials)
+            if eve.base is None:
+                eve.base = eve_base
+            with instrumentation.stage("intercept_resend"):
+                eve.receive(photon_beam)
+                if tactic == 1:
+                    eve.base = None
+                photon_beam = eve.send()
+        with instrumentation.stage("detection"):
+            bob.receive(photon_beam)
+        qber_dict = batch_qber(alice, bob)
+        results_dict = {
+            "error_rate" : qber_dict["error_rate"],
+            "sifted_key_length" : qber_dict["sifted_key_length"],
+            "final_key_length" : qber_dict["final_key_length"],
+            "tactic" : tactic if eve_config["exists"] else None,
         }
-        results_dict.update(self.qber(alice, bob))
+        if return_keys:
+            results_dict.update({
+                "alice_initial_key" : alice.key,
+                "alice_base" : alice.base,
+                "bob_initial_key" : bob.key,
+                "bob_base" : bob.base,
+                "eve_stolen_key" : eve.key if eve_config["exists"] else None,
+                "eve_base" : eve.base if eve_config["exists"] else None,
+                "same_bases" : alice.base == bob.base,
+            })
+        return results_dict
+    @instrumentation.timed("Simulation.simulate_lossy")
+    def simulate_lossy(self,
+                    number_of_pulses : int,
+                    channel : Channel,
+                    tactic : int = 0,
+                    eve_position : float = 0.5):
+        """
+        Performs the simulation over a lossy channel. Only the pulses which reach a detector are
+        ever materialized: the arrivals are drawn first, Alice's bits are only generated for them
+        and for the dark counts, and Bob measures the sparse Detections. Memory and sifting thus
+        scale with the number of detections, which makes 10^9 pulses at 50-100 km feasible.
+        Eve taps the fibre at eve_position with an ideal detector and resends what she measured
+        into the rest of the fibre. Tactics are the same as in simulate.
+
+        Args:
+            number_of_pulses: int defining how many pulses Alice emits
+            channel: Channel between Alice and Bob, including Bob's detector
+            tactic: int defining which tactic's to be used
+            eve_position: float between 0-1, fraction of the fibre between Alice and Eve
+        Returns:
+            results_dict: a dict with the scheme of Simulation.qber plus
+                     scheme:
+                        {
+                        "number_of_pulses" : int,
+                        "detections" : int,
+                        "dark_counts" : int,
+                        "detection_rate" : float,
+                        "detection_index" : int64 array,
+                        "tactic" : int || None
+                        }
+        """
+        alice_rng,bob_rng,eve_rng,channel_rng = self.rng.spawn(4)
+        first,second = channel.split(eve_position) if self.eve_config["exists"] else (channel,None)
+        with instrumentation.stage("channel"):
+            arrived = first.arrivals(channel_rng,number_of_pulses)
+        alice = VectorHuman(len(arrived),emitter_efficiency=self.alice_config["emitter_efficiency"],
+                            rng=alice_rng)
+        with instrumentation.stage("emission"):
+            pulses = Detections(arrived,alice.send(),number_of_pulses)
+        if self.eve_config["exists"]:
+            eve = VectorHuman(emitter_efficiency=self.eve_config["emitter_efficiency"],
+                              detector_efficiency=self.eve_config["detector_efficiency"],
+                              rng=eve_rng)
+            eve.base = self.eve_base_at(arrived,tactic)
+            with instrumentation.stage("intercept_resend"):
+                eve.receive(pulses.beam)
+                if tactic == 1:
+                    eve.base = None
+                pulses = Detections(arrived,eve.send(),number_of_pulses)
+            with instrumentation.stage("channel"):
+                pulses = second.transmit(channel_rng,pulses)
+            channel = second
+        with instrumentation.stage("channel"):
+            detections = channel.detect(channel_rng,pulses)
+        # Alice's bits of the pulses detected as dark counts were never needed before
+        position = np.searchsorted(arrived,detections.index)
+        emitted = position < len(arrived)
+        emitted[emitted] = arrived[position[emitted]] == detections.index[emitted]
+        alice_key = alice_rng.random_bits(len(detections))
+        alice_base = alice_rng.random_bits(len(detections))
+        alice_key[emitted] = alice.key[position[emitted]]
+        alice_base[emitted] = alice.base[position[emitted]]
+        bob = VectorHuman(detector_efficiency=self.bob_config["detector_efficiency"],rng=bob_rng)
+        with instrumentation.stage("detection"):
+            bob.receive(detections.beam)
+        with instrumentation.stage("sifting"):
+            results_dict = qber(alice_key,alice_base,bob.key,bob.base)
+        results_dict.update({
+            "number_of_pulses" : number_of_pulses,
+            "detections" : len(detections),
+            "dark_counts" : int(np.count_nonzero(detections.dark)),
+            "detection_rate" : len(detections) / number_of_pulses if number_of_pulses else 0.0,
+            "detection_index" : detections.index,
+            "tactic" : tactic if self.eve_config["exists"] else None,
+        })
         return results_dict
+    @staticmethod
+    def eve_base_at(index : np.ndarray, tactic : int):
+        """
+        Sparse version of eve_base: Eve's fixed measurement base at the given pulse indices,
+        or None for the tactics which randomize it
+        """
+        if tactic in [2,3]:
+            return np.full(len(index),0 if tactic == 2 else 1,dtype=np.uint8)
+        if tactic == 4:
+            return (index % 2 == 0).astype(np.uint8)
+        return None
+    @staticmethod
+    def eve_base(sender_key_length : int, tactic : int, number_of_trials : int = None):
+        """
+        Returns Eve's fixed measurement base for the given tactic as a uint8 array,
+        or None for the tactics which randomize it
+        """
+        if tactic in [2,3]:
+            base = np.full(sender_key_length,0 if tactic == 2 else 1,dtype=np.uint8)
+        elif tactic == 4:
+            # 1 for even indices, 0 for odd ones
+            base = (np.arange(sender_key_length) % 2 == 0).astype(np.uint8)
+        else:
+            return None
+        if number_of_trials is not None:
+            base = np.tile(base,(number_of_trials,1))
+        return base
+    @instrumentation.timed("sifting")
     def qber(self,
             alice : Human,
-            bob : Human):
+            bob : Human,
+            block_size : int = None):
         """
         Function used for calculating the quantum bit error rate as well as creating final key by
-        filtering out the incorrect bits
+        filtering out the incorrect bits. Keys and bases are packed into 64-bit words, sifting
+        is a mask and the errors are counted with XOR + popcount, see sifting.qber.
 
         Args:
             alice: Human instance equivalent to BB84 Alice
             bob: Human instance equivalent to BB84 Bob
+            block_size: int multiple of 64, when given the per-block error rates are returned as well
         Returns:
-            results_dict: a dict holding all the results from comparisons
+            results_dict: a dict holding all the results from comparisons, the str fields are
+                          only created when accessed
                      scheme:
                         {
                         "final_key" : str,
                         "error_rate" : float,
                         "alice_key_same_bases" : str,
-                        "bob_key_same_bases" : str
+                        "bob_key_same_bases" : str,
+                        "sifted_key_length" : int,
+                        "final_key_length" : int,
+                        only if block_size:
+                        "block_error_rate" : float array,
+                        "block_sifted_key_length" : int array
                         }
         """
-        alice_key_filtered = ""
-        bob_key_filtered = ""
-        final_key = ""
-        good_bits = 0
-        for i in range(alice.key_length):
-            if alice.base[i] == bob.base[i]:
-                alice_key_filtered += alice.key[i]
-                bob_key_filtered += bob.key[i]
-                if alice.key[i] == bob.key[i]:
-                    good_bits +=1
-                    final_key += alice.key[i]
-        if good_bits == 0:
-            error_rate = 100
-        else:
-            error_rate = (1 - (good_bits / len(alice_key_filtered))) * 100.0
-        results_dict = {
-            "final_key" : final_key,
-            "error_rate" : error_rate,
-            "alice_key_same_bases" : alice_key_filtered,
-            "bob_key_same_bases" : bob_key_filtered
-        }
-        return results_dict
+        return qber(str_to_bits(alice.key),str_to_bits(alice.base),
+                    str_to_bits(bob.key),str_to_bits(bob.base),block_size)
 
 def main():
     """
@@ -0,0 +1,267 @@
+"""
+This module contains the bounded-memory streaming pipeline which simulates a long key exchange
+block by block, together with the key sinks the sifted and final bits are streamed into
+"""
+import os
+import numpy as np
+import instrumentation
+from channel import Channel
+from randomness import RandomnessBackend
+from simulation import Simulation
+from sifting import error_rate_from_counts,str_to_bits
+from vector_engine import VectorHuman
+
+
+BLOCK_SIZE = 1 << 20
+
+
+class MemmapKeyFile():
+    """
+    Key bits packed 8 per byte into a memory-mapped file. The file is created with room for
+    capacity bits, written pages are backed by the file rather than by RAM, and it's cut to the
+    written length when closed. Bits which don't fill a byte are carried over to the next write.
+    """
+    def __init__(self,path: str,capacity: int):
+        """
+        Args:
+            path: str file name, overwritten
+            capacity: int maximal number of bits, e.g. the number of emitted pulses
+        """
+        self.path = path
+        self.number_of_bits = 0
+        self.capacity = capacity
+        self._memmap = np.memmap(path,dtype=np.uint8,mode="w+",shape=(max(1,-(-capacity // 8)),))
+        self._carry = np.zeros(0,dtype=np.uint8)
+    def write(self,bits: np.ndarray):
+        """
+        Appends an array of 0s and 1s
+        """
+        if self.number_of_bits + len(bits) > self.capacity:
+            raise ValueError("The key file is full")
+        bits = np.concatenate((self._carry,np.asarray(bits,dtype=np.uint8)))
+        whole = len(bits) - len(bits) % 8
+        offset = (self.number_of_bits - len(self._carry)) // 8
+        self._memmap[offset:offset + whole // 8] = np.packbits(bits[:whole])
+        self._carry = bits[whole:]
+        self.number_of_bits = offset * 8 + len(bits)
+    def close(self):
+        """
+        Writes the carried bits, padded with 0s, and cuts the file to the written bytes
+        """
+        if self._memmap is None:
+            return
+        offset = (self.number_of_bits - len(self._carry)) // 8
+        if len(self._carry):
+            self._memmap[offset] = np.packbits(self._carry)[0]
+        self._memmap.flush()
+        self._memmap = None
+        self._carry = np.zeros(0,dtype=np.uint8)
+        os.truncate(self.path,-(-self.number_of_bits // 8))
+    def __enter__(self):
+        return self
+    def __exit__(self,*exception):
+        self.close()
+
+def load_key(path: str,number_of_bits: int = None):
+    """
+    Memory maps a key written by MemmapKeyFile without reading it
+
+    Returns:
+        (words, number_of_bits): read-only uint8 memmap of the packed bits and int number of bits,
+                                 every byte is a multiple of 8 when the length isn't given
+    """
+    words = np.memmap(path,dtype=np.uint8,mode="r")
+    return words,number_of_bits if number_of_bits is not None else 8 * len(words)
+
+
+class RingBuffer():
+    """
+    Keeps the last capacity bits written to it in a fixed-size array
+    """
+    def __init__(self,capacity: int):
+        self.capacity = capacity
+        self.number_of_bits = 0
+        self._bits = np.zeros(capacity,dtype=np.uint8)
+    def write(self,bits: np.ndarray):
+        """
+        Appends an array of 0s and 1s, overwriting the oldest bits
+        """
+        bits = np.asarray(bits,dtype=np.uint8)
+        # Only the last capacity bits survive, written where they'd have ended up
+        position = (self.number_of_bits + len(bits) - len(bits[-self.capacity:])) % self.capacity
+        self.number_of_bits += len(bits)
+        bits = bits[-self.capacity:]
+        first = min(len(bits),self.capacity - position)
+        self._bits[position:position + first] = bits[:first]
+        self._bits[:len(bits) - first] = bits[first:]
+    def bits(self):
+        """
+        Returns:
+            bits: uint8 array of the kept bits, oldest first
+        """
+        if self.number_of_bits < self.capacity:
+            return self._bits[:self.number_of_bits].copy()
+        return np.roll(self._bits,-(self.number_of_bits % self.capacity))
+    def close(self):
+        """
+        Nothing to release, present so that it can replace a MemmapKeyFile
+        """
+        return None
+
+
+def _dense_block(simulation: Simulation,rng: RandomnessBackend,start: int,number_of_pulses: int,tactic: int):
+    """
+    Simulates the pulses start .. start + number_of_pulses with the vector engine
+
+    Returns:
+        (sifted, correct): Alice's sifted bits and a bool array marking the ones Bob got right
+    """
+    alice_rng,bob_rng,eve_rng = rng.spawn(3)
+    alice = VectorHuman(number_of_pulses,emitter_efficiency=simulation.alice_config["emitter_efficiency"],
+                        rng=alice_rng)
+    with instrumentation.stage("emission"):
+        photon_beam = alice.send()
+    bob = VectorHuman(detector_efficiency=simulation.bob_config["detector_efficiency"],rng=bob_rng)
+    if simulation.eve_config["exists"]:
+        eve = VectorHuman(emitter_efficiency=simulation.eve_config["emitter_efficiency"],
+                          detector_efficiency=simulation.eve_config["detector_efficiency"],
+                          rng=eve_rng)
+        # Fixed bases follow the pulse index across blocks
+        eve.base = Simulation.eve_base_at(np.arange(start,start + number_of_pulses),tactic)
+        with instrumentation.stage("intercept_resend"):
+            eve.receive(photon_beam)
+            if tactic == 1:
+                eve.base = None
+            photon_beam = eve.send()
+    with instrumentation.stage("detection"):
+        bob.receive(photon_beam)
+    with instrumentation.stage("sifting"):
+        same_bases = alice.base == bob.base
+        sifted = alice.key[same_bases]
+        correct = sifted == bob.key[same_bases]
+    return sifted,correct
+
+def _lossy_block(simulation: Simulation,
+                rng: RandomnessBackend,
+                number_of_pulses: int,
+                tactic: int,
+                channel: Channel,
+                eve_position: float):
+    """
+    Simulates a block with Simulation.simulate_lossy
+
+    Returns:
+        (sifted, correct): Alice's sifted bits and a bool array marking the ones Bob got right
+    """
+    block = Simulation(simulation.alice_config,simulation.bob_config,simulation.eve_config,rng=rng)
+    results_dict = block.simulate_lossy(number_of_pulses,channel,tactic,eve_position)
+    sifted = str_to_bits(results_dict["alice_key_same_bases"])
+    correct = sifted == str_to_bits(results_dict["bob_key_same_bases"])
+    return sifted,correct
+
+def stream(simulation: Simulation,
+        number_of_pulses: int,
+        block_size: int = BLOCK_SIZE,
+        tactic: int = 0,
+        channel: Channel = None,
+        eve_position: float = 0.5,
+        sifted_sink = None,
+        final_sink = None):
+    """
+    Generator simulating number_of_pulses pulses in blocks of block_size: every block is
+    emitted, passes the channel and Eve, is measured and sifted, its statistics are accumulated
+    and its sifted and final bits are written to the sinks before the next block is created.
+    Peak memory is thus set by the block size, not by the number of pulses. Every block draws
+    from its own stream spawned from the randomness backend of the simulation.
+
+    Args:
+        simulation: Simulation holding the configs and the randomness backend
+        number_of_pulses: int total number of pulses emitted by Alice
+        block_size: int number of pulses per block
+        tactic: int defining which eve's tactic's to be used
+        channel: Channel, when given the blocks are simulated with Simulation.simulate_lossy,
+                 whose pulse indices restart every block, thus tactic 4 needs an even block size
+        eve_position: float between 0-1, see Simulation.simulate_lossy
+        sifted_sink, final_sink: MemmapKeyFile, RingBuffer or anything with write(bits),
+                                 receiving Alice's sifted bits and the correctly received ones
+    Yields:
+        block_dict: a dict
+                 scheme:
+                    {
+                    "block" : int,
+                    "pulses" : int, emitted so far,
+                    "error_rate" : float [%] of the block,
+                    "sifted_key_length" : int of the block,
+                    "final_key_length" : int of the block,
+                    "total_error_rate" : float [%] so far,
+                    "total_sifted_key_length" : int,
+                    "total_final_key_length" : int
+                    }
+    """
+    total_sifted = 0
+    total_final = 0
+    for block,start in enumerate(range(0,number_of_pulses,block_size)):
+        length = min(block_size,number_of_pulses - start)
+        rng = simulation.rng.spawn(1)[0]
+        if channel is None:
+            sifted,correct = _dense_block(simulation,rng,start,length,tactic)
+        else:
+            sifted,correct = _lossy_block(simulation,rng,length,tactic,channel,eve_position)
+        final_key_length = int(np.count_nonzero(correct))
+        if sifted_sink is not None:
+            sifted_sink.write(sifted)
+        if final_sink is not None:
+            final_sink.write(sifted[correct])
+        total_sifted += len(sifted)
+        total_final += final_key_length
+        instrumentation.count("streamed_blocks")
+        yield {
+            "block" : block,
+            "pulses" : start + length,
+            "error_rate" : error_rate_from_counts(len(sifted),final_key_length),
+            "sifted_key_length" : len(sifted),
+            "final_key_length" : final_key_length,
+            "total_error_rate" : error_rate_from_counts(total_sifted,total_final),
+            "total_sifted_key_length" : total_sifted,
+            "total_final_key_length" : total_final,
+        }
+
+def block_qber(simulation: Simulation,number_of_pulses: int,**options):
+    """
+    Iterator over the per-block quantum bit error rates of a streamed run, for live monitoring
+
+    Args:
+        options: keyword arguments of stream
+    Yields:
+        error_rate: float [%] of every block
+    """
+    for block_dict in stream(simulation,number_of_pulses,**options):
+        yield block_dict["error_rate"]
+
+def run_stream(simulation: Simulation,
+            number_of_pulses: int,
+            sifted_path: str = None,
+            final_path: str = None,
+            **options):
+    """
+    Consumes stream, writing the sifted and final keys to memory-mapped files when paths are given
+
+    Args:
+        options: keyword arguments of stream
+    Returns:
+        results_dict: the last block dict of stream, plus "number_of_blocks"
+    """
+    sinks = [MemmapKeyFile(path,number_of_pulses) if path is not None else None
+             for path in (sifted_path,final_path)]
+    block_dict = {"block":-1,"pulses":0,"total_error_rate":100.0,
+                  "total_sifted_key_length":0,"total_final_key_length":0}
+    try:
+        for block_dict in stream(simulation,number_of_pulses,sifted_sink=sinks[0],
+                                 final_sink=sinks[1],**options):
+            pass
+    finally:
+        for sink in sinks:
+            if sink is not None:
+                sink.close()
+    results_dict = dict(block_dict,number_of_blocks=block_dict["block"] + 1)
+    return results_dict
@@ -0,0 +1,292 @@
+"""
+This module contains class SweepRunner which runs parameter sweeps across a pool of processes
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from aggregator import run_branches_until_converged,run_until_converged
+from entropy_pool import EntropyPool
+from instrumentation import Metrics,recording
+from randomness import AerBackend,create_backend
+from result_cache import ResultCache,task_key
+from simulation import Simulation
+
+
+def create_task(key_length: int,
+                alice: dict,
+                bob: dict,
+                eve: dict,
+                tactic: int = 0,
+                number_of_iterations: int = 1,
+                target_width: dict = None,
+                batch_size: int = None,
+                confidence: float = 0.95):
+    """
+    Helper function for creating a single grid point of a sweep
+
+    Args:
+        key_length: int defining the initial key length
+        alice: dict config of Alice, see Simulation.create_configuration_dict
+        bob: dict config of Bob
+        eve: dict config of Eve
+        tactic: int defining which eve's tactic's to be used
+        number_of_iterations: int defining how many trials are simulated for this point, or the
+                              cap on their number when target_width is given
+        target_width, batch_size, confidence: early stopping settings,
+                                              see aggregator.run_until_converged
+    """
+    task = {"key_length":key_length,
+            "alice":alice,
+            "bob":bob,
+            "eve":eve,
+            "tactic":tactic,
+            "number_of_iterations":number_of_iterations,
+            "target_width":target_width,
+            "batch_size":batch_size,
+            "confidence":confidence}
+    return task
+
+# Grid points equal in these fields only differ downstream of Alice's emission
+EMISSION_FIELDS = ["key_length","alice","number_of_iterations","target_width","batch_size","confidence"]
+
+def emission_key(task: dict):
+    """
+    Returns the part of a task which determines Alice's emission
+    """
+    return {field:task[field] for field in EMISSION_FIELDS}
+
+
+_WORKER_POOL = None
+# Entropy pools of the branches of a common random numbers group, reused between groups
+_BRANCH_POOLS = []
+
+def run_task(task: dict,
+            seed: np.random.SeedSequence = None,
+            backend: str = "aer",
+            instrument: bool = False):
+    """
+    Simulates a single grid point with its own independent random stream. For the "aer" backend
+    the entropy pool of the process is reused between tasks and reseeded for every task.
+
+    Args:
+        instrument: bool, when True the stage timings and counters of the grid point are
+                    recorded and added to the results, see instrumentation.Metrics.flatten
+    Returns:
+        results_dict: the dict returned by aggregator.run_until_converged
+    """
+    if not instrument:
+        return _run_task(task,seed,backend)
+    with recording(Metrics()) as metrics:
+        with metrics.stage("task"):
+            results_dict = _run_task(task,seed,backend)
+    results_dict.update(metrics.flatten())
+    return results_dict
+
+def _run_task(task: dict,seed: np.random.SeedSequence = None,backend: str = "aer"):
+    """
+    Uninstrumented body of run_task
+    """
+    sim = Simulation(task["alice"],task["bob"],task["eve"],rng=_create_rng(backend,seed))
+    return run_until_converged(sim,task["key_length"],task["tactic"],task["number_of_iterations"],
+                               task["target_width"],task["batch_size"],task["confidence"])
+
+def _create_rng(backend: str,seed: np.random.SeedSequence = None):
+    """
+    Creates the randomness backend of a task, reseeding the entropy pool of the process for "aer"
+    """
+    global _WORKER_POOL
+    if backend == "aer":
+        if _WORKER_POOL is None:
+            _WORKER_POOL = EntropyPool()
+        _WORKER_POOL.reseed(seed)
+        return AerBackend(pool=_WORKER_POOL)
+    return create_backend(backend,seed)
+
+def _create_branch_rngs(backend: str,branch_seeds: list):
+    """
+    Creates one randomness backend per branch of a group, each seeded by its grid point. For
+    "aer" every branch gets its own entropy pool of the process, so its bits don't depend on
+    what the other branches draw.
+    """
+    if backend != "aer":
+        return [create_backend(backend,branch_seed) for branch_seed in branch_seeds]
+    while len(_BRANCH_POOLS) < len(branch_seeds):
+        _BRANCH_POOLS.append(EntropyPool())
+    branch_rngs = []
+    for pool,branch_seed in zip(_BRANCH_POOLS,branch_seeds):
+        pool.reseed(branch_seed)
+        branch_rngs.append(AerBackend(pool=pool))
+    return branch_rngs
+
+def run_task_group(tasks: list,
+                   seed: np.random.SeedSequence = None,
+                   branch_seeds: list = None,
+                   backend: str = "aer",
+                   instrument: bool = False):
+    """
+    Simulates grid points sharing their emission_key with common random numbers, see
+    Simulation.simulate_branches. Alice's stream is seeded by seed, the streams of Bob and Eve
+    by the seed of their grid point, thus a point's results don't depend on which other points
+    are in the group. With the "aer" backend Alice's draws and every branch come from separate
+    entropy pools of the process for the same reason.
+
+    Args:
+        instrument: bool, when True the metrics of the whole group are added to the results of
+                    its first grid point
+    Returns:
+        results: list of the dicts returned by aggregator.run_branches_until_converged
+    """
+    if not instrument:
+        return _run_task_group(tasks,seed,branch_seeds,backend)
+    with recording(Metrics()) as metrics:
+        with metrics.stage("task"):
+            results = _run_task_group(tasks,seed,branch_seeds,backend)
+    results[0].update(metrics.flatten())
+    return results
+
+def _run_task_group(tasks: list,seed: np.random.SeedSequence,branch_seeds: list,backend: str):
+    """
+    Uninstrumented body of run_task_group
+    """
+    rng = _create_rng(backend,seed)
+    branch_rngs = _create_branch_rngs(backend,branch_seeds) if branch_seeds is not None else None
+    task = tasks[0]
+    sim = Simulation(task["alice"],task["bob"],task["eve"],rng=rng)
+    branches = [{"bob":branch["bob"],"eve":branch["eve"],"tactic":branch["tactic"]} for branch in tasks]
+    return run_branches_until_converged(sim,task["key_length"],branches,task["number_of_iterations"],
+                                        task["target_width"],task["batch_size"],task["confidence"],
+                                        branch_rngs)
+
+def _run_unit(unit: tuple):
+    """
+    Runs a (function, arguments) tuple for ProcessPoolExecutor.map, always returning a list
+    """
+    function,arguments = unit
+    results = function(*arguments)
+    return results if isinstance(results,list) else [results]
+
+
+class SweepRunner():
+    """
+    Fans a list of grid points out over a ProcessPoolExecutor and returns the results in the
+    order of the grid. The random stream of every task is derived from the root seed and the
+    content of the task, thus a sweep with a given seed is reproducible independently of the
+    number of workers, the chunking and of which other points are in the grid.
+    Given a ResultCache, points already in it are skipped and new ones are stored as they finish.
+    With instrument set every grid point records its stage timings and counters.
+    With common_random_numbers set the grid points sharing Alice's configuration are simulated
+    together, every trial's emission being reused by all of them, see run_task_group.
+    """
+    def __init__(self,
+                max_workers: int = None,
+                seed: int = None,
+                chunksize: int = None,
+                backend: str = "aer",
+                cache: ResultCache = None,
+                instrument: bool = False,
+                common_random_numbers: bool = False):
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self.requested_seed = seed
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.chunksize = chunksize
+        self.backend = backend
+        self.cache = cache
+        self.instrument = instrument
+        self.common_random_numbers = common_random_numbers
+    @property
+    def seed(self):
+        """
+        Root seed of the sweep, pass it back to reproduce the results
+        """
+        return self.seed_sequence.entropy
+    def task_keys(self,tasks: list):
+        """
+        Returns:
+            keys: list of str content addresses, see result_cache.task_key
+        """
+        mode = "common_random_numbers" if self.common_random_numbers else None
+        return [task_key(task,self.backend,self.requested_seed,mode) for task in tasks]
+    def task_seeds(self,keys: list):
+        """
+        Derives the SeedSequence of every task from the root seed and its key. Repeated grid
+        points are told apart by their occurrence so that they don't share a stream.
+        """
+        occurrences = {}
+        seeds = []
+        for key in keys:
+            occurrence = occurrences.get(key,0)
+            occurrences[key] = occurrence + 1
+            spawn_key = (int(key[0:8],16),int(key[8:16],16),occurrence)
+            seeds.append(np.random.SeedSequence(self.seed_sequence.entropy,spawn_key=spawn_key))
+        return seeds
+    def run(self,tasks: list,callback = None):
+        """
+        Simulates all the tasks which aren't cached yet
+
+        Args:
+            tasks: list of dicts created by create_task
+            callback: callable taking (index, results_dict), called as soon as a grid point is
+                      done, e.g. ProgressReporter updates
+        Returns:
+            results: list of results dicts, results[i] belongs to tasks[i]
+        """
+        keys = self.task_keys(tasks)
+        seeds = self.task_seeds(keys)
+        results = [None] * len(tasks)
+        pending = []
+        for i,key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is None:
+                pending.append(i)
+            else:
+                results[i] = cached
+                if callback is not None:
+                    callback(i,cached)
+        units = self.units(tasks,seeds,pending)
+        for indices,unit_results in zip([indices for indices,unit in units],
+                                        self._run_pending([unit for indices,unit in units])):
+            for i,results_dict in zip(indices,unit_results):
+                if self.cache is not None:
+                    self.cache.put(keys[i],results_dict,tasks[i])
+                results[i] = results_dict
+                if callback is not None:
+                    callback(i,results_dict)
+        return results
+    def units(self,tasks: list,seeds: list,pending: list):
+        """
+        Splits the pending tasks into units of work, a single task each or, with common random
+        numbers, a group of tasks sharing their emission
+
+        Returns:
+            units: list of (indices, (function, arguments)) tuples
+        """
+        if not self.common_random_numbers:
+            return [([i],(run_task,(tasks[i],seeds[i],self.backend,self.instrument))) for i in pending]
+        groups = {}
+        for i in pending:
+            key = task_key(emission_key(tasks[i]),self.backend,self.requested_seed,"emission")
+            groups.setdefault(key,[]).append(i)
+        units = []
+        for key,seed in zip(groups,self.task_seeds(list(groups))):
+            indices = groups[key]
+            arguments = ([tasks[i] for i in indices],seed,[seeds[i] for i in indices],
+                         self.backend,self.instrument)
+            units.append((indices,(run_task_group,arguments)))
+        return units
+    def _run_pending(self,arguments: list):
+        """
+        Yields the list of results of every (function, arguments) unit in their order
+        """
+        if self.max_workers <= 1 or len(arguments) <= 1:
+            for argument in arguments:
+                yield _run_unit(argument)
+            return
+        chunksize = self.chunksize
+        if chunksize is None:
+            # A few chunks per worker keeps the pool balanced while amortising the start-up cost
+            chunksize = max(1,-(-len(arguments) // (self.max_workers * 4)))
+        # Forking a process which already runs Aer / prefetch threads can deadlock, so spawn
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.max_workers,mp_context=context) as executor:
+            yield from executor.map(_run_unit,arguments,chunksize=chunksize)
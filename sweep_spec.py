@@ -0,0 +1,148 @@
+"""
+This module contains the declarative definitions of the sweeps plotted by main.py
+"""
+from simulation import Simulation
+from sweep import create_task
+
+
+# Values of the config axes which a sweep doesn't set
+AXIS_DEFAULTS = {
+    "alice_emitter_efficiency" : 100,
+    "bob_detector_efficiency" : 100,
+    "eve_exists" : False,
+    "eve_emitter_efficiency" : 100,
+    "eve_detector_efficiency" : 100,
+    "tactic" : 0,
+}
+
+# Every sweep draws one figure per key length. Its x values are either a list or the name of a
+# CONFIG entry and they're assigned to every axis in "x_axes". Every series sets further axes,
+# a series with "expand" : (axis, CONFIG entry) is repeated for every value of that entry.
+SWEEP_SPECS = {
+    "detector" : {
+        "description" : "detector efficiency",
+        "figure" : "test_detector_{key_length}.png",
+        "x_label" : "Detector efficiency [%]",
+        "x_values" : "detector_efficiencies",
+        "x_axes" : ["bob_detector_efficiency"],
+        "series" : [{"expand" : ("eve_exists","eavesdropping"),
+                     "labels" : {False:"without Eve",True:"with Eve"},
+                     "styles" : {False:{"color":"blue"},True:{"fmt":"--r"}}}],
+    },
+    "emitter" : {
+        "description" : "emitter efficiency",
+        "figure" : "test_emitter_{key_length}.png",
+        "x_label" : "Emitter efficiency [%]",
+        "x_values" : "emitter_efficiencies",
+        "x_axes" : ["alice_emitter_efficiency"],
+        "series" : [{"expand" : ("eve_exists","eavesdropping"),
+                     "labels" : {False:"without Eve",True:"with Eve"},
+                     "styles" : {False:{"color":"blue"},True:{"fmt":"--r"}}}],
+    },
+    "system" : {
+        "description" : "system efficiency",
+        "figure" : "test_system_{key_length}.png",
+        "x_label" : "System efficiency [%]",
+        "x_values" : "system_efficiencies",
+        "x_axes" : ["alice_emitter_efficiency","bob_detector_efficiency"],
+        "series" : [{"expand" : ("eve_exists","eavesdropping"),
+                     "labels" : {False:"without Eve",True:"with Eve"},
+                     "styles" : {False:{"color":"blue"},True:{"fmt":"--r"}}}],
+    },
+    "eve_tactic" : {
+        "description" : "different eve tactics",
+        "figure" : "test_eve_tactic_{key_length}.png",
+        "x_label" : "Emitter and detector efficiency [%]",
+        "x_values" : [i*10 for i in range(11)],
+        "x_axes" : ["alice_emitter_efficiency","bob_detector_efficiency"],
+        "series" : [{"expand" : ("tactic","eve_tactic"),"eve_exists" : True,"label" : "Tactic #{tactic}"},
+                    {"eve_exists" : False,"label" : "Without Eve"}],
+    },
+}
+
+# Panels of every figure: (metric, title, y label), drawn column by column into a 2 x 2 grid
+PANELS = [
+    ("average_error_rate","Average quantum bit error rate","quantum bit error rate [%]"),
+    ("mode_error_rate","Mode quantum bit error rate","quantum bit error rate [%]"),
+    ("average_final_key_length","Average usable key length","usable key length [bit]"),
+    ("mode_final_key_length","Mode usable key length","usable key length [bit]"),
+]
+
+# Panels of the secret key rate figures, see key_rate.key_rate_columns
+KEY_RATE_PANELS = [
+    ("asymptotic_key_rate","Asymptotic secret key rate","secret key rate [bit/pulse]"),
+    ("finite_key_rate","Finite-size secret key rate","secret key rate [bit/pulse]"),
+    ("decoy_key_rate","Decoy-state secret key rate","secret key rate [bit/pulse]"),
+    ("finite_key_length","Finite-size secret key length","secret key length [bit]"),
+]
+
+# Panel sets a dataset can be drawn with, and the prefix added to the figure names of the spec
+PANEL_SETS = {
+    "simulation" : (PANELS,""),
+    "key_rate" : (KEY_RATE_PANELS,"key_rate_"),
+    "adaptive" : (PANELS,"adaptive_"),
+}
+
+
+def _config_values(values,config: dict):
+    """
+    Returns a list given either directly or as the name of a CONFIG entry
+    """
+    return list(config[values]) if isinstance(values,str) else list(values)
+
+def expand_series(spec: dict,config: dict):
+    """
+    Returns:
+        series: list of dicts holding the axes set by every series, its "label" and "style"
+    """
+    series = []
+    for entry in spec["series"]:
+        fixed = {key:value for key,value in entry.items()
+                 if key not in ("expand","label","labels","style","styles")}
+        if "expand" not in entry:
+            series.append(dict(fixed,label=entry.get("label",""),style=entry.get("style",{})))
+            continue
+        axis,values = entry["expand"]
+        for value in _config_values(values,config):
+            item = dict(fixed,**{axis:value})
+            if "labels" in entry:
+                item["label"] = entry["labels"][value]
+            else:
+                item["label"] = entry.get("label","{" + axis + "}").format(**item)
+            item["style"] = entry.get("styles",{}).get(value,entry.get("style",{}))
+            series.append(item)
+    return series
+
+def build_grid(spec: dict,config: dict,task_options: dict = None):
+    """
+    Expands a sweep spec into its grid points, ordered by key length, series and x value
+
+    Args:
+        spec: dict, one of SWEEP_SPECS
+        config: dict holding "key_lengths", "number_of_iterations_per_simulation" and the
+                entries referenced by the spec
+        task_options: dict of further keyword arguments of create_task, e.g. early stopping
+    Returns:
+        (tasks, rows): lists of the dicts created by create_task and of the config axes of every
+                       grid point, which become the columns of the sweep dataset
+    """
+    task_options = task_options or {}
+    x_values = _config_values(spec["x_values"],config)
+    tasks = []
+    rows = []
+    for key_length in config["key_lengths"]:
+        for series_index,series in enumerate(expand_series(spec,config)):
+            for x_value in x_values:
+                axes = dict(AXIS_DEFAULTS)
+                axes.update({key:value for key,value in series.items() if key in AXIS_DEFAULTS})
+                axes.update({axis:x_value for axis in spec["x_axes"]})
+                alice_config = Simulation.create_configuration_dict(emitter_efficiency=axes["alice_emitter_efficiency"])
+                bob_config = Simulation.create_configuration_dict(detector_efficiency=axes["bob_detector_efficiency"])
+                eve_config = Simulation.create_configuration_dict(axes["eve_emitter_efficiency"],
+                                                                  axes["eve_detector_efficiency"],
+                                                                  axes["eve_exists"])
+                tasks.append(create_task(key_length,alice_config,bob_config,eve_config,axes["tactic"],
+                                         config["number_of_iterations_per_simulation"],**task_options))
+                rows.append(dict(axes,key_length=key_length,x=x_value,series=series_index,
+                                 label=series["label"]))
+    return tasks,rows
@@ -0,0 +1,39 @@
+"""
+Compares the FFT Toeplitz hashing with a dense matrix product over GF(2)
+"""
+import numpy as np
+import pytest
+from privacy_amplification import toeplitz_hash
+
+
+def dense_toeplitz_hash(bits: np.ndarray,output_length: int,seed_bits: np.ndarray):
+    """
+    (T @ bits) % 2 with the Toeplitz matrix T[i, j] = seed_bits[i - j + n - 1]
+    """
+    number_of_bits = len(bits)
+    i,j = np.indices((output_length,number_of_bits))
+    matrix = seed_bits[i - j + number_of_bits - 1].astype(np.int64)
+    return ((matrix @ bits.astype(np.int64)) % 2).astype(np.uint8)
+
+
+# Seed lengths n + m - 1 on, just below and well away from powers of two
+@pytest.mark.parametrize("number_of_bits,output_length",[
+    (1,1),(2,1),(5,3),(8,1),(8,9),(17,9),(33,32),(64,1),(64,64),(100,37),(257,100),(1000,999),
+])
+def test_toeplitz_hash_matches_dense_product(number_of_bits,output_length):
+    rng = np.random.default_rng(number_of_bits * 1000 + output_length)
+    for _ in range(5):
+        bits = rng.integers(0,2,number_of_bits,dtype=np.uint8)
+        seed_bits = rng.integers(0,2,number_of_bits + output_length - 1,dtype=np.uint8)
+        np.testing.assert_array_equal(toeplitz_hash(bits,output_length,seed_bits),
+                                      dense_toeplitz_hash(bits,output_length,seed_bits))
+
+def test_toeplitz_hash_of_all_ones():
+    # Every window of the convolution then sums n ones, its largest possible values
+    bits = np.ones(300,dtype=np.uint8)
+    seed_bits = np.ones(300 + 50 - 1,dtype=np.uint8)
+    np.testing.assert_array_equal(toeplitz_hash(bits,50,seed_bits),dense_toeplitz_hash(bits,50,seed_bits))
+
+def test_toeplitz_hash_needs_n_plus_m_minus_1_seed_bits():
+    with pytest.raises(ValueError):
+        toeplitz_hash(np.ones(8,dtype=np.uint8),4,np.ones(8,dtype=np.uint8))
@@ -0,0 +1,40 @@
+"""
+Reconciles keys with a known error rate and checks that Bob ends up with Alice's key
+"""
+import numpy as np
+import pytest
+from reconciliation import reconcile
+
+
+def noisy_keys(key_length: int,error_rate: float,seed: int = 0):
+    """
+    Returns:
+        (alice_key, bob_key): uint8 arrays differing in exactly round(error_rate * key_length) bits
+    """
+    rng = np.random.default_rng(seed)
+    alice_key = rng.integers(0,2,key_length,dtype=np.uint8)
+    bob_key = alice_key.copy()
+    errors = rng.choice(key_length,round(error_rate * key_length),replace=False)
+    bob_key[errors] ^= 1
+    return alice_key,bob_key
+
+
+@pytest.mark.parametrize("method,key_length,frame_size,error_rate",[
+    ("cascade",20000,8192,0.01),
+    ("cascade",20000,8192,0.05),
+    ("ldpc",8192,4096,0.01),
+    ("ldpc",8192,4096,0.03),
+])
+def test_reconciled_key_matches_alice(method,key_length,frame_size,error_rate):
+    alice_key,bob_key = noisy_keys(key_length,error_rate)
+    results_dict = reconcile(alice_key,bob_key,error_rate,method,frame_size,max_workers=1,seed=1)
+    assert results_dict["failed_frames"] == 0
+    assert results_dict["residual_errors"] == 0
+    assert results_dict["reconciled_key_length"] == key_length
+    np.testing.assert_array_equal(results_dict["reconciled_key"],alice_key)
+    assert results_dict["efficiency"] >= 1.0
+
+def test_error_free_keys_are_kept():
+    alice_key,bob_key = noisy_keys(5000,0.0)
+    results_dict = reconcile(alice_key,bob_key,0.0,"cascade",max_workers=1,seed=1)
+    np.testing.assert_array_equal(results_dict["reconciled_key"],alice_key)
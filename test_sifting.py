@@ -0,0 +1,70 @@
+"""
+Compares the bit packed sifting kernel with the original str based Simulation.qber
+"""
+import numpy as np
+import pytest
+from sifting import batch_counts,bits_to_str,qber
+
+
+def string_qber(alice_key: str,alice_base: str,bob_key: str,bob_base: str):
+    """
+    The str based sifting Simulation.qber used before the packed kernel
+    """
+    alice_key_filtered = ""
+    bob_key_filtered = ""
+    final_key = ""
+    good_bits = 0
+    for i in range(len(alice_key)):
+        if alice_base[i] == bob_base[i]:
+            alice_key_filtered += alice_key[i]
+            bob_key_filtered += bob_key[i]
+            if alice_key[i] == bob_key[i]:
+                good_bits +=1
+                final_key += alice_key[i]
+    if good_bits == 0:
+        error_rate = 100
+    else:
+        error_rate = (1 - (good_bits / len(alice_key_filtered))) * 100.0
+    results_dict = {
+        "final_key" : final_key,
+        "error_rate" : error_rate,
+        "alice_key_same_bases" : alice_key_filtered,
+        "bob_key_same_bases" : bob_key_filtered
+    }
+    return results_dict
+
+def random_exchange(rng: np.random.Generator,key_length: int,error_probability: float = 0.1):
+    """
+    Returns:
+        (alice_key, alice_base, bob_key, bob_base): uint8 arrays of 0s and 1s
+    """
+    alice_key = rng.integers(0,2,key_length,dtype=np.uint8)
+    alice_base = rng.integers(0,2,key_length,dtype=np.uint8)
+    bob_base = rng.integers(0,2,key_length,dtype=np.uint8)
+    flips = (rng.random(key_length) < error_probability).astype(np.uint8)
+    return alice_key,alice_base,alice_key ^ flips,bob_base
+
+
+@pytest.mark.parametrize("key_length",[0,1,63,64,65,1000])
+def test_qber_matches_string_sifting(key_length):
+    rng = np.random.default_rng(key_length)
+    for _ in range(20):
+        bits = random_exchange(rng,key_length)
+        expected = string_qber(*[bits_to_str(array) for array in bits])
+        results_dict = qber(*bits)
+        assert results_dict["error_rate"] == pytest.approx(expected["error_rate"])
+        assert results_dict["sifted_key_length"] == len(expected["alice_key_same_bases"])
+        assert results_dict["final_key_length"] == len(expected["final_key"])
+        for field in ("final_key","alice_key_same_bases","bob_key_same_bases"):
+            assert results_dict[field] == expected[field]
+
+@pytest.mark.parametrize("key_length",[0,1,63,64,65,1000])
+def test_batch_counts_match_string_sifting(key_length):
+    rng = np.random.default_rng(key_length)
+    trials = [random_exchange(rng,key_length,0.25) for _ in range(8)]
+    matrices = [np.array([trial[i] for trial in trials]).reshape(len(trials),key_length) for i in range(4)]
+    sifted_key_length,final_key_length = batch_counts(*matrices)
+    for i,trial in enumerate(trials):
+        expected = string_qber(*[bits_to_str(array) for array in trial])
+        assert sifted_key_length[i] == len(expected["alice_key_same_bases"])
+        assert final_key_length[i] == len(expected["final_key"])
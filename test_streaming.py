@@ -0,0 +1,47 @@
+"""
+Round trips of key bits through the sinks of the streaming simulation
+"""
+import numpy as np
+import pytest
+from streaming import MemmapKeyFile,RingBuffer,load_key
+
+
+def random_blocks(sizes: list,seed: int = 0):
+    """
+    Returns:
+        blocks: list of uint8 arrays of 0s and 1s of the given sizes
+    """
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0,2,size,dtype=np.uint8) for size in sizes]
+
+
+@pytest.mark.parametrize("sizes",[[3,13,8,1],[8,8],[1] * 17,[0,5,0,64,7],[100,3,1000,29]])
+def test_memmap_key_file_round_trip(tmp_path,sizes):
+    blocks = random_blocks(sizes)
+    path = str(tmp_path / "key.bin")
+    with MemmapKeyFile(path,sum(sizes) + 11) as key_file:
+        for block in blocks:
+            key_file.write(block)
+    number_of_bits = key_file.number_of_bits
+    assert number_of_bits == sum(sizes)
+    words,number_of_bits = load_key(path,number_of_bits)
+    assert len(words) == -(-sum(sizes) // 8)
+    np.testing.assert_array_equal(np.unpackbits(words)[:number_of_bits],np.concatenate(blocks))
+
+def test_memmap_key_file_is_full(tmp_path):
+    with MemmapKeyFile(str(tmp_path / "key.bin"),10) as key_file:
+        key_file.write(np.ones(6,dtype=np.uint8))
+        with pytest.raises(ValueError):
+            key_file.write(np.ones(5,dtype=np.uint8))
+
+@pytest.mark.parametrize("sizes",[[3,13,8,1],[2,3],[10],[25],[7,30,1,4],[0,11,0,9,100]])
+def test_ring_buffer_keeps_last_bits(sizes):
+    capacity = 10
+    blocks = random_blocks(sizes,seed=len(sizes))
+    ring_buffer = RingBuffer(capacity)
+    written = np.zeros(0,dtype=np.uint8)
+    for block in blocks:
+        ring_buffer.write(block)
+        written = np.concatenate((written,block))
+        np.testing.assert_array_equal(ring_buffer.bits(),written[-capacity:])
+    assert ring_buffer.number_of_bits == sum(sizes)
@@ -0,0 +1,172 @@
+"""
+This module contains the array backed BB84 engine: class Beam and class VectorHuman
+"""
+import numpy as np
+import instrumentation
+from malfunction import malfunction_mask
+from randomness import RandomnessBackend,default_backend
+from sifting import batch_counts,error_rate_from_counts,qber
+
+
+class Beam():
+    """
+    Photon beam stored as two uint8 arrays, one for the bases and one for the values.
+    Index i of both arrays describes the same photon as Photon(base[i],value[i]) would.
+    Both arrays are read-only views, so a beam can be received by several nodes without any of
+    them changing what the others see; use copy for a writable beam.
+    """
+    def __init__(self,base: np.ndarray,value: np.ndarray):
+        if len(base) != len(value):
+            raise ValueError("Base and value arrays have to be of the same length")
+        self.base = np.asarray(base,dtype=np.uint8).view()
+        self.value = np.asarray(value,dtype=np.uint8).view()
+        self.base.flags.writeable = False
+        self.value.flags.writeable = False
+    def __len__(self):
+        return len(self.base)
+    def copy(self):
+        """
+        Returns a writable Beam which doesn't share memory with this one
+        """
+        beam = Beam.__new__(Beam)
+        beam.base = self.base.copy()
+        beam.value = self.value.copy()
+        return beam
+
+
+class VectorHuman():
+    """
+    Array backed equivalent of Human, every stage of send / receive is a single array operation.
+    Keys and bases are uint8 arrays instead of str. When number_of_trials is given every array
+    gets a leading trial axis, so that many independent runs are simulated at once.
+    """
+    def __init__(self,
+                key_length: int = 1,
+                emitter_efficiency: float = 100.0,
+                detector_efficiency: float = 100.0,
+                rng: RandomnessBackend = None,
+                number_of_trials: int = None):
+        self.key_length = key_length
+        self.number_of_trials = number_of_trials
+        self.emitter_efficiency = emitter_efficiency
+        self.detector_efficiency = detector_efficiency
+        self.base = None
+        self.key = None
+        self.rng = rng if rng is not None else default_backend()
+    @instrumentation.timed("VectorHuman.receive")
+    def receive(self,photon_beam: Beam):
+        """
+        Simulation of the photon beam measurement procedure.
+
+        Args:
+            photon_beam: Beam to be measured, it's left unchanged
+        """
+        shape = photon_beam.base.shape
+        if self.base is None or self.base.shape != shape:
+            self.base = self.random_bits(shape)
+        base,value = self.apply_malfunction(photon_beam.base,photon_beam.value,
+                                            100 - self.detector_efficiency)
+        # If the bases are different, value is randomized
+        mismatch = base != self.base
+        key = value.copy()
+        key[mismatch] = self.random_bits(int(np.count_nonzero(mismatch)))
+        self.key = key
+        self.key_length = shape[-1]
+        instrumentation.count("photons_detected",key.size)
+    @instrumentation.timed("VectorHuman.send")
+    def send(self):
+        """
+        Simulation of the photon beam generation procedure.
+
+        Returns:
+            photon_beam: Beam holding the emitted photons
+        """
+        shape = (self.key_length,)
+        if self.number_of_trials is not None:
+            shape = (self.number_of_trials,self.key_length)
+        if self.key is None:
+            self.key = self.random_bits(shape)
+        if self.base is None:
+            self.base = self.random_bits(shape)
+        base,value = self.apply_malfunction(self.base,self.key,100 - self.emitter_efficiency)
+        instrumentation.count("photons_emitted",base.size)
+        return Beam(base,value)
+    def apply_malfunction(self,base: np.ndarray,value: np.ndarray,chance_of_malfunction: float):
+        """
+        Flips either the value or the base of every photon for which the device malfunctioned
+
+        Args:
+            base: uint8 array of photon bases
+            value: uint8 array of photon values
+            chance_of_malfunction: float between 0-100 equal to the chance of device malfunctioning
+        Returns:
+            (base, value): new uint8 arrays with the malfunctions applied
+        """
+        malfunction,flip_value = malfunction_mask(self.rng,chance_of_malfunction,base.shape)
+        if instrumentation.enabled():
+            instrumentation.count("malfunctions",int(np.count_nonzero(malfunction)))
+        # Device failed, the mask decided whether it changed the base or the value of the photon
+        flip_base = malfunction & ~flip_value
+        return base ^ flip_base.astype(np.uint8),value ^ flip_value.astype(np.uint8)
+    def device_malfunction(self,chance_of_malfunction: float,shape):
+        """
+        Array version of Human.device_malfunction at full floating point precision
+
+        Args:
+            chance_of_malfunction: float between 0-100 equal to the chance of device malfunctioning
+            shape: int or tuple equal to the shape of the photon arrays
+        Returns:
+            malfunction: bool array where True means that the device malfunctioned
+        """
+        return malfunction_mask(self.rng,chance_of_malfunction,shape)[0]
+    def random_bits(self,shape):
+        """
+        Args:
+            shape: int or tuple equal to the shape of the output array
+        Returns:
+            bits: uint8 array of random bits
+        """
+        if instrumentation.enabled():
+            instrumentation.count("rng_calls")
+            instrumentation.count("rng_bits",int(np.prod(shape)))
+        return self.rng.random_bits(shape)
+
+
+def vector_qber(alice: VectorHuman,bob: VectorHuman,block_size: int = None):
+    """
+    Array version of Simulation.qber
+
+    Args:
+        alice: VectorHuman instance equivalent to BB84 Alice
+        bob: VectorHuman instance equivalent to BB84 Bob
+        block_size: int multiple of 64, when given the per-block error rates are returned as well
+    Returns:
+        results_dict: a dict with the same scheme as Simulation.qber returns
+    """
+    with instrumentation.stage("sifting"):
+        return qber(alice.key,alice.base,bob.key,bob.base,block_size)
+
+def batch_qber(alice: VectorHuman,bob: VectorHuman):
+    """
+    Trial-wise version of vector_qber for VectorHuman instances holding trial x bit matrices
+
+    Args:
+        alice: VectorHuman instance equivalent to BB84 Alice
+        bob: VectorHuman instance equivalent to BB84 Bob
+    Returns:
+        results_dict: a dict holding one value per trial
+                 scheme:
+                    {
+                    "error_rate" : float array,
+                    "sifted_key_length" : int array,
+                    "final_key_length" : int array
+                    }
+    """
+    with instrumentation.stage("sifting"):
+        sifted_key_length,final_key_length = batch_counts(alice.key,alice.base,bob.key,bob.base)
+    results_dict = {
+        "error_rate" : error_rate_from_counts(sifted_key_length,final_key_length),
+        "sifted_key_length" : sifted_key_length,
+        "final_key_length" : final_key_length
+    }
+    return results_dict